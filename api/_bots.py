@@ -0,0 +1,62 @@
+"""
+Detector de bots por User-Agent en una sola pasada
+Los patrones (subcadenas literales) se cargan de bot_patterns.txt y se compilan
+una única vez en una alternancia escapada; el match indica qué regla saltó
+"""
+
+import os
+import re
+
+BOT_PATTERNS_FILE = os.environ.get(
+    'BOT_PATTERNS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_patterns.txt')
+)
+
+
+def load_patterns(path: str) -> list:
+    """Lee el fichero de patrones: uno por línea, '#' para comentarios, sin duplicados"""
+    patterns = []
+    seen = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            pattern = line.strip().lower()
+            if not pattern or pattern.startswith('#') or pattern in seen:
+                continue
+            seen.add(pattern)
+            patterns.append(pattern)
+    return patterns
+
+
+class BotDetector:
+    """Clasificador de User-Agents compilado en un único regex"""
+
+    def __init__(self, patterns: list):
+        self.patterns = list(dict.fromkeys(p.lower() for p in patterns if p))
+        # Los más largos primero: en la misma posición gana la regla más específica
+        ordered = sorted(self.patterns, key=len, reverse=True)
+        self._regex = re.compile('|'.join(re.escape(p) for p in ordered)) if ordered else None
+
+    @classmethod
+    def from_file(cls, path: str = BOT_PATTERNS_FILE) -> 'BotDetector':
+        return cls(load_patterns(path))
+
+    def match(self, user_agent: str) -> str:
+        """Retorna la regla que coincide con el User-Agent, o None"""
+        if not user_agent or self._regex is None:
+            return None
+        m = self._regex.search(user_agent.lower())
+        return m.group(0) if m else None
+
+    def is_bot(self, user_agent: str) -> bool:
+        return self.match(user_agent) is not None
+
+
+_detector = None
+
+
+def get_detector() -> BotDetector:
+    """Detector compartido del proceso (se compila en el primer uso)"""
+    global _detector
+    if _detector is None:
+        _detector = BotDetector.from_file()
+    return _detector
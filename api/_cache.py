@@ -0,0 +1,84 @@
+"""
+Caché LRU en memoria con TTL para Vercel Serverless Functions
+Vive a nivel de módulo, así que sobrevive entre invocaciones "warm" de la misma instancia
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Centinela para distinguir "no está en caché" de un valor None cacheado
+MISSING = object()
+
+
+class LRUCache:
+    """LRU acotado con TTL por entrada y contadores de hits/misses"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=MISSING):
+        """Devuelve el valor cacheado o `default` si no existe o expiró"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """Guarda un valor; `ttl` sobreescribe el TTL por defecto (None = sin caducidad, <= 0 = no cachear)"""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is not None and ttl <= 0:
+            with self._lock:
+                self._data.pop(key, None)
+            return
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key) -> bool:
+        """Elimina una entrada. Retorna True si existía"""
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        """Vacía la caché (los contadores se mantienen)"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Contadores para diagnóstico"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
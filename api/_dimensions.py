@@ -0,0 +1,166 @@
+"""
+Codificación por diccionario de los campos repetitivos de events_raw (DIMENSIONS_ENABLED)
+
+user_agent, browser, os, idioma... se repiten casi idénticos en cada fila. Con el modo compacto cada
+valor se guarda una vez en dimension_values (sql/dimensions.sql) y la fila lleva `<campo>_id`. Los ids
+conocidos salen de una caché en memoria; los nuevos de todo un INSERT se registran juntos con una
+sola llamada a register_dimension_values. Los ids no cambian nunca, así que la caché no expira.
+"""
+
+import os
+import threading
+import time
+
+import _obs as obs
+from _cache import LRUCache, MISSING
+
+DIMENSIONS_ENABLED = os.environ.get('DIMENSIONS_ENABLED', '0') == '1'
+# Valores (campo, texto) con id conocido por instancia
+DIMENSIONS_CACHE_SIZE = int(os.environ.get('DIMENSIONS_CACHE_SIZE', '100000'))
+# Tras un registro fallido, segundos sin volver a intentarlo (las filas con valores nuevos van en texto)
+DIMENSIONS_RETRY_INTERVAL = float(os.environ.get('DIMENSIONS_RETRY_INTERVAL', '30'))
+
+DIMENSION_FIELDS = ('user_agent', 'browser', 'browser_version', 'os', 'os_version', 'device_type',
+                    'language', 'timezone', 'screen_resolution')
+
+
+def id_column(field: str) -> str:
+    return f'{field}_id'
+
+
+class DimensionEncoder:
+    """Filas de texto <-> filas con ids de dimension_values, con caché en ambos sentidos"""
+
+    def __init__(self, register_fn=None, resolve_fn=None, fields: tuple = DIMENSION_FIELDS,
+                 cache_size: int = DIMENSIONS_CACHE_SIZE, retry_interval: float = DIMENSIONS_RETRY_INTERVAL):
+        # register_fn([[campo, valor]]) -> {(campo, valor): id}; resolve_fn([id]) -> {id: (campo, valor)}
+        self.register_fn = register_fn
+        self.resolve_fn = resolve_fn
+        self.fields = tuple(fields)
+        self._field_set = frozenset(self.fields)
+        self._columns = [(field, id_column(field)) for field in self.fields]
+        self._ids = LRUCache(max_size=cache_size)
+        self._values = LRUCache(max_size=cache_size)
+        self._register_lock = threading.Lock()
+        self.retry_interval = retry_interval
+        self._retry_at = 0.0
+        self.registered = 0
+        self.register_calls = 0
+        self.register_failures = 0
+
+    def _remember(self, field: str, value: str, value_id: int):
+        self._ids.set((field, value), value_id)
+        self._values.set(value_id, (field, value))
+
+    def ids_for(self, pairs: set) -> dict:
+        """{(campo, valor): id}, registrando en una sola llamada los que no están en caché"""
+        found = {}
+        missing = []
+        for pair in pairs:
+            value_id = self._ids.get(pair)
+            if value_id is MISSING:
+                missing.append(pair)
+            else:
+                found[pair] = value_id
+        if not missing:
+            return found
+        if time.monotonic() < self._retry_at:
+            raise RuntimeError("dimension registration unavailable, retrying later")
+        # Un solo registro a la vez: peticiones concurrentes con los mismos valores nuevos esperan
+        # y encuentran los ids en caché en lugar de repetir la llamada
+        with self._register_lock:
+            pending = []
+            for pair in missing:
+                value_id = self._ids.get(pair)
+                if value_id is MISSING:
+                    pending.append(pair)
+                else:
+                    found[pair] = value_id
+            if pending:
+                self.register_calls += 1
+                try:
+                    registered = self.register_fn([list(pair) for pair in sorted(pending)])
+                    if any(pair not in registered for pair in pending):
+                        raise RuntimeError("register_dimension_values returned fewer ids than values")
+                except Exception:
+                    self.register_failures += 1
+                    self._retry_at = time.monotonic() + self.retry_interval
+                    raise
+                for pair in pending:
+                    value_id = registered[pair]
+                    self._remember(pair[0], pair[1], value_id)
+                    found[pair] = value_id
+                self.registered += len(pending)
+        return found
+
+    def encode(self, rows: list) -> list:
+        """Copias de las filas con `<campo>_id` en lugar del texto (None se queda en None)"""
+        pairs = set()
+        for field in self.fields:
+            pairs.update((field, value) for value in {row.get(field) for row in rows} if value is not None)
+        ids = self.ids_for(pairs)
+        fields = self._field_set
+        columns = self._columns
+        encoded = []
+        for row in rows:
+            compact = {key: value for key, value in row.items() if key not in fields}
+            for field, column in columns:
+                value = row.get(field)
+                compact[column] = None if value is None else ids[field, value]
+            encoded.append(compact)
+        return encoded
+
+    def decode(self, rows: list) -> list:
+        """Inverso de encode() para filas leídas de events_raw (las que ya traen texto no cambian)"""
+        columns = self._columns
+        wanted = {row[column] for row in rows for _, column in columns if row.get(column) is not None}
+        values = {}
+        missing = []
+        for value_id in wanted:
+            pair = self._values.get(value_id)
+            if pair is MISSING:
+                missing.append(value_id)
+            else:
+                values[value_id] = pair
+        if missing:
+            for value_id, pair in self.resolve_fn(sorted(missing)).items():
+                self._remember(pair[0], pair[1], value_id)
+                values[value_id] = pair
+        decoded = []
+        for row in rows:
+            plain = dict(row)
+            for field, column in columns:
+                value_id = plain.pop(column, None)
+                if plain.get(field) is None:
+                    pair = values.get(value_id)
+                    plain[field] = pair[1] if pair else None
+            decoded.append(plain)
+        return decoded
+
+    def stats(self) -> dict:
+        stats = self._ids.stats()
+        stats.update({'registered': self.registered, 'register_calls': self.register_calls,
+                      'register_failures': self.register_failures})
+        return stats
+
+
+def parse_registered(rows: list) -> dict:
+    """Respuesta de register_dimension_values ([{dimension, value, id}]) -> {(campo, valor): id}"""
+    return {(row['dimension'], row['value']): row['id'] for row in rows}
+
+
+def fetch_dimension_values(client, ids: list, chunk: int = 500) -> dict:
+    """{id: (campo, valor)} leyendo dimension_values por PostgREST (en trozos para no alargar la URL)"""
+    values = {}
+    for start in range(0, len(ids), chunk):
+        params = {
+            'select': 'id,dimension,value',
+            'id': 'in.(' + ','.join(str(value_id) for value_id in ids[start:start + chunk]) + ')'
+        }
+        response = client.select('dimension_values', params)
+        if response.status_code != 200:
+            raise RuntimeError(f"dimension_values returned {response.status_code}: {response.text}")
+        for row in response.json():
+            values[row['id']] = (row['dimension'], row['value'])
+    obs.debug("Dimension values fetched", ids=len(ids), found=len(values))
+    return values
@@ -0,0 +1,385 @@
+"""
+País y región a partir de la IP con una base de datos local de rangos, antes de anonimizarla
+
+La base se carga como tablas ordenadas de inicio/fin (IPv4: enteros de 32 bits; IPv6: los 64 bits
+altos, la granularidad de las asignaciones) más un índice a (país, región), y se busca con bisect:
+sin llamadas de red. IPv4 se busca con la dirección completa y se memoiza por /24 cuando todo el /24
+cae en un solo rango (o en ninguno), si no por dirección; IPv6 igual con el /64 y memo por /48 o /64.
+El fichero se recarga en segundo plano cuando cambia su mtime.
+
+Formatos de GEO_DB_PATH:
+- CSV (opcionalmente .gz): `inicio,fin,país[,región]` con IPs en texto o como enteros (DB-IP lite)
+- Compilado (cualquier otra extensión): tablas binarias que se leen con mmap, sin parseo.
+  `python api/_geo.py compile rangos.csv geo.bin [--region-column N]`
+"""
+
+import bisect
+import csv
+import gzip
+import json
+import mmap
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from array import array
+
+import _obs as obs
+from _cache import LRUCache, MISSING
+
+GEO_DB_PATH = os.environ.get('GEO_DB_PATH', '')
+GEO_CACHE_SIZE = int(os.environ.get('GEO_CACHE_SIZE', '16384'))
+# Segundos entre comprobaciones del mtime de GEO_DB_PATH (0 = sin recarga automática)
+GEO_RELOAD_INTERVAL = float(os.environ.get('GEO_RELOAD_INTERVAL', '60'))
+
+_MAGIC = b'AMGEO1\n\x00'
+_V4_MAPPED = 0xFFFF << 32
+# Códigos de "desconocido" habituales en las bases gratuitas
+_UNKNOWN_COUNTRIES = frozenset(('', '-', 'ZZ', 'XX'))
+# Memo de un /24 IPv4 o /48 IPv6 repartido entre varios rangos: se busca y memoiza cada dirección o /64
+_MIXED = object()
+
+
+def _parse_bound(value: str):
+    """'1.2.3.0' / '2001:db8::' / '16909056' -> (versión, entero); None si no es una IP"""
+    value = value.strip().strip('"')
+    if value.isdigit():
+        number = int(value)
+        if number <= 0xFFFFFFFF:
+            return 4, number
+        if number >> 32 == 0xFFFF:
+            return 4, number & 0xFFFFFFFF
+        return 6, number
+    try:
+        if ':' not in value:
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, value), 'big')
+        number = int.from_bytes(socket.inet_pton(socket.AF_INET6, value), 'big')
+    except OSError:
+        return None
+    if number >> 32 == 0xFFFF:
+        return 4, number & 0xFFFFFFFF
+    return 6, number
+
+
+class GeoDatabase:
+    """Tablas ordenadas por inicio de rango: starts/ends/location por familia + lista de ubicaciones"""
+
+    def __init__(self, locations: list, v4: tuple, v6: tuple, source: str = '', keep=None):
+        self.locations = locations
+        self.v4_starts, self.v4_ends, self.v4_locations = v4
+        self.v6_starts, self.v6_ends, self.v6_locations = v6
+        self.source = source
+        # Referencias que deben vivir mientras se usen las tablas (mmap)
+        self._keep = keep
+        self._cache = LRUCache(max_size=GEO_CACHE_SIZE)
+
+    @property
+    def ranges(self) -> int:
+        return len(self.v4_starts) + len(self.v6_starts)
+
+    def _find(self, starts, ends, locations, key: int):
+        index = bisect.bisect_right(starts, key) - 1
+        if index >= 0 and key <= ends[index]:
+            return self.locations[locations[index]]
+        return None
+
+    def lookup_v4(self, number: int):
+        return self._find(self.v4_starts, self.v4_ends, self.v4_locations, number)
+
+    def lookup_v6(self, top64: int):
+        return self._find(self.v6_starts, self.v6_ends, self.v6_locations, top64)
+
+    def _block(self, starts, ends, locations, low: int, high: int):
+        """Ubicación común a todo [low, high] (None si ningún rango lo toca), o _MIXED si no la hay"""
+        index = bisect.bisect_right(starts, high) - 1
+        if index < 0 or ends[index] < low:
+            return None
+        if starts[index] <= low and ends[index] >= high:
+            return self.locations[locations[index]]
+        return _MIXED
+
+    def _v4_block(self, prefix: int):
+        return self._block(self.v4_starts, self.v4_ends, self.v4_locations, prefix, prefix | 0xFF)
+
+    def _v6_block(self, top48: int):
+        low = top48 << 16
+        return self._block(self.v6_starts, self.v6_ends, self.v6_locations, low, low | 0xFFFF)
+
+    def lookup(self, ip: str):
+        """(país, región) de la IP (región puede ser None); None si no está en la base o no es una IP"""
+        if not ip or ip == 'unknown':
+            return None
+        if ':' not in ip:
+            # IPv4: clave por /24 con el texto
+            cut = ip.rfind('.')
+            key = ip[:cut]
+            result = self._cache.get(key)
+            if result is not MISSING and result is not _MIXED:
+                return result
+            parts = ip.split('.')
+            try:
+                a, b, c, d = int(parts[0]), int(parts[1]), int(parts[2]), int(parts[3])
+            except (ValueError, IndexError):
+                a = -1
+            if len(parts) != 4 or not (0 <= a <= 255 and 0 <= b <= 255 and 0 <= c <= 255 and 0 <= d <= 255):
+                self._cache.set(key, None)
+                return None
+            prefix = (a << 24) | (b << 16) | (c << 8)
+            if result is MISSING:
+                result = self._v4_block(prefix)
+                self._cache.set(key, result)
+                if result is not _MIXED:
+                    return result
+            # /24 repartido entre rangos: búsqueda y memo por dirección
+            result = self._cache.get(ip)
+            if result is MISSING:
+                result = self.lookup_v4(prefix | d)
+                self._cache.set(ip, result)
+            return result
+
+        # IPv6: clave por /48 con el texto si no hay '::' antes del tercer grupo
+        head = ip.split('::', 1)[0].split(':')
+        key = ':'.join(head[:3]).lower() if len(head) >= 3 else None
+        result = MISSING
+        if key is not None:
+            result = self._cache.get(key)
+            if result is not MISSING and result is not _MIXED:
+                return result
+        try:
+            number = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip.split('%', 1)[0]), 'big')
+        except OSError:
+            return None
+        if number >> 32 == 0xFFFF:
+            # IPv4 mapeada (::ffff:a.b.c.d)
+            return self.lookup('.'.join(str(number >> shift & 0xFF) for shift in (24, 16, 8, 0)))
+        if key is None:
+            key = '%x:%x:%x' % (number >> 112, number >> 96 & 0xFFFF, number >> 80 & 0xFFFF)
+            result = self._cache.get(key)
+            if result is not MISSING and result is not _MIXED:
+                return result
+        top64 = number >> 64
+        if result is MISSING:
+            result = self._v6_block(top64 >> 16)
+            self._cache.set(key, result)
+            if result is not _MIXED:
+                return result
+        # /48 repartido entre rangos: clave entera por /64 (no choca con las claves de texto)
+        result = self._cache.get(top64)
+        if result is MISSING:
+            result = self.lookup_v6(top64)
+            self._cache.set(top64, result)
+        return result
+
+    def cache_stats(self) -> dict:
+        return self._cache.stats()
+
+
+def _build(entries: list, source: str) -> GeoDatabase:
+    """entries: [(versión, inicio, fin, país, región)] -> tablas ordenadas"""
+    index = {}
+    locations = []
+    tables = {4: [], 6: []}
+    for version, start, end, country, region in entries:
+        location = (country, region or None)
+        code = index.get(location)
+        if code is None:
+            code = index[location] = len(locations)
+            locations.append(location)
+        if version == 6:
+            # Granularidad /64: nunca más fina que una asignación
+            start, end = start >> 64, end >> 64
+        tables[version].append((start, end, code))
+    v4 = sorted(tables[4])
+    v6 = sorted(tables[6])
+    return GeoDatabase(
+        locations,
+        (array('I', [r[0] for r in v4]), array('I', [r[1] for r in v4]), array('I', [r[2] for r in v4])),
+        (array('Q', [r[0] for r in v6]), array('Q', [r[1] for r in v6]), array('I', [r[2] for r in v6])),
+        source
+    )
+
+
+def read_csv(path: str, region_column: int = 3) -> list:
+    """Filas `inicio,fin,país[,...]`; se ignoran cabeceras, comentarios y rangos sin país"""
+    opener = gzip.open if path.endswith('.gz') else open
+    entries = []
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or row[0].startswith('#'):
+                continue
+            start, end = _parse_bound(row[0]), _parse_bound(row[1])
+            if start is None or end is None or start[0] != end[0]:
+                continue
+            country = row[2].strip().upper()
+            if country in _UNKNOWN_COUNTRIES or len(country) != 2:
+                continue
+            region = row[region_column].strip() if len(row) > region_column else ''
+            entries.append((start[0], start[1], end[1], country, region if region not in ('', '-') else None))
+    return entries
+
+
+def compile_database(entries: list, output: str):
+    """Escribe el formato compilado: cabecera JSON + tablas little-endian alineadas a 8 bytes"""
+    database = _build(entries, output)
+    header = json.dumps({'locations': database.locations, 'v4': len(database.v4_starts),
+                         'v6': len(database.v6_starts)}).encode('utf-8')
+    header += b' ' * (-(len(_MAGIC) + 8 + len(header)) % 8)
+    tables = [database.v4_starts, database.v4_ends, database.v4_locations,
+              database.v6_starts, database.v6_ends, database.v6_locations]
+    tmp = output + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for table in tables:
+            if sys.byteorder != 'little':
+                table = array(table.typecode, table)
+                table.byteswap()
+            f.write(table.tobytes())
+            f.write(b'\x00' * (-len(table.tobytes()) % 8))
+    # Sustitución atómica: los procesos con el fichero anterior en mmap no ven datos a medias
+    os.replace(tmp, output)
+
+
+def _load_compiled(path: str) -> GeoDatabase:
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[:len(_MAGIC)] != _MAGIC:
+        data.close()
+        raise ValueError(f"{path} is not a compiled geo database")
+    offset = len(_MAGIC)
+    (header_size,) = struct.unpack_from('<Q', data, offset)
+    offset += 8
+    header = json.loads(data[offset:offset + header_size])
+    offset += header_size
+    view = memoryview(data)
+
+    tables = []
+    for typecode, count in (('I', header['v4']), ('I', header['v4']), ('I', header['v4']),
+                            ('Q', header['v6']), ('Q', header['v6']), ('I', header['v6'])):
+        size = array(typecode).itemsize * count
+        chunk = view[offset:offset + size]
+        if sys.byteorder == 'little':
+            table = chunk.cast(typecode)
+        else:
+            table = array(typecode, chunk.tobytes())
+            table.byteswap()
+        tables.append(table)
+        offset += size + (-size % 8)
+    locations = [tuple(location) for location in header['locations']]
+    return GeoDatabase(locations, tuple(tables[:3]), tuple(tables[3:]), path, keep=(data, view))
+
+
+def load_database(path: str, region_column: int = 3) -> GeoDatabase:
+    if path.endswith('.csv') or path.endswith('.csv.gz'):
+        return _build(read_csv(path, region_column), path)
+    return _load_compiled(path)
+
+
+class GeoResolver:
+    """Base de datos actual + recarga en caliente cuando cambia el fichero"""
+
+    def __init__(self, path: str, reload_interval: float = GEO_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.database = None
+        self.reloads = 0
+        self.errors = 0
+        self._mtime = None
+        self._checked = 0.0
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def reload(self) -> bool:
+        """Carga el fichero y sustituye la base en uso (las búsquedas en curso terminan con la anterior)"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            start = time.perf_counter()
+            database = load_database(self.path)
+        except Exception as e:
+            self.errors += 1
+            obs.error("Geo database load failed", path=self.path, error=str(e))
+            return False
+        self.database = database
+        self._mtime = mtime
+        self.reloads += 1
+        obs.info("Geo database loaded", path=self.path, ranges=database.ranges,
+                 ms=round((time.perf_counter() - start) * 1000, 1))
+        return True
+
+    def _reload_in_background(self):
+        try:
+            self.reload()
+        finally:
+            self._loading = False
+
+    def maybe_reload(self):
+        if self.database is None and not self._checked:
+            # Primera carga síncrona (una vez por proceso); si falla se reintenta en segundo plano
+            # cada reload_interval, como una recarga más
+            with self._lock:
+                if self.database is None and not self._checked:
+                    self._checked = time.monotonic()
+                    self.reload()
+            return
+        if not self.reload_interval:
+            return
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval or self._loading:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self._loading = True
+            threading.Thread(target=self._reload_in_background, name='geo-reload', daemon=True).start()
+
+    def lookup(self, ip: str):
+        self.maybe_reload()
+        database = self.database
+        return database.lookup(ip) if database is not None else None
+
+    def stats(self) -> dict:
+        database = self.database
+        stats = database.cache_stats() if database is not None else {}
+        stats.update({'ranges': database.ranges if database is not None else 0,
+                      'reloads': self.reloads, 'load_errors': self.errors})
+        return stats
+
+
+_resolver = GeoResolver(GEO_DB_PATH) if GEO_DB_PATH else None
+
+
+def geo_enabled() -> bool:
+    return _resolver is not None
+
+
+def lookup_ip(ip: str):
+    """(país, región) de la IP cruda, o None (sin base, IP desconocida o fuera de rango)"""
+    if _resolver is None:
+        return None
+    try:
+        return _resolver.lookup(ip)
+    except Exception as e:
+        obs.error("Geo lookup error", error=str(e))
+        return None
+
+
+def get_geo_stats() -> dict:
+    return _resolver.stats() if _resolver is not None else {}
+
+
+if __name__ == '__main__':
+    # python api/_geo.py compile rangos.csv geo.bin [--region-column N]
+    if len(sys.argv) >= 4 and sys.argv[1] == 'compile':
+        column = int(sys.argv[sys.argv.index('--region-column') + 1]) if '--region-column' in sys.argv else 3
+        rows = read_csv(sys.argv[2], column)
+        compile_database(rows, sys.argv[3])
+        print(f"{len(rows)} ranges -> {sys.argv[3]}")
+    else:
+        print("usage: python api/_geo.py compile <ranges.csv[.gz]> <output.bin> [--region-column N]")
+        sys.exit(2)
@@ -0,0 +1,232 @@
+"""
+Observabilidad: logs estructurados con nivel y muestreo, timers por etapa
+(cabecera Server-Timing) y métricas en formato de texto de Prometheus
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# ============================================
+# LOGGING
+# ============================================
+
+LEVELS = {'debug': 10, 'info': 20, 'warn': 30, 'error': 40}
+
+LOG_LEVEL = LEVELS.get(os.environ.get('LOG_LEVEL', 'info').lower(), 20)
+# Fracción de logs debug/info que se emiten; warn y error nunca se muestrean
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1'))
+
+
+def log(level: str, message: str, **fields):
+    """Emite una línea JSON si el nivel está activo (y pasa el muestreo)"""
+    severity = LEVELS[level]
+    if severity < LOG_LEVEL:
+        return
+    if severity < LEVELS['warn'] and LOG_SAMPLE_RATE < 1 and random.random() >= LOG_SAMPLE_RATE:
+        return
+    record = {'level': level, 'msg': message}
+    record.update(fields)
+    sys.stdout.write(json.dumps(record, default=str) + '\n')
+
+
+def debug(message: str, **fields):
+    log('debug', message, **fields)
+
+
+def info(message: str, **fields):
+    log('info', message, **fields)
+
+
+def warn(message: str, **fields):
+    log('warn', message, **fields)
+
+
+def error(message: str, **fields):
+    log('error', message, **fields)
+
+
+# ============================================
+# MÉTRICAS
+# ============================================
+
+# Buckets de latencia en segundos (de 0.5 ms a 10 s)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Counter:
+    """Contador monotónico con etiquetas"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        # Copia bajo el lock: otro hilo puede añadir etiquetas durante el scrape
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+
+class Histogram:
+    """Histograma acumulativo con buckets fijos y etiquetas"""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # key -> [conteos por bucket..., +Inf], suma
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(key, (list(counts), total)) for key, (counts, total) in self._series.items()]
+        for key, (counts, total) in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(key, (("le", bound),))} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{_format_labels(key, (("le", "+Inf"),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas + gauges calculados al renderizar (p. ej. stats de cachés)"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def register_collector(self, fn):
+        """fn() -> lista de (nombre, help, tipo, {etiquetas}, valor), evaluada en cada scrape"""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        # Agrupar por nombre: el formato exige que cada familia sea contigua
+        families = {}
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                error("Metrics collector failed", error=str(e))
+                continue
+            for name, help_text, kind, labels, value in samples:
+                family = families.setdefault(name, [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'])
+                family.append(f'{name}{_format_labels(_label_key(labels))} {value}')
+        for family in families.values():
+            lines.extend(family)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+EVENTS_ACCEPTED = REGISTRY.counter('accumetrics_events_accepted_total', 'Eventos aceptados')
+EVENTS_REJECTED = REGISTRY.counter('accumetrics_events_rejected_total', 'Eventos rechazados por motivo')
+STAGE_DURATION = REGISTRY.histogram('accumetrics_stage_duration_seconds', 'Duración de cada etapa de /api/track')
+SUPABASE_DURATION = REGISTRY.histogram('accumetrics_supabase_request_duration_seconds',
+                                       'Latencia de las llamadas a Supabase (incluye reintentos)')
+
+
+def cache_collector(cache_name: str, stats_fn):
+    """Collector que expone hits/misses/tamaño de una caché a partir de su stats()"""
+    def collect():
+        stats = stats_fn() or {}
+        labels = {'cache': cache_name}
+        return [
+            ('accumetrics_cache_hits_total', 'Hits de caché en memoria', 'counter', labels, stats.get('hits', 0)),
+            ('accumetrics_cache_misses_total', 'Misses de caché en memoria', 'counter', labels, stats.get('misses', 0)),
+            ('accumetrics_cache_evictions_total', 'Expulsiones LRU', 'counter', labels, stats.get('evictions', 0)),
+            ('accumetrics_cache_size', 'Entradas en caché', 'gauge', labels, stats.get('size', 0)),
+        ]
+    return collect
+
+
+# ============================================
+# TIMERS POR ETAPA
+# ============================================
+
+class StageTimer:
+    """Mide la duración de cada etapa de una petición"""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.stages.append((name, seconds))
+        STAGE_DURATION.observe(seconds, stage=name)
+
+    def server_timing(self) -> str:
+        """Valor de la cabecera Server-Timing (duraciones en ms, etapas repetidas sumadas)"""
+        totals = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in totals.items())
@@ -0,0 +1,115 @@
+"""
+Verificación de Origin contra allowed_domains, compilada una vez por proyecto
+
+Reglas de cada entrada de allowed_domains (se ignoran esquema, puerto, ruta y punto final):
+- `*`               cualquier origen
+- `example.com`     example.com y sus subdominios (www.example.com), nunca `badexample.com`
+- `*.example.com`   solo subdominios de example.com
+"""
+
+import os
+from urllib.parse import urlsplit
+
+from _cache import LRUCache, MISSING
+
+ORIGIN_CACHE_SIZE = int(os.environ.get('ORIGIN_CACHE_SIZE', '4096'))
+
+# Marcas en los nodos del trie (las etiquetas DNS nunca contienen espacios)
+_INCLUDE_SELF = ' self'
+_SUBDOMAINS = ' sub'
+
+
+def normalize_host(value: str) -> str:
+    """'https://WWW.Example.com:443/x' -> 'www.example.com' ('' si no hay host)"""
+    value = (value or '').strip().lower()
+    if not value:
+        return ''
+    if '//' not in value:
+        value = '//' + value
+    try:
+        host = urlsplit(value).hostname or ''
+    except ValueError:
+        return ''
+    return host.rstrip('.')
+
+
+_origin_hosts = LRUCache(max_size=ORIGIN_CACHE_SIZE)
+
+
+def origin_host(origin: str) -> str:
+    """Host normalizado de una cabecera Origin (memoizado: hay pocos orígenes distintos)"""
+    host = _origin_hosts.get(origin)
+    if host is MISSING:
+        host = normalize_host(origin)
+        _origin_hosts.set(origin, host)
+    return host
+
+
+def get_origin_cache_stats() -> dict:
+    return _origin_hosts.stats()
+
+
+class OriginMatcher:
+    """Set de hosts exactos + trie de sufijos por etiquetas invertidas (com -> example -> www)"""
+
+    __slots__ = ('allow_all', 'exact', 'trie', 'size')
+
+    def __init__(self, allowed_domains):
+        self.allow_all = False
+        self.exact = set()
+        self.trie = {}
+        self.size = 0
+        for entry in allowed_domains or ():
+            self.add(entry)
+        # Lista vacía = sin restricción (comportamiento histórico)
+        if not self.size:
+            self.allow_all = True
+
+    def add(self, entry: str):
+        entry = (entry or '').strip().lower()
+        if not entry:
+            return
+        self.size += 1
+        if entry == '*':
+            self.allow_all = True
+            return
+        wildcard = entry.startswith('*.')
+        host = normalize_host(entry[2:] if wildcard else entry)
+        if not host:
+            return
+        node = self.trie
+        for label in reversed(host.split('.')):
+            node = node.setdefault(label, {})
+        if wildcard:
+            node[_SUBDOMAINS] = True
+        else:
+            node[_INCLUDE_SELF] = True
+            self.exact.add(host)
+
+    def match_host(self, host: str) -> bool:
+        if self.allow_all or host in self.exact:
+            return True
+        if not host or not self.trie:
+            return False
+        node = self.trie
+        labels = host.split('.')
+        for i in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[i])
+            if node is None:
+                return False
+            # Quedan etiquetas a la izquierda: host es subdominio de este nodo
+            if i and (_INCLUDE_SELF in node or _SUBDOMAINS in node):
+                return True
+        return False
+
+    def match(self, origin: str) -> bool:
+        """
+        ¿Está permitido este Origin?
+        Sin cabecera Origin (servidor a servidor) se acepta, como hacía la versión anterior
+        """
+        if self.allow_all or not origin:
+            return True
+        return self.match_host(origin_host(origin))
+
+
+ALLOW_ALL = OriginMatcher(())
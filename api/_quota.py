@@ -0,0 +1,278 @@
+"""
+Límite mensual de eventos por cliente y rate limit por tracking_code, sin consultas por evento
+
+Cada instancia lleva en memoria el uso del cliente (último total autoritativo de Supabase +
+eventos propios aún no sincronizados) y decide en O(1). allow() reserva el evento en el uso
+local antes del INSERT y release() lo devuelve si al final no se guarda, así que las peticiones
+concurrentes de una instancia nunca pasan del límite. Los incrementos se envían por lotes a la
+función SQL increment_client_usage (sql/client_usage.sql), que devuelve el total global y el
+límite vigente; la primera vez que se ve un cliente se consulta antes de decidir. El error
+sobre el límite son los eventos de otras instancias aún sin sincronizar (QUOTA_MAX_DRIFT cada una).
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import _obs as obs
+
+QUOTA_ENABLED = os.environ.get('QUOTA_ENABLED', '0') == '1'
+# Máximo de eventos sin sincronizar por cliente e instancia (cota de error sobre el límite)
+QUOTA_MAX_DRIFT = int(os.environ.get('QUOTA_MAX_DRIFT', '100'))
+# Segundos entre sincronizaciones aunque no se alcance QUOTA_MAX_DRIFT
+QUOTA_SYNC_INTERVAL = float(os.environ.get('QUOTA_SYNC_INTERVAL', '30'))
+
+# Token bucket por tracking_code (0 = desactivado)
+RATE_LIMIT_PER_SECOND = float(os.environ.get('RATE_LIMIT_PER_SECOND', '0'))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', str(max(1.0, RATE_LIMIT_PER_SECOND * 10))))
+
+
+def current_period() -> str:
+    """Primer día del mes actual (UTC), clave del periodo de facturación"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-01')
+
+
+def next_period_start() -> float:
+    """Epoch del primer día del mes siguiente (UTC): a partir de ahí cambia current_period()"""
+    now = datetime.now(timezone.utc)
+    year, month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+    return datetime(year, month, 1, tzinfo=timezone.utc).timestamp()
+
+
+class _ClientUsage:
+    __slots__ = ('limit', 'used', 'pending', 'in_flight', 'synced_at', 'known', 'retry_at')
+
+    def __init__(self):
+        self.limit = None      # None = sin límite
+        self.used = 0          # último total autoritativo (todas las instancias)
+        self.pending = 0       # eventos reservados aquí y aún no enviados
+        self.in_flight = 0     # eventos enviados en una sincronización en curso
+        self.synced_at = 0.0
+        self.known = False     # ya tenemos límite/uso de Supabase
+        self.retry_at = 0.0    # próxima sincronización síncrona tras un fallo
+
+
+class QuotaTracker:
+    """Uso mensual por client_id con reconciliación periódica por lotes"""
+
+    def __init__(self, sync_fn, max_drift: int = QUOTA_MAX_DRIFT,
+                 sync_interval: float = QUOTA_SYNC_INTERVAL):
+        # sync_fn(period, {client_id: incremento}) -> {client_id: (used, limit)}
+        self.sync_fn = sync_fn
+        self.max_drift = max(1, max_drift)
+        self.sync_interval = sync_interval
+        self.period = current_period()
+        self._period_end = next_period_start()
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.syncs = 0
+        self.sync_failures = 0
+        self.rejected = 0
+
+    def _usage(self, client_id: str) -> _ClientUsage:
+        usage = self._clients.get(client_id)
+        if usage is None:
+            usage = self._clients[client_id] = _ClientUsage()
+        return usage
+
+    def _drift_allowance(self, usage: _ClientUsage) -> int:
+        """Cerca del límite se sincroniza más a menudo: la holgura nunca supera lo que queda"""
+        if usage.limit is None:
+            return self.max_drift
+        remaining = usage.limit - usage.used
+        return max(1, min(self.max_drift, remaining // 2))
+
+    @staticmethod
+    def _at_limit(usage: _ClientUsage) -> bool:
+        return usage.limit is not None and usage.used + usage.pending + usage.in_flight >= usage.limit
+
+    def _stale(self, usage: _ClientUsage, now: float) -> bool:
+        """
+        ¿Hay que consultar Supabase antes de decidir? Cliente sin límite conocido, o bloqueado en su
+        límite con datos de hace más de sync_interval (puede haber cambiado de plan). Sin pendientes
+        la sincronización periódica no lo incluiría nunca
+        """
+        if not usage.known:
+            return True
+        return self._at_limit(usage) and now - usage.synced_at >= self.sync_interval
+
+    def _check_period(self):
+        """Cambio de mes: el uso vuelve a cero aunque no se haya sincronizado (los pendientes se pierden)"""
+        if time.time() < self._period_end:
+            return
+        with self._lock:
+            period = current_period()
+            if period != self.period:
+                self._clients = {}
+                self.period = period
+            self._period_end = next_period_start()
+
+    def _sync_client(self, client_id: str):
+        """
+        Sincronización síncrona antes de decidir sobre un cliente nuevo o bloqueado con datos viejos
+        Las peticiones concurrentes esperan a la primera; si Supabase falla se reintenta cada sync_interval
+        """
+        with self._lock:
+            usage = self._usage(client_id)
+        with self._sync_lock:
+            now = time.monotonic()
+            if now < usage.retry_at or not self._stale(usage, now):
+                return
+            if not self._sync_locked():
+                usage.retry_at = time.monotonic() + self.sync_interval
+
+    def allow(self, client_id: str) -> bool:
+        """
+        ¿Puede el cliente enviar otro evento este mes? Si sí, lo reserva en el uso local
+        El llamador debe devolverlo con release() si el evento no llega a guardarse
+        """
+        self._check_period()
+        usage = self._clients.get(client_id)
+        if usage is None:
+            self._sync_client(client_id)
+        else:
+            now = time.monotonic()
+            if now >= usage.retry_at and self._stale(usage, now):
+                self._sync_client(client_id)
+        with self._lock:
+            usage = self._usage(client_id)
+            # Sin límite o sin poder consultarlo (Supabase caído) se admite y se cuenta igual
+            if self._at_limit(usage):
+                self.rejected += 1
+                return False
+            usage.pending += 1
+            return True
+
+    def release(self, client_id: str, count: int = 1):
+        """Devuelve reservas de eventos que no se guardaron (INSERT fallido o duplicado)"""
+        with self._lock:
+            usage = self._clients.get(client_id)
+            if usage is not None:
+                usage.pending = max(0, usage.pending - count)
+
+    def needs_sync(self) -> bool:
+        if self.period != current_period():
+            return True
+        now = time.monotonic()
+        for usage in list(self._clients.values()):
+            if usage.pending and (not usage.known
+                                  or usage.pending >= self._drift_allowance(usage)
+                                  or now - usage.synced_at >= self.sync_interval):
+                return True
+            if usage.known and self._stale(usage, now):
+                return True
+        return False
+
+    def maybe_sync(self) -> bool:
+        """Sincroniza si algún cliente superó su holgura, es nuevo o lleva demasiado sin sincronizar"""
+        if not self.needs_sync():
+            return False
+        return self.sync()
+
+    def sync(self, wait: bool = False) -> bool:
+        """
+        Envía los incrementos pendientes en una sola llamada y actualiza los totales
+        wait=True espera a la sincronización en curso en lugar de saltársela
+        """
+        if not self._sync_lock.acquire(blocking=wait):
+            return False
+        try:
+            return self._sync_locked()
+        finally:
+            self._sync_lock.release()
+
+    def _sync_locked(self) -> bool:
+        """sync() con _sync_lock ya adquirido"""
+        period = current_period()
+        with self._lock:
+            if period != self.period:
+                # Cambio de mes: los pendientes del mes anterior se pierden (como mucho max_drift)
+                self._clients = {}
+                self.period = period
+                self._period_end = next_period_start()
+            now = time.monotonic()
+            increments = {}
+            for client_id, usage in self._clients.items():
+                # Los bloqueados se consultan con incremento 0 para ver si cambió su límite
+                if usage.pending or self._stale(usage, now):
+                    increments[client_id] = usage.pending
+                    usage.in_flight, usage.pending = usage.pending, 0
+        if not increments:
+            return True
+
+        try:
+            totals = self.sync_fn(period, increments)
+        except Exception as e:
+            obs.error("Quota sync failed", error=str(e))
+            totals = None
+
+        now = time.monotonic()
+        with self._lock:
+            for client_id, sent in increments.items():
+                usage = self._usage(client_id)
+                usage.in_flight = 0
+                if totals is None:
+                    # Reintentar en la próxima sincronización
+                    usage.pending += sent
+                    continue
+                used, limit = totals.get(client_id, (usage.used + sent, usage.limit))
+                usage.used = used
+                usage.limit = limit
+                usage.known = True
+                usage.synced_at = now
+
+        if totals is None:
+            self.sync_failures += 1
+            return False
+        self.syncs += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'period': self.period,
+            'clients': len(self._clients),
+            'pending_events': sum(u.pending for u in list(self._clients.values())),
+            'syncs': self.syncs,
+            'sync_failures': self.sync_failures,
+            'rejected': self.rejected
+        }
+
+
+class TokenBucketLimiter:
+    """Rate limit por clave (tracking_code): rate tokens/s con ráfagas de hasta burst"""
+
+    def __init__(self, rate: float = RATE_LIMIT_PER_SECOND, burst: float = RATE_LIMIT_BURST,
+                 max_keys: int = 10000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def allow(self, key: str, cost: float = 1.0) -> bool:
+        if not self.enabled:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    # Claves inactivas: un bucket lleno equivale a no tenerlo
+                    self._buckets = {k: b for k, b in self._buckets.items()
+                                     if b[0] + (now - b[1]) * self.rate < self.burst}
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now)
+                self.rejected += 1
+                return False
+            self._buckets[key] = (tokens - cost, now)
+            return True
@@ -0,0 +1,310 @@
+"""
+Agregados incrementales por proyecto y franja horaria (tabla events_rollup)
+
+Cada instancia acumula en memoria, por (project_id, bucket): eventos, pageviews, eventos custom por
+event_name, tráfico de bots, compras e ingresos por moneda, y sketches HyperLogLog de user_id y
+session_id. Se envían periódicamente a la función SQL merge_events_rollup (sql/events_rollup.sql), que
+suma los contadores y fusiona los sketches (máximo por registro): los parciales de instancias
+concurrentes se combinan sin contar dos veces a un mismo usuario.
+"""
+
+import base64
+import hashlib
+import heapq
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import _obs as obs
+
+ROLLUP_ENABLED = os.environ.get('ROLLUP_ENABLED', '0') == '1'
+# Tamaño de la franja en segundos (3600 = por hora; los días se obtienen fusionando horas)
+ROLLUP_BUCKET_SECONDS = int(os.environ.get('ROLLUP_BUCKET_SECONDS', '3600'))
+# Segundos entre envíos, o antes si se acumulan ROLLUP_MAX_PENDING eventos
+ROLLUP_FLUSH_INTERVAL = float(os.environ.get('ROLLUP_FLUSH_INTERVAL', '60'))
+ROLLUP_MAX_PENDING = int(os.environ.get('ROLLUP_MAX_PENDING', '5000'))
+# Franjas retenidas en memoria (se descartan las más antiguas); con la mitad ya se fuerza un envío
+ROLLUP_MAX_BUCKETS = int(os.environ.get('ROLLUP_MAX_BUCKETS', '1000'))
+# Franjas por llamada a merge_events_rollup (cada una lleva dos sketches de 4 KB)
+ROLLUP_FLUSH_CHUNK = int(os.environ.get('ROLLUP_FLUSH_CHUNK', '100'))
+
+# 2^12 registros de 1 byte: 4 KB por sketch, error típico 1.04/sqrt(4096) ~ 1.6%.
+# Fijo: sketches con distinta precisión no se pueden fusionar
+HLL_PRECISION = 12
+
+# 9999-12-31T23:59:59Z, última fecha que datetime puede representar
+_MAX_EPOCH = 253402300799
+
+
+class HyperLogLog:
+    """Estimador de cardinalidad con hash de 64 bits (blake2b, estable entre instancias)"""
+
+    __slots__ = ('p', 'm', 'registers')
+
+    _ALPHA = {16: 0.673, 32: 0.697, 64: 0.709}
+    _INVERSE_POWERS = [2.0 ** -r for r in range(65)]
+
+    def __init__(self, p: int = HLL_PRECISION, registers: bytes = None):
+        self.p = p
+        self.m = 1 << p
+        if registers is None:
+            self.registers = bytearray(self.m)
+        else:
+            if len(registers) != self.m:
+                raise ValueError(f"HyperLogLog expects {self.m} registers, got {len(registers)}")
+            self.registers = bytearray(registers)
+
+    def add(self, value: str):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+        x = int.from_bytes(digest, 'big')
+        bits = 64 - self.p
+        index = x >> bits
+        # Posición del primer 1 en los bits restantes (bits + 1 si son todos 0)
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        """Unión in situ: máximo registro a registro"""
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+        mine = self.registers
+        for i, rank in enumerate(other.registers):
+            if rank > mine[i]:
+                mine[i] = rank
+
+    def count(self) -> int:
+        m = self.m
+        alpha = self._ALPHA.get(m, 0.7213 / (1 + 1.079 / m))
+        inverse = self._INVERSE_POWERS
+        total = 0.0
+        zeros = 0
+        for rank in self.registers:
+            total += inverse[rank]
+            if not rank:
+                zeros += 1
+        estimate = alpha * m * m / total
+        # Corrección para cardinalidades pequeñas (linear counting)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def is_empty(self) -> bool:
+        return not any(self.registers)
+
+    def to_base64(self) -> str:
+        return base64.b64encode(bytes(self.registers)).decode('ascii')
+
+    @classmethod
+    def from_base64(cls, value: str) -> 'HyperLogLog':
+        return cls(registers=base64.b64decode(value))
+
+
+class RollupBucket:
+    """Contadores de un proyecto en una franja"""
+
+    __slots__ = ('events', 'pageviews', 'bot_events', 'purchases', 'revenue', 'event_names',
+                 'users', 'sessions')
+
+    def __init__(self):
+        self.events = 0
+        self.pageviews = 0
+        self.bot_events = 0
+        self.purchases = 0
+        self.revenue = {}        # moneda -> suma de ecommerce_data.value
+        self.event_names = {}    # event_name -> eventos custom
+        self.users = HyperLogLog()
+        self.sessions = HyperLogLog()
+
+    def add(self, record: dict):
+        self.events += 1
+        if record.get('is_bot'):
+            self.bot_events += 1
+        if record.get('event_type') == 'pageview':
+            self.pageviews += 1
+        else:
+            name = record.get('event_name') or ''
+            self.event_names[name] = self.event_names.get(name, 0) + 1
+        ecommerce = record.get('ecommerce_data')
+        if ecommerce and ecommerce.__class__ is dict and 'value' in ecommerce:
+            self.purchases += 1
+            currency = str(ecommerce.get('currency') or '').upper()
+            self.revenue[currency] = self.revenue.get(currency, 0) + ecommerce['value']
+        self.users.add(str(record['user_id']))
+        self.sessions.add(str(record['session_id']))
+
+    def merge(self, other: 'RollupBucket'):
+        self.events += other.events
+        self.pageviews += other.pageviews
+        self.bot_events += other.bot_events
+        self.purchases += other.purchases
+        for currency, value in other.revenue.items():
+            self.revenue[currency] = self.revenue.get(currency, 0) + value
+        for name, count in other.event_names.items():
+            self.event_names[name] = self.event_names.get(name, 0) + count
+        self.users.merge(other.users)
+        self.sessions.merge(other.sessions)
+
+    def to_row(self, project_id: str, bucket: int) -> dict:
+        return {
+            'project_id': project_id,
+            'bucket': datetime.fromtimestamp(bucket, timezone.utc).isoformat(),
+            'events': self.events,
+            'pageviews': self.pageviews,
+            'bot_events': self.bot_events,
+            'purchases': self.purchases,
+            'revenue': self.revenue,
+            'event_names': self.event_names,
+            'users_hll': self.users.to_base64(),
+            'sessions_hll': self.sessions.to_base64()
+        }
+
+
+def _parse_epoch(value):
+    """
+    Segundos UNIX de un timestamp ISO 8601 (sin zona = UTC) o numérico (s o ms); None si no se entiende
+    o cae fuera de 1970-9999 (la franja no se podría convertir a fecha en to_row)
+    """
+    if value.__class__ is str:
+        try:
+            parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        epoch = parsed.timestamp()
+    elif value.__class__ in (int, float) and math.isfinite(value):
+        epoch = value / 1000 if value > 1e11 else value
+    else:
+        return None
+    return epoch if 0 <= epoch <= _MAX_EPOCH else None
+
+
+class RollupAggregator:
+    """Agregados por (project_id, franja) pendientes de enviar; add() y flush() son thread-safe"""
+
+    def __init__(self, flush_fn, bucket_seconds: int = ROLLUP_BUCKET_SECONDS,
+                 flush_interval: float = ROLLUP_FLUSH_INTERVAL, max_pending: int = ROLLUP_MAX_PENDING,
+                 max_buckets: int = ROLLUP_MAX_BUCKETS, flush_chunk: int = ROLLUP_FLUSH_CHUNK):
+        # flush_fn([fila, ...]) envía las filas de to_row(); lanza excepción si falla
+        self.flush_fn = flush_fn
+        self.bucket_seconds = max(1, bucket_seconds)
+        self.flush_interval = flush_interval
+        self.max_pending = max(1, max_pending)
+        self.max_buckets = max(1, max_buckets)
+        self.flush_chunk = max(1, flush_chunk)
+        self._buckets = {}
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.flushes = 0
+        self.flush_failures = 0
+        self.dropped_buckets = 0
+
+    def bucket_of(self, record: dict, now: float) -> int:
+        """Franja del evento según su timestamp; processed_at (o ahora) si falta, no se entiende o es futuro"""
+        epoch = _parse_epoch(record.get('timestamp'))
+        if epoch is None or epoch > now + self.bucket_seconds:
+            epoch = _parse_epoch(record.get('processed_at')) or now
+        epoch = int(epoch)
+        return epoch - epoch % self.bucket_seconds
+
+    def add(self, records: list):
+        now = time.time()
+        with self._lock:
+            buckets = self._buckets
+            for record in records:
+                key = (str(record['project_id']), self.bucket_of(record, now))
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = RollupBucket()
+                bucket.add(record)
+            self._pending += len(records)
+            self._drop_overflow()
+
+    def _drop_overflow(self):
+        """Con _lock: descarta las franjas más antiguas por encima de max_buckets"""
+        overflow = len(self._buckets) - self.max_buckets
+        if overflow <= 0:
+            return
+        for key in heapq.nsmallest(overflow, self._buckets, key=lambda k: k[1]):
+            del self._buckets[key]
+        self.dropped_buckets += overflow
+        obs.warn("Rollup buckets dropped", count=overflow)
+
+    def needs_flush(self) -> bool:
+        if not self._buckets:
+            return False
+        # Timestamps muy dispersos crean muchas franjas con pocos eventos: enviarlas antes de llegar al tope
+        return (self._pending >= self.max_pending
+                or len(self._buckets) * 2 >= self.max_buckets
+                or time.monotonic() - self._last_flush >= self.flush_interval)
+
+    def maybe_flush(self) -> bool:
+        if not self.needs_flush():
+            return False
+        return self.flush()
+
+    def flush(self) -> bool:
+        """
+        Envía las franjas pendientes en llamadas de como mucho flush_chunk filas
+        Si una falla, esa y las siguientes se reincorporan (las ya enviadas no se repiten)
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                buckets, self._buckets = self._buckets, {}
+                pending, self._pending = self._pending, 0
+                self._last_flush = time.monotonic()
+            if not buckets:
+                return True
+
+            keys = list(buckets)
+            for offset in range(0, len(keys), self.flush_chunk):
+                rows = []
+                for key in keys[offset:offset + self.flush_chunk]:
+                    try:
+                        rows.append(buckets[key].to_row(*key))
+                    except Exception as e:
+                        # Una franja que no se puede serializar fallaría en todos los envíos: se descarta
+                        obs.error("Rollup bucket dropped", error=str(e), project_id=key[0], bucket=key[1])
+                        self.dropped_buckets += 1
+                try:
+                    if rows:
+                        self.flush_fn(rows)
+                except Exception as e:
+                    unsent = {key: buckets[key] for key in keys[offset:]}
+                    obs.error("Rollup flush failed", error=str(e), buckets=len(unsent))
+                    self.flush_failures += 1
+                    # Los eventos pendientes no se reparten por franja: se reincorporan en proporción
+                    self._restore(unsent, pending * len(unsent) // len(keys))
+                    return False
+            self.flushes += 1
+            return True
+        finally:
+            self._flush_lock.release()
+
+    def _restore(self, buckets: dict, pending: int):
+        """Reincorpora franjas no enviadas (contadores sumables, sketches fusionables)"""
+        with self._lock:
+            for key, bucket in buckets.items():
+                current = self._buckets.get(key)
+                if current is None:
+                    self._buckets[key] = bucket
+                else:
+                    current.merge(bucket)
+            self._pending += pending
+            self._drop_overflow()
+
+    def stats(self) -> dict:
+        return {
+            'buckets': len(self._buckets),
+            'pending_events': self._pending,
+            'flushes': self.flushes,
+            'flush_failures': self.flush_failures,
+            'dropped_buckets': self.dropped_buckets
+        }
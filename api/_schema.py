@@ -0,0 +1,338 @@
+"""
+Esquema declarativo de los eventos de /api/track, compilado una vez en un validador
+que comprueba, normaliza y construye los campos del registro de events_raw en una sola pasada
+"""
+
+import json
+import math
+import os
+
+# Límites de tamaño
+MAX_STRING_LENGTH = int(os.environ.get('SCHEMA_MAX_STRING_LENGTH', '1024'))
+MAX_URL_LENGTH = int(os.environ.get('SCHEMA_MAX_URL_LENGTH', '8192'))
+CUSTOM_PARAMS_MAX_KEYS = int(os.environ.get('CUSTOM_PARAMS_MAX_KEYS', '50'))
+CUSTOM_PARAMS_MAX_BYTES = int(os.environ.get('CUSTOM_PARAMS_MAX_BYTES', '8192'))
+ECOMMERCE_MAX_ITEMS = int(os.environ.get('ECOMMERCE_MAX_ITEMS', '1000'))
+# Devolver todos los errores de un evento en lugar de solo el primero
+COLLECT_ALL_ERRORS = os.environ.get('SCHEMA_COLLECT_ALL_ERRORS', '0') == '1'
+
+EVENT_TYPES = ['pageview', 'event']
+
+_NUMBER_TYPES = (int, float)
+
+
+class Invalid(Exception):
+    """Error de validación: motivo estable (métricas) + mensajes para el cliente"""
+
+    def __init__(self, reason: str, messages):
+        self.reason = reason
+        self.messages = [messages] if isinstance(messages, str) else list(messages)
+        super().__init__(self.messages[0])
+
+
+class Field:
+    """
+    Declaración de un campo del evento
+    kind: 'str' (los números se convierten a str), 'scalar' (str o número, sin tocar),
+          'object' (dict) o 'any'
+    default: valor (o factory) si el campo falta o es null
+    check(value, event, collect_all): validación/normalización adicional (event = evento recibido)
+    """
+
+    __slots__ = ('name', 'kind', 'required', 'default', 'max_length', 'choices', 'check')
+
+    def __init__(self, name: str, kind: str = 'str', required: bool = False, default=None,
+                 max_length: int = MAX_STRING_LENGTH, choices: list = None, check=None):
+        self.name = name
+        self.kind = kind
+        self.required = required
+        self.default = default
+        self.max_length = max_length
+        self.choices = choices
+        self.check = check
+
+
+def _compile_field(field: Field):
+    """Convierte la declaración en step(value, event, collect_all) -> valor normalizado"""
+    name, kind, required, default = field.name, field.kind, field.required, field.default
+    max_length, check = field.max_length, field.check
+    choices = frozenset(field.choices) if field.choices else None
+    default_factory = default if callable(default) else None
+    is_text = kind in ('str', 'scalar')
+    to_str = kind == 'str'
+    # Mensajes construidos una sola vez
+    missing = f"Missing required field: {name}"
+    invalid_choice = f"Invalid {name}. Must be one of: {field.choices}"
+    too_long = f"{name} exceeds {max_length} characters"
+    not_string = f"{name} must be a string"
+    not_finite = f"{name} must be a finite number"
+    not_object = f"{name} must be an object"
+
+    def step(value, event, collect_all):
+        if value is None:
+            if required:
+                raise Invalid('missing_field', missing)
+            value = default_factory() if default_factory else default
+            return check(value, event, collect_all) if check else value
+        if is_text:
+            cls = value.__class__
+            if cls is str:
+                if len(value) > max_length:
+                    raise Invalid('field_too_large', too_long)
+            elif cls in _NUMBER_TYPES:
+                # NaN/Infinity no son JSON válido para PostgREST (ni tienen sentido como texto)
+                if cls is float and not math.isfinite(value):
+                    raise Invalid('invalid_field', not_finite)
+                if to_str:
+                    value = str(value)
+            else:
+                raise Invalid('invalid_field', not_string)
+        elif kind == 'object' and value.__class__ is not dict:
+            raise Invalid('invalid_field', not_object)
+        if choices is not None and value not in choices:
+            raise Invalid(f'invalid_{name}', invalid_choice)
+        return check(value, event, collect_all) if check else value
+
+    return step
+
+
+class EventValidator:
+    """Validador compilado: validate(event) -> (campos normalizados, errores)"""
+
+    def __init__(self, fields: list):
+        self.fields = list(fields)
+        self.required = tuple(f.name for f in self.fields if f.required)
+        self._required_set = frozenset(self.required)
+        # (nombre, longitud máxima si es un string sin más reglas, step): los strings simples
+        # se resuelven en línea sin llamar a step, que es el caso de casi todos los campos
+        self._steps = tuple(
+            (f.name, f.max_length if f.kind in ('str', 'scalar') and not f.choices and not f.check else -1,
+             _compile_field(f))
+            for f in self.fields
+        )
+        self._fast = self._generate()
+
+    def _generate(self):
+        """
+        Genera una función en línea recta (sin bucle ni tuplas por campo) para el caso habitual:
+        todos los obligatorios presentes y sin collect_all. Cada campo comprueba en línea si ya
+        es válido tal cual y solo llama a step (coerción, default o error) si no lo es
+        """
+        lines = ['def validate(event):', '    get = event.get']
+        namespace = {}
+        for i, (field, (name, _, step)) in enumerate(zip(self.fields, self._steps)):
+            namespace[f'step_{i}'] = step
+            if field.kind in ('str', 'scalar'):
+                ok = f'v{i}.__class__ is str and len(v{i}) <= {field.max_length}'
+                if field.choices:
+                    namespace[f'choices_{i}'] = frozenset(field.choices)
+                    ok += f' and v{i} in choices_{i}'
+            elif field.kind == 'object':
+                ok = f'v{i}.__class__ is dict'
+            else:
+                ok = f'v{i} is not None'
+            lines += [f'    v{i} = get({name!r})',
+                      f'    if not ({ok}):',
+                      f'        v{i} = step_{i}(v{i}, event, False)']
+            if field.check:
+                namespace[f'check_{i}'] = field.check
+                lines += ['    else:',
+                          f'        v{i} = check_{i}(v{i}, event, False)']
+        # Un literal de dict es más rápido que asignar clave a clave
+        lines.append('    return {' + ', '.join(f'{name!r}: v{i}' for i, (name, _, _) in enumerate(self._steps)) + '}')
+        exec(compile('\n'.join(lines), '<event-validator>', 'exec'), namespace)
+        return namespace['validate']
+
+    def validate(self, event: dict, collect_all: bool = COLLECT_ALL_ERRORS) -> tuple:
+        """
+        Retorna (record, errors): errors es una lista de Invalid (vacía si el evento es válido)
+        Sin collect_all se detiene en el primer error, en el mismo orden que la validación anterior:
+        campos obligatorios, event_type, event_name, ecommerce_data
+        """
+        if not collect_all and self._required_set <= event.keys():
+            try:
+                return self._fast(event), []
+            except Invalid as e:
+                return None, [e]
+
+        errors = []
+        if not self._required_set <= event.keys():
+            for name in self.required:
+                if name not in event:
+                    errors.append(Invalid('missing_field', f"Missing required field: {name}"))
+                    if not collect_all:
+                        return None, errors
+
+        record = {}
+        get = event.get
+        for name, max_length, step in self._steps:
+            value = get(name)
+            if value.__class__ is str and len(value) <= max_length:
+                record[name] = value
+                continue
+            try:
+                record[name] = step(value, event, collect_all)
+            except Invalid as e:
+                if collect_all and e.reason == 'missing_field' and name not in event:
+                    continue  # ya reportado arriba
+                errors.append(e)
+                if not collect_all:
+                    return None, errors
+        return (None if errors else record), errors
+
+
+# ============================================
+# VALIDACIONES ESPECÍFICAS DE EVENTOS
+# ============================================
+
+def _check_event_name(value, event, collect_all):
+    """Obligatorio en eventos custom; los pageviews sin nombre se guardan como 'pageview'"""
+    event_type = event.get('event_type')
+    if not value:
+        if event_type == 'event':
+            raise Invalid('missing_event_name', "event_name is required for event_type='event'")
+        return 'pageview' if event_type == 'pageview' else None
+    return value
+
+
+def _approx_size(params: dict) -> int:
+    """
+    Tamaño aproximado en JSON: exacto para strings, serializa solo los valores anidados
+    Lanza Invalid si algún valor (también anidado) es NaN o Infinity
+    """
+    size = 0
+    for key, value in params.items():
+        cls = value.__class__
+        if cls is str:
+            size += len(key) + len(value) + 6
+        elif cls is dict or cls is list:
+            try:
+                size += len(key) + len(json.dumps(value, separators=(',', ':'), default=str, allow_nan=False)) + 4
+            except ValueError:
+                raise Invalid('invalid_field', "custom_params must not contain NaN or Infinity")
+        else:
+            if cls is float and not math.isfinite(value):
+                raise Invalid('invalid_field', "custom_params must not contain NaN or Infinity")
+            size += len(key) + 24
+    return size
+
+
+def _check_custom_params(value, event, collect_all):
+    if len(value) > CUSTOM_PARAMS_MAX_KEYS:
+        raise Invalid('field_too_large', f"custom_params exceeds {CUSTOM_PARAMS_MAX_KEYS} keys")
+    if value and _approx_size(value) > CUSTOM_PARAMS_MAX_BYTES:
+        raise Invalid('field_too_large', f"custom_params exceeds {CUSTOM_PARAMS_MAX_BYTES} bytes")
+    return value
+
+
+def _to_number(value, convert):
+    """float()/int() como antes, pero sin aceptar NaN/Infinity (no son JSON válido para PostgREST)"""
+    cls = value.__class__
+    if cls is float and math.isfinite(value) or cls is int:
+        return value if convert is float or cls is int else convert(value)
+    try:
+        number = convert(value)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if number.__class__ is float and not math.isfinite(number):
+        return None
+    return number
+
+
+def _ecommerce_errors(data: dict, collect_all: bool) -> list:
+    """Valida y normaliza ecommerce_data in situ (value/price/quantity enviados como texto pasan a número)"""
+    errors = []
+
+    # Validar campos obligatorios para purchase
+    if not data.get('transaction_id'):
+        errors.append("ecommerce_data.transaction_id is required")
+        if not collect_all:
+            return errors
+
+    if 'value' not in data:
+        errors.append("ecommerce_data.value is required")
+    else:
+        value = _to_number(data['value'], float)
+        if value is None:
+            errors.append("ecommerce_data.value must be a number")
+        elif value < 0:
+            errors.append("ecommerce_data.value must be >= 0")
+        else:
+            data['value'] = value
+    if errors and not collect_all:
+        return errors
+
+    # Validar items si existe
+    if 'items' in data:
+        items = data['items']
+        if items.__class__ is not list:
+            errors.append("ecommerce_data.items must be an array")
+            return errors
+        if len(items) > ECOMMERCE_MAX_ITEMS:
+            errors.append(f"ecommerce_data.items exceeds {ECOMMERCE_MAX_ITEMS} items")
+            return errors
+
+        for idx, item in enumerate(items):
+            if item.__class__ is not dict:
+                errors.append(f"ecommerce_data.items[{idx}] must be an object")
+            else:
+                if 'price' in item:
+                    price = item['price']
+                    if price.__class__ is not float or not math.isfinite(price):
+                        price = _to_number(price, float)
+                        if price is None:
+                            errors.append(f"ecommerce_data.items[{idx}].price must be a number")
+                        else:
+                            item['price'] = price
+                if 'quantity' in item:
+                    quantity = item['quantity']
+                    if quantity.__class__ is not int:
+                        quantity = _to_number(quantity, int)
+                        if quantity is None:
+                            errors.append(f"ecommerce_data.items[{idx}].quantity must be an integer")
+                        else:
+                            item['quantity'] = quantity
+            if errors and not collect_all:
+                return errors
+
+    return errors
+
+
+def _check_ecommerce_data(value, event, collect_all):
+    # Un ecommerce_data vacío se guarda tal cual, sin validar
+    if not value:
+        return value
+    if value.__class__ is not dict:
+        raise Invalid('invalid_ecommerce_data', "Invalid ecommerce_data: ecommerce_data must be an object")
+    errors = _ecommerce_errors(value, collect_all)
+    if errors:
+        reason = 'field_too_large' if errors[0].startswith('ecommerce_data.items exceeds') else 'invalid_ecommerce_data'
+        raise Invalid(reason, [f"Invalid ecommerce_data: {message}" for message in errors])
+    return value
+
+
+# Orden = orden de validación (y de los errores): obligatorios, event_type, event_name, resto
+EVENT_SCHEMA = [
+    Field('event_id', required=True, max_length=128),
+    Field('timestamp', kind='scalar', required=True, max_length=64),
+    Field('user_id', required=True, max_length=256),
+    Field('session_id', required=True, max_length=256),
+    Field('event_type', required=True, choices=EVENT_TYPES),
+    Field('page_url', required=True, max_length=MAX_URL_LENGTH),
+    Field('user_agent', required=True),
+    Field('event_name', max_length=256, check=_check_event_name),
+    Field('page_title', default=''),
+    Field('referrer', default='', max_length=MAX_URL_LENGTH),
+    # Valores enviados por el píxel que tienen prioridad sobre el parseo del User-Agent
+    Field('device_type', max_length=64),
+    Field('browser', max_length=64),
+    Field('os', max_length=64),
+    Field('screen_resolution', max_length=64),
+    Field('viewport_size', max_length=64),
+    Field('language', max_length=64),
+    Field('timezone', max_length=64),
+    Field('custom_params', kind='object', default=dict, check=_check_custom_params),
+    Field('ecommerce_data', kind='any', check=_check_ecommerce_data),
+]
+
+EVENT_VALIDATOR = EventValidator(EVENT_SCHEMA)
@@ -0,0 +1,417 @@
+"""
+Buffer write-behind de eventos con spool local append-only y circuit breaker
+
+Los eventos enriquecidos se añaden a un fichero JSONL y el handler responde de inmediato.
+Un flusher drena el spool a events_raw por lotes (por tamaño o antigüedad) y guarda el
+offset confirmado en un fichero aparte. Tras un reinicio o crash se reenvía todo lo que
+haya después del offset; el INSERT es idempotente (on_conflict=event_id), así que un
+lote reenviado no duplica filas.
+
+Solo se reintentan los fallos transitorios (5xx, conexión). Un lote que PostgREST rechaza (4xx) o que
+no se puede serializar se reintenta fila a fila; las que siguen fallando van a events.dead.jsonl y el
+offset avanza, para que una fila mala no bloquee el spool.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+
+import _obs as obs
+
+SPOOL_DIR = os.environ.get('SPOOL_DIR', '/tmp/accumetrics-spool')
+SPOOL_BATCH_SIZE = int(os.environ.get('SPOOL_BATCH_SIZE', '200'))
+SPOOL_MAX_AGE = float(os.environ.get('SPOOL_MAX_AGE', '5'))
+SPOOL_FLUSH_INTERVAL = float(os.environ.get('SPOOL_FLUSH_INTERVAL', '1'))
+SPOOL_MAX_BYTES = int(os.environ.get('SPOOL_MAX_BYTES', str(256 * 1024 * 1024)))
+SPOOL_FSYNC = os.environ.get('SPOOL_FSYNC', '1') == '1'
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_TIMEOUT', '30'))
+
+
+class SpoolFullError(Exception):
+    """El spool superó SPOOL_MAX_BYTES (Supabase lleva demasiado tiempo caído)"""
+
+
+class RejectedRowsError(Exception):
+    """insert_fn: Supabase rechazó el lote de forma definitiva (4xx); reintentarlo no sirve"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clásico: closed -> open tras N fallos seguidos,
+    open -> half_open pasado reset_timeout (deja pasar una sola sonda),
+    half_open -> closed si la sonda funciona, o vuelve a open si falla
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Indica si se puede llamar a Supabase ahora"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'times_opened': self.times_opened
+        }
+
+
+class EventSpool:
+    """Spool JSONL append-only con offset confirmado y flush por lotes"""
+
+    def __init__(self, insert_fn, directory: str = SPOOL_DIR, batch_size: int = SPOOL_BATCH_SIZE,
+                 max_age: float = SPOOL_MAX_AGE, max_bytes: int = SPOOL_MAX_BYTES,
+                 breaker: CircuitBreaker = None, fsync: bool = SPOOL_FSYNC):
+        self.insert_fn = insert_fn
+        self.batch_size = max(1, batch_size)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.breaker = breaker or CircuitBreaker()
+        self.fsync = fsync
+
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, 'events.jsonl')
+        self.offset_path = os.path.join(directory, 'events.offset')
+        self.dead_letter_path = os.path.join(directory, 'events.dead.jsonl')
+        self.flush_lock_path = os.path.join(directory, 'events.flush.lock')
+
+        self._lock = threading.Lock()
+        self._flush_thread_lock = threading.Lock()
+        self._flusher = None
+        self._stop = threading.Event()
+        # Tras un arranque no sabemos cuánto tiene el spool: forzar el primer flush
+        self._pending = 1
+        self._oldest = 0.0
+
+        self.appended = 0
+        self.flushed = 0
+        self.flush_failures = 0
+        self.corrupt_records = 0
+        self.dead_lettered = 0
+
+        self._recover()
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def _recover(self):
+        """Descarta una última línea incompleta (crash a mitad de un append)"""
+        with self._locked_data('a+b') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(max(0, size - 1))
+            if f.read(1) == b'\n':
+                return
+            # Buscar el último salto de línea completo
+            pos = size
+            chunk = 4096
+            while pos > 0:
+                start = max(0, pos - chunk)
+                f.seek(start)
+                idx = f.read(pos - start).rfind(b'\n')
+                if idx != -1:
+                    f.truncate(start + idx + 1)
+                    obs.warn("Spool: truncated torn record", offset=start + idx + 1)
+                    return
+                pos = start
+            f.truncate(0)
+
+    def _locked_data(self, mode: str):
+        return _FileLock(self.data_path, mode)
+
+    def append(self, rows: list):
+        """
+        Añade filas enriquecidas al spool (una línea JSON por fila)
+        ValueError si alguna no es JSON válido (NaN/Infinity): no se escribe ninguna
+        """
+        data = ''.join(json.dumps(row, separators=(',', ':'), allow_nan=False) + '\n'
+                       for row in rows).encode('utf-8')
+        with self._lock:
+            with self._locked_data('ab') as f:
+                if f.tell() + len(data) > self.max_bytes:
+                    raise SpoolFullError(f"Spool exceeds {self.max_bytes} bytes")
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            if self._pending == 0:
+                self._oldest = time.monotonic()
+            self._pending += len(rows)
+            self.appended += len(rows)
+
+    # ------------------------------------------------------------------
+    # Flush
+    # ------------------------------------------------------------------
+
+    def is_due(self) -> bool:
+        """Hay que drenar por tamaño de lote o por antigüedad del registro más viejo"""
+        if self._pending <= 0:
+            return False
+        if self._pending >= self.batch_size:
+            return True
+        return time.monotonic() - self._oldest >= self.max_age
+
+    def maybe_flush(self) -> int:
+        """Drena el spool solo si toca por tamaño/antigüedad"""
+        if not self.is_due():
+            return 0
+        return self.flush()
+
+    def flush(self) -> int:
+        """
+        Drena el spool a Supabase por lotes hasta vaciarlo, fallar o abrirse el breaker
+        Retorna el número de filas confirmadas
+        """
+        # Un solo flusher a la vez (entre hilos y entre procesos)
+        if not self._flush_thread_lock.acquire(blocking=False):
+            return 0
+        try:
+            with open(self.flush_lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 0
+                try:
+                    return self._drain()
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            self._flush_thread_lock.release()
+
+    def _drain(self) -> int:
+        total = 0
+        offset = self._read_offset()
+        if offset > os.path.getsize(self.data_path):
+            # Offset de un spool ya compactado: volver al principio
+            offset = 0
+            self._write_offset(0)
+        while True:
+            rows, next_offset = self._read_batch(offset)
+            if not rows:
+                if next_offset != offset:
+                    # Solo había registros corruptos: avanzar igualmente
+                    self._write_offset(next_offset)
+                    offset = next_offset
+                self._compact(offset)
+                return total
+
+            if not self.breaker.allow():
+                return total
+
+            dead_before = self.dead_lettered
+            try:
+                ok = self.insert_fn(rows)
+            except (RejectedRowsError, ValueError) as e:
+                ok = self._insert_isolating(rows, str(e))
+            except Exception as e:
+                obs.error("Spool flush error", error=str(e))
+                ok = False
+
+            if not ok:
+                self.breaker.record_failure()
+                self.flush_failures += 1
+                return total
+
+            self.breaker.record_success()
+            self._write_offset(next_offset)
+            offset = next_offset
+            inserted = len(rows) - (self.dead_lettered - dead_before)
+            total += inserted
+            self.flushed += inserted
+
+    def _insert_isolating(self, rows: list, error: str) -> bool:
+        """
+        Lote rechazado de forma definitiva: se inserta fila a fila y las rechazadas van a la cola de
+        descartes. False si aparece un fallo transitorio (el lote entero se reintentará; el INSERT
+        es idempotente y los descartes solo se escriben cuando el lote se resuelve)
+        """
+        obs.warn("Spool: batch rejected, retrying row by row", rows=len(rows), error=error)
+        rejected = []
+        for row in rows:
+            try:
+                if not self.insert_fn([row]):
+                    return False
+            except (RejectedRowsError, ValueError) as e:
+                rejected.append((row, str(e)))
+            except Exception as e:
+                obs.error("Spool flush error", error=str(e))
+                return False
+        if rejected:
+            self._dead_letter(rejected)
+        return True
+
+    def _dead_letter(self, rejected: list):
+        """Guarda las filas rechazadas (con el motivo) para revisarlas a mano"""
+        data = ''.join(json.dumps({'error': error, 'row': row}, separators=(',', ':')) + '\n'
+                       for row, error in rejected).encode('utf-8')
+        with _FileLock(self.dead_letter_path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self.dead_lettered += len(rejected)
+        for row, error in rejected:
+            obs.error("Spool: row rejected, moved to dead letter", event_id=str(row.get('event_id')),
+                      error=error, path=self.dead_letter_path)
+
+    def _read_batch(self, offset: int) -> tuple:
+        """Lee hasta batch_size registros completos a partir del offset"""
+        rows = []
+        with open(self.data_path, 'rb') as f:
+            f.seek(offset)
+            while len(rows) < self.batch_size:
+                line = f.readline()
+                if not line or not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    self.corrupt_records += 1
+                    obs.error("Spool: skipping corrupt record", offset=offset)
+        return rows, offset
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self.offset_path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, offset: int):
+        """Escritura atómica del offset confirmado (tmp + rename)"""
+        tmp_path = self.offset_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def _compact(self, offset: int):
+        """Si todo está confirmado, trunca el spool y reinicia el offset"""
+        with self._lock:
+            with self._locked_data('r+b') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() != offset:
+                    # Llegaron registros nuevos mientras drenábamos
+                    self._pending = max(self._pending, 1)
+                    return
+                if offset:
+                    # Primero el offset: un crash entre ambos pasos solo provoca un
+                    # reenvío idempotente, nunca un offset más allá del final del fichero
+                    self._write_offset(0)
+                    f.truncate(0)
+            self._pending = 0
+
+    # ------------------------------------------------------------------
+    # Flusher en segundo plano
+    # ------------------------------------------------------------------
+
+    def start(self, interval: float = SPOOL_FLUSH_INTERVAL):
+        """Arranca (una vez) el hilo que drena el spool periódicamente"""
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._run, args=(interval,), name='spool-flusher', daemon=True
+            )
+            self._flusher.start()
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.maybe_flush()
+            except Exception as e:
+                obs.error("Spool flusher error", error=str(e))
+
+    def stop(self, drain: bool = True):
+        """Detiene el flusher y opcionalmente drena lo pendiente"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        if drain:
+            self.flush()
+
+    def stats(self) -> dict:
+        try:
+            size = os.path.getsize(self.data_path)
+        except OSError:
+            size = 0
+        return {
+            'appended': self.appended,
+            'flushed': self.flushed,
+            'flush_failures': self.flush_failures,
+            'corrupt_records': self.corrupt_records,
+            'dead_lettered': self.dead_lettered,
+            'backlog_bytes': max(0, size - self._read_offset()),
+            'breaker': self.breaker.stats()
+        }
+
+
+class _FileLock:
+    """Abre un fichero con flock exclusivo (appends seguros entre procesos)"""
+
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self.file = None
+
+    def __enter__(self):
+        if self.mode == 'r+b' and not os.path.exists(self.path):
+            open(self.path, 'ab').close()
+        self.file = open(self.path, self.mode)
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        if 'a' in self.mode:
+            self.file.seek(0, os.SEEK_END)
+        return self.file
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        finally:
+            self.file.close()
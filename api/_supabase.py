@@ -0,0 +1,164 @@
+"""
+Cliente REST de Supabase (PostgREST) compartido por los handlers de api/
+Mantiene un pool de conexiones keep-alive que sobrevive entre invocaciones warm,
+con timeouts ajustados y reintentos acotados con backoff + jitter
+
+Solo se reintentan peticiones idempotentes (GET, INSERT con on_conflict + ignore-duplicates y las RPC
+marcadas con retry=True): un 502/504 o un reset puede llegar después del commit, y repetir p. ej.
+increment_client_usage o merge_events_rollup sumaría dos veces
+"""
+
+import os
+import random
+import threading
+import time
+
+import _obs as obs
+
+# Configuración (segundos)
+CONNECT_TIMEOUT = float(os.environ.get('SUPABASE_CONNECT_TIMEOUT', '2'))
+READ_TIMEOUT = float(os.environ.get('SUPABASE_READ_TIMEOUT', '5'))
+MAX_RETRIES = int(os.environ.get('SUPABASE_MAX_RETRIES', '2'))
+RETRY_BACKOFF = float(os.environ.get('SUPABASE_RETRY_BACKOFF', '0.1'))
+RETRY_BACKOFF_MAX = float(os.environ.get('SUPABASE_RETRY_BACKOFF_MAX', '1'))
+POOL_SIZE = int(os.environ.get('SUPABASE_POOL_SIZE', '10'))
+
+
+class SupabaseClient:
+    """Cliente PostgREST mínimo sobre una requests.Session persistente"""
+
+    def __init__(self, url: str, key: str, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, max_retries: int = MAX_RETRIES,
+                 retry_backoff: float = RETRY_BACKOFF, pool_size: int = POOL_SIZE):
+        # requests se importa aquí y no a nivel de módulo: OPTIONS/GET no lo necesitan
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._connection_error = requests.exceptions.ConnectionError
+        self.url = (url or '').rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff
+
+        # Sin reintentos en urllib3: los gestionamos aquí para limitar a 5xx/conexión
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+        self.session.headers.update({
+            'apikey': key or '',
+            'Authorization': f'Bearer {key}',
+            'Content-Type': 'application/json'
+        })
+
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+        self.retries = 0
+
+    def request(self, method: str, path: str, params: dict = None, json=None,
+                headers: dict = None, retry: bool = None) -> 'requests.Response':
+        """
+        Ejecuta una petición contra /rest/v1/{path}
+        Con retry (por defecto solo GET) reintenta ante errores de conexión (resets, connect timeouts)
+        y respuestas 5xx
+        """
+        url = f"{self.url}/rest/v1/{path}"
+        table = path.split('?', 1)[0]
+        if retry is None:
+            retry = method == 'GET'
+        start = time.perf_counter()
+        try:
+            return self._request_with_retries(method, url, params, json, headers,
+                                              self.max_retries if retry else 0)
+        finally:
+            obs.SUPABASE_DURATION.observe(time.perf_counter() - start, method=method, table=table)
+
+    def _request_with_retries(self, method: str, url: str, params, json, headers,
+                              max_retries: int) -> 'requests.Response':
+        attempt = 0
+        while True:
+            with self._lock:
+                self.requests_sent += 1
+            try:
+                response = self.session.request(
+                    method, url, params=params, json=json, headers=headers, timeout=self.timeout
+                )
+            except self._connection_error:
+                if attempt >= max_retries:
+                    raise
+            else:
+                if response.status_code < 500 or attempt >= max_retries:
+                    return response
+
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            self._sleep_backoff(attempt)
+
+    def _sleep_backoff(self, attempt: int):
+        """Backoff exponencial con "full jitter" """
+        cap = min(RETRY_BACKOFF_MAX, self.retry_backoff * (2 ** (attempt - 1)))
+        time.sleep(random.uniform(0, cap))
+
+    def select(self, table: str, params: dict) -> 'requests.Response':
+        """GET sobre una tabla con filtros PostgREST"""
+        return self.request('GET', table, params=params)
+
+    def insert(self, table: str, rows, returning: bool = False, params: dict = None,
+               prefer: list = None) -> 'requests.Response':
+        """
+        INSERT de una fila o un lote de filas
+        Por defecto usa `Prefer: return=minimal` porque nunca leemos la representación
+        Solo se reintenta si es idempotente: on_conflict + resolution=ignore-duplicates
+        """
+        prefer = list(prefer or [])
+        idempotent = bool((params or {}).get('on_conflict')) and 'resolution=ignore-duplicates' in prefer
+        prefer.append('return=representation' if returning else 'return=minimal')
+        return self.request('POST', table, params=params, json=rows,
+                            headers={'Prefer': ','.join(prefer)}, retry=idempotent)
+
+    def rpc(self, function: str, payload: dict, retry: bool = False) -> 'requests.Response':
+        """Llama a una función SQL expuesta por PostgREST (retry=True solo si repetirla no cambia el resultado)"""
+        return self.request('POST', f'rpc/{function}', json=payload, retry=retry)
+
+    def connections_opened(self) -> int:
+        """Conexiones TCP/TLS abiertas por el pool desde el arranque"""
+        pools = self._adapter.poolmanager.pools
+        total = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+        return total
+
+    def stats(self) -> dict:
+        """Contadores de uso del pool: reused = peticiones que no abrieron conexión nueva"""
+        opened = self.connections_opened()
+        return {
+            'requests': self.requests_sent,
+            'retries': self.retries,
+            'connections_opened': opened,
+            'connections_reused': max(0, self.requests_sent - opened)
+        }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> SupabaseClient:
+    """Cliente compartido del proceso (se crea en el primer uso)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SupabaseClient(
+                    os.environ.get('SUPABASE_URL'),
+                    os.environ.get('SUPABASE_SERVICE_KEY')
+                )
+    return _client
+
+
+def get_client_stats() -> dict:
+    """Contadores del cliente compartido, sin crearlo (None si aún no se usó)"""
+    return _client.stats() if _client is not None else None
@@ -0,0 +1,119 @@
+"""
+Parseo de User-Agent memoizado
+user_agents.parse() es el paso más caro de cada evento y la distribución de UAs es muy
+sesgada, así que se cachea el resultado ya extraído (junto con el veredicto de bot)
+por UA crudo en un LRU acotado
+"""
+
+import os
+import threading
+
+import _obs as obs
+from _bots import get_detector
+from _cache import LRUCache, MISSING
+
+UA_CACHE_SIZE = int(os.environ.get('UA_CACHE_SIZE', '2048'))
+# Fichero opcional con los UAs más frecuentes (uno por línea) para precalentar la caché
+UA_WARM_FILE = os.environ.get('UA_WARM_FILE')
+
+# Importar user_agents en segundo plano al arrancar (compila ~1000 regex de ua-parser)
+UA_PRELOAD = os.environ.get('UA_PRELOAD', '1') == '1'
+
+_ua_cache = LRUCache(max_size=UA_CACHE_SIZE)
+_parse = None
+
+
+def _get_parser():
+    """
+    Importa user_agents en el primer uso: cargar las reglas de ua-parser es lo más
+    caro del cold start y OPTIONS/GET no lo necesitan
+    """
+    global _parse
+    if _parse is None:
+        from user_agents import parse
+        _parse = parse
+    return _parse
+
+
+def parse_user_agent(ua_string: str) -> dict:
+    """Parsea el User-Agent y extrae información"""
+    user_agent = _get_parser()(ua_string)
+    return {
+        'browser': user_agent.browser.family,
+        'browser_version': user_agent.browser.version_string,
+        'os': user_agent.os.family,
+        'os_version': user_agent.os.version_string,
+        'device': user_agent.device.family,
+        'is_mobile': user_agent.is_mobile,
+        'is_tablet': user_agent.is_tablet,
+        'is_pc': user_agent.is_pc,
+        'is_bot': user_agent.is_bot
+    }
+
+
+def _classify(ua_string: str) -> dict:
+    ua_data = parse_user_agent(ua_string)
+    bot_rule = get_detector().match(ua_string)
+    ua_data['bot_rule'] = bot_rule
+    # Veredicto combinado: patrones propios o la detección de ua-parser
+    ua_data['is_bot'] = bot_rule is not None or ua_data['is_bot']
+    return ua_data
+
+
+def classify_user_agent(ua_string: str) -> dict:
+    """
+    Datos del User-Agent + veredicto de bot combinado, desde caché si es posible
+    El dict devuelto se comparte entre llamadas: no modificarlo
+    """
+    ua_data = _ua_cache.get(ua_string)
+    if ua_data is MISSING:
+        ua_data = _classify(ua_string)
+        _ua_cache.set(ua_string, ua_data)
+    return ua_data
+
+
+def warm_ua_cache(path: str) -> int:
+    """Precarga la caché con los UAs de un fichero (uno por línea). Retorna cuántos cargó"""
+    loaded = 0
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                ua_string = line.rstrip('\n')
+                if not ua_string or ua_string.startswith('#'):
+                    continue
+                if loaded >= _ua_cache.max_size:
+                    break
+                _ua_cache.set(ua_string, _classify(ua_string))
+                loaded += 1
+    except OSError as e:
+        obs.error("Could not warm UA cache", path=path, error=str(e))
+    return loaded
+
+
+def get_ua_cache_stats() -> dict:
+    """Contadores de la caché de User-Agents (hit rate, evictions)"""
+    return _ua_cache.stats()
+
+
+def _preload():
+    try:
+        _get_parser()
+        get_detector()
+        if UA_WARM_FILE:
+            obs.info("UA cache warmed", user_agents=warm_ua_cache(UA_WARM_FILE))
+    except Exception as e:
+        obs.error("UA preload failed", error=str(e))
+
+
+def start_preload():
+    """
+    Carga el parser (y precalienta la caché) en un hilo: se solapa con la lectura del
+    body y la consulta del proyecto en vez de sumarse a la latencia de la primera petición
+    """
+    threading.Thread(target=_preload, name='ua-preload', daemon=True).start()
+
+
+if UA_PRELOAD:
+    start_preload()
+elif UA_WARM_FILE:
+    obs.info("UA cache warmed", user_agents=warm_ua_cache(UA_WARM_FILE))
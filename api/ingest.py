@@ -0,0 +1,421 @@
+"""
+Importación masiva de eventos (backfills y eventos server-side) - Vercel Serverless Function
+POST /api/ingest?tracking_code=XXX con un cuerpo NDJSON (un evento por línea), opcionalmente
+comprimido (Content-Encoding: gzip) y/o con Transfer-Encoding: chunked.
+
+El cuerpo se procesa en streaming con memoria acotada: se descomprime y se parte en líneas trozo
+a trozo, cada línea pasa por la misma validación y enriquecimiento que /api/track y las filas se
+insertan en events_raw en lotes de IMPORT_BATCH_SIZE, ignorando event_id ya existentes.
+
+Autenticación: Authorization: Bearer <HMAC-SHA256(IMPORT_SIGNING_KEY, tracking_code) en hex>
+(`python api/ingest.py token <tracking_code>` lo genera)
+"""
+
+from http.server import BaseHTTPRequestHandler
+import hashlib
+import hmac
+import json
+import os
+import sys
+import traceback
+import zlib
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+# Permite importar los módulos auxiliares (_*.py) y track.py de esta misma carpeta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import _obs as obs
+from _supabase import get_client
+from track import (DUPLICATES_DROPPED, DuplicateEvent, EventError, aggregate_events, compact_rows, process_event,
+                   release_usage, remember_events, resolve_project, run_deferred_work, sync_usage)
+
+IMPORT_SIGNING_KEY = os.environ.get('IMPORT_SIGNING_KEY')
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '1000'))
+IMPORT_MAX_LINE_BYTES = int(os.environ.get('IMPORT_MAX_LINE_BYTES', str(1024 * 1024)))
+# Máximo de números de línea rechazados/duplicados que se devuelven en el resumen
+IMPORT_MAX_REPORTED = int(os.environ.get('IMPORT_MAX_REPORTED', '100'))
+
+READ_SIZE = 64 * 1024
+# Tope de bytes descomprimidos por llamada (evita que un trozo gzip se expanda sin límite)
+DECOMPRESS_SIZE = 256 * 1024
+
+IMPORT_LINES = obs.REGISTRY.counter('accumetrics_import_lines_total', 'Líneas de /api/ingest por resultado')
+
+
+class ImportAborted(Exception):
+    """
+    Fallo de Supabase a mitad de importación: lo anterior a resume_from_line ya es definitivo
+    (insertado, duplicado o rechazado) y se puede reanudar desde esa línea
+    """
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.resume_from_line = None
+        self.summary = None
+
+
+class QuotaExceeded(ImportAborted):
+    """Límite mensual del cliente alcanzado: las líneas anteriores a resume_from_line ya están guardadas"""
+
+
+class InvalidBody(Exception):
+    """Cuerpo truncado o compresión corrupta"""
+
+
+def import_token(tracking_code: str, key: str = None) -> str:
+    """Token de importación de un tracking_code"""
+    key = key if key is not None else IMPORT_SIGNING_KEY
+    return hmac.new(key.encode('utf-8'), tracking_code.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def verify_token(tracking_code: str, token: str) -> bool:
+    if not IMPORT_SIGNING_KEY or not tracking_code or not token:
+        return False
+    return hmac.compare_digest(import_token(tracking_code), token)
+
+
+# ============================================
+# LECTURA DEL CUERPO EN STREAMING
+# ============================================
+
+def iter_body(rfile, headers):
+    """Cuerpo crudo en trozos de como mucho READ_SIZE, con Content-Length o chunked"""
+    if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+        while True:
+            size_line = rfile.readline(1024)
+            if not size_line:
+                raise InvalidBody("Truncated chunked body")
+            try:
+                size = int(size_line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise InvalidBody("Invalid chunk size")
+            if size == 0:
+                # Trailers opcionales hasta la línea vacía
+                while rfile.readline(1024) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            while size > 0:
+                data = rfile.read(min(size, READ_SIZE))
+                if not data:
+                    raise InvalidBody("Truncated chunked body")
+                size -= len(data)
+                yield data
+            rfile.readline(1024)
+    else:
+        remaining = int(headers.get('Content-Length', 0))
+        while remaining > 0:
+            data = rfile.read(min(remaining, READ_SIZE))
+            if not data:
+                raise InvalidBody("Truncated body")
+            remaining -= len(data)
+            yield data
+
+
+def iter_decoded(chunks, encoding: str):
+    """Descomprime gzip/deflate trozo a trozo con salida acotada; identity pasa tal cual"""
+    if encoding in ('', 'identity'):
+        yield from chunks
+        return
+    try:
+        yield from _decompress(chunks)
+    except zlib.error as e:
+        raise InvalidBody(f"Corrupt compressed body: {e}")
+
+
+def _decompress(chunks):
+    # wbits 47 = 32 + 15: detecta cabecera gzip o zlib automáticamente
+    decompressor = zlib.decompressobj(wbits=47)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk, DECOMPRESS_SIZE)
+        while True:
+            if data:
+                yield data
+            if not decompressor.unconsumed_tail:
+                break
+            data = decompressor.decompress(decompressor.unconsumed_tail, DECOMPRESS_SIZE)
+        if decompressor.eof:
+            break
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+    if not decompressor.eof:
+        raise InvalidBody("Truncated compressed body")
+
+
+def iter_lines(chunks, max_line_bytes: int = IMPORT_MAX_LINE_BYTES):
+    """
+    (número de línea, bytes) por cada línea; bytes es None si la línea supera max_line_bytes
+    (se descarta sin acumularla en memoria)
+    """
+    line_no = 0
+    pending = b''
+    oversized = False
+    for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b'\n', start)
+            if end < 0:
+                break
+            line_no += 1
+            if oversized or len(pending) + end - start > max_line_bytes:
+                yield line_no, None
+            else:
+                yield line_no, pending + chunk[start:end]
+            pending = b''
+            oversized = False
+            start = end + 1
+        if not oversized:
+            pending += chunk[start:]
+            if len(pending) > max_line_bytes:
+                pending = b''
+                oversized = True
+    if oversized:
+        yield line_no + 1, None
+    elif pending.strip():
+        yield line_no + 1, pending
+
+
+# ============================================
+# IMPORTACIÓN
+# ============================================
+
+class ImportSummary:
+    """Contadores y números de línea (acotados) del resultado de una importación"""
+
+    def __init__(self, max_reported: int = IMPORT_MAX_REPORTED):
+        self.max_reported = max_reported
+        self.lines = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.duplicates = 0
+        # Duplicados descartados por el filtro de event_id (el resto los ignoró el INSERT)
+        self.filtered = 0
+        self.rejected_lines = []
+        self.duplicate_lines = []
+        self.reasons = {}
+
+    def reject(self, line_no: int, message: str, reason: str):
+        self.rejected += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        if len(self.rejected_lines) < self.max_reported:
+            self.rejected_lines.append({'line': line_no, 'error': message})
+
+    def duplicate(self, line_no: int, filtered: bool = False):
+        self.duplicates += 1
+        self.filtered += 1 if filtered else 0
+        if len(self.duplicate_lines) < self.max_reported:
+            self.duplicate_lines.append(line_no)
+
+    def to_dict(self) -> dict:
+        return {
+            'lines': self.lines,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'duplicates': self.duplicates,
+            'rejected_lines': self.rejected_lines,
+            'duplicate_lines': self.duplicate_lines,
+            'truncated': (len(self.rejected_lines) < self.rejected
+                          or len(self.duplicate_lines) < self.duplicates)
+        }
+
+
+def insert_new_events(rows: list) -> set:
+    """
+    INSERT masivo que ignora event_id existentes y devuelve los event_id realmente insertados
+    (los que faltan son duplicados). Lanza ImportAborted si Supabase falla
+    """
+    try:
+        response = get_client().insert(
+            'events_raw', compact_rows(rows), returning=True,
+            params={'on_conflict': 'event_id', 'select': 'event_id'},
+            prefer=['resolution=ignore-duplicates']
+        )
+        if response.status_code not in [200, 201]:
+            obs.error("Import insert failed", status=response.status_code, response=response.text)
+            raise ImportAborted(f"Supabase returned {response.status_code}")
+        return {row['event_id'] for row in response.json()}
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # Red caída o respuesta ilegible: se aborta igual que con un error HTTP (con el progreso)
+        obs.error("Import insert failed", error=str(e))
+        raise ImportAborted(f"Supabase request failed: {e}")
+
+
+def run_import(lines, project_info: dict, tracking_code: str, insert_fn=insert_new_events,
+               batch_size: int = IMPORT_BATCH_SIZE) -> ImportSummary:
+    """Valida, enriquece e inserta por lotes cada línea de `lines` ((número, bytes) de iter_lines)"""
+    summary = ImportSummary()
+    batch = []   # filas enriquecidas
+    numbers = [] # número de línea de cada fila
+
+    def flush():
+        try:
+            inserted = insert_fn(batch)
+        except ImportAborted as e:
+            e.resume_from_line = numbers[0]
+            e.summary = summary
+            raise
+        accepted_rows = []
+        duplicate_rows = []
+        for line_no, row in zip(numbers, batch):
+            event_id = row['event_id']
+            if event_id in inserted:
+                # Repeticiones del mismo event_id dentro del lote cuentan como duplicados
+                inserted.discard(event_id)
+                accepted_rows.append(row)
+            else:
+                summary.duplicate(line_no)
+                duplicate_rows.append(row)
+        summary.accepted += len(accepted_rows)
+        remember_events(batch)
+        release_usage(duplicate_rows)
+        aggregate_events(accepted_rows)
+        batch.clear()
+        numbers.clear()
+        # Con el límite mensual, los demás procesos tienen que ver este uso antes de que acabe la importación
+        sync_usage()
+
+    try:
+        for line_no, line in lines:
+            summary.lines = line_no
+            if line is None:
+                summary.reject(line_no, f"Line exceeds {IMPORT_MAX_LINE_BYTES} bytes", 'line_too_large')
+                continue
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                summary.reject(line_no, "Invalid JSON", 'invalid_json')
+                continue
+            if not isinstance(event, dict):
+                summary.reject(line_no, "Line must be a JSON object", 'invalid_event')
+                continue
+            event_code = event.get('tracking_code')
+            if event_code and event_code != tracking_code:
+                summary.reject(line_no, "tracking_code does not match the import", 'invalid_tracking_code')
+                continue
+            try:
+                # Eventos server-side: la IP (si la hay) viene en el propio evento y no hay Origin
+                client_ip = event.get('ip_address') or event.get('client_ip')
+                row = process_event(event, project_info, None, client_ip, rate_limit=False)
+            except DuplicateEvent:
+                summary.duplicate(line_no, filtered=True)
+                continue
+            except EventError as e:
+                if e.reason == 'quota_exceeded':
+                    # Sin cuota no se admite ninguna línea más: guardar el lote y parar aquí
+                    if batch:
+                        flush()
+                    error = QuotaExceeded(e.message)
+                    error.resume_from_line = line_no
+                    error.summary = summary
+                    raise error
+                summary.reject(line_no, e.message, e.reason)
+                continue
+            batch.append(row)
+            numbers.append(line_no)
+            if len(batch) >= batch_size:
+                flush()
+
+        if batch:
+            flush()
+    except BaseException:
+        # Import abortado: las filas del lote sin guardar devuelven su reserva de cuota
+        release_usage(batch)
+        raise
+    return summary
+
+
+class handler(BaseHTTPRequestHandler):
+    """Handler de /api/ingest"""
+
+    def do_POST(self):
+        try:
+            if not IMPORT_SIGNING_KEY:
+                self.send_json(503, {"error": "Import endpoint is not configured"})
+                return
+
+            query = parse_qs(urlparse(self.path).query)
+            tracking_code = query.get('tracking_code', [None])[0] or self.headers.get('X-Tracking-Code')
+            auth = self.headers.get('Authorization', '')
+            token = auth[7:].strip() if auth.startswith('Bearer ') else ''
+            if not verify_token(tracking_code, token):
+                self.send_json(401, {"error": "Invalid import token"})
+                return
+
+            encoding = self.headers.get('Content-Encoding', 'identity').strip().lower()
+            if encoding not in ('identity', 'gzip', 'deflate'):
+                self.send_json(415, {"error": f"Unsupported Content-Encoding: {encoding}"})
+                return
+
+            project_info = resolve_project(tracking_code)
+            body = iter_decoded(iter_body(self.rfile, self.headers), encoding)
+            try:
+                summary = run_import(iter_lines(body), project_info, tracking_code)
+            except QuotaExceeded as e:
+                # El resto del cuerpo no se lee
+                self.close_connection = True
+                self.report(e.summary)
+                result = e.summary.to_dict()
+                result.update({"error": str(e), "resume_from_line": e.resume_from_line})
+                self.send_json(429, result)
+            except ImportAborted as e:
+                self.close_connection = True
+                self.report(e.summary)
+                result = e.summary.to_dict()
+                result.update({"error": "Failed to insert events", "detail": str(e),
+                               "resume_from_line": e.resume_from_line})
+                self.send_json(502, result)
+            except InvalidBody as e:
+                # Lo ya insertado se mantiene; reenviar el fichero completo es seguro (event_id)
+                self.close_connection = True
+                self.send_json(400, {"error": f"Invalid body: {e}"})
+            else:
+                self.report(summary)
+                result = summary.to_dict()
+                obs.info("Import finished", tracking_code=tracking_code, lines=result['lines'],
+                         accepted=result['accepted'], rejected=result['rejected'],
+                         duplicates=result['duplicates'])
+                self.send_json(200, result)
+            finally:
+                # También tras un import abortado: el uso y los agregados de lo ya insertado no esperan
+                run_deferred_work()
+
+        except EventError as e:
+            self.send_json(e.code, {"error": e.message})
+        except Exception as e:
+            obs.error("Unhandled exception", error=str(e), traceback=traceback.format_exc())
+            self.close_connection = True
+            self.send_json(500, {"error": "Internal server error"})
+
+    def report(self, summary: ImportSummary):
+        """Métricas de la importación"""
+        IMPORT_LINES.inc(summary.accepted, status='accepted')
+        IMPORT_LINES.inc(summary.duplicates, status='duplicate')
+        IMPORT_LINES.inc(summary.rejected, status='rejected')
+        DUPLICATES_DROPPED.inc(summary.filtered, source='filter')
+        DUPLICATES_DROPPED.inc(summary.duplicates - summary.filtered, source='insert')
+        obs.EVENTS_ACCEPTED.inc(summary.accepted)
+        for reason, count in summary.reasons.items():
+            obs.EVENTS_REJECTED.inc(count, reason=reason)
+
+    def send_json(self, code: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+
+if __name__ == '__main__':
+    # python api/ingest.py token <tracking_code>
+    if len(sys.argv) == 3 and sys.argv[1] == 'token' and IMPORT_SIGNING_KEY:
+        print(import_token(sys.argv[2]))
+    else:
+        print("Uso: IMPORT_SIGNING_KEY=... python api/ingest.py token <tracking_code>")
+        sys.exit(1)
@@ -1,6 +1,11 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _supabase import get_client
 
 class handler(BaseHTTPRequestHandler):
     def _set_cors_headers(self):
@@ -30,76 +35,61 @@ class handler(BaseHTTPRequestHandler):
                 }
             })
             
-            # Test 2: Importar supabase
-            from supabase import create_client
+            # Test 2: Cliente REST compartido (pool keep-alive)
+            client = get_client()
             result["steps"].append({
                 "step": 2,
-                "name": "Import supabase",
-                "status": "OK"
+                "name": "Create Supabase REST client",
+                "status": "OK",
+                "data": {
+                    "connect_timeout": client.timeout[0],
+                    "read_timeout": client.timeout[1],
+                    "max_retries": client.max_retries
+                }
             })
             
-            # Test 3: Crear cliente básico
-            try:
-                client = create_client(SUPABASE_URL, SUPABASE_KEY)
-                result["steps"].append({
-                    "step": 3,
-                    "name": "Create Supabase client",
-                    "status": "OK"
-                })
-            except TypeError as te:
-                result["steps"].append({
-                    "step": 3,
-                    "name": "Create Supabase client",
-                    "status": "ERROR",
-                    "error": str(te)
-                })
-                # Intentar con opciones
-                try:
-                    from supabase.lib.client_options import ClientOptions
-                    options = ClientOptions()
-                    client = create_client(SUPABASE_URL, SUPABASE_KEY, options)
-                    result["steps"].append({
-                        "step": 3.1,
-                        "name": "Create client with ClientOptions",
-                        "status": "OK"
-                    })
-                except Exception as e2:
-                    result["steps"].append({
-                        "step": 3.1,
-                        "name": "Create client with ClientOptions",
-                        "status": "ERROR",
-                        "error": str(e2)
-                    })
-                    raise
-            
-            # Test 4: Query simple
-            response = client.table('projects').select('tracking_code').limit(1).execute()
+            # Test 3: Query simple
+            response = client.select('projects', {'select': 'tracking_code', 'limit': 1})
+            response.raise_for_status()
             result["steps"].append({
-                "step": 4,
+                "step": 3,
                 "name": "Simple query",
                 "status": "OK",
-                "data": f"Found {len(response.data)} rows"
+                "data": f"Found {len(response.json())} rows"
             })
             
-            # Test 5: Query específica
-            response2 = client.table('projects').select('*').eq('tracking_code', 'ad7c528c7bb4734efb065d555a90e724').execute()
+            # Test 4: Query específica
+            response2 = client.select('projects', {
+                'select': '*',
+                'tracking_code': 'eq.ad7c528c7bb4734efb065d555a90e724'
+            })
+            response2.raise_for_status()
+            rows = response2.json()
             result["steps"].append({
-                "step": 5,
+                "step": 4,
                 "name": "Specific tracking_code query",
                 "status": "OK",
                 "data": {
-                    "found": len(response2.data) > 0,
-                    "count": len(response2.data)
+                    "found": len(rows) > 0,
+                    "count": len(rows)
                 }
             })
             
-            if response2.data:
+            if rows:
                 result["project_found"] = {
-                    "project_id": response2.data[0].get('project_id'),
-                    "project_name": response2.data[0].get('project_name'),
-                    "is_active": response2.data[0].get('is_active')
+                    "project_id": rows[0].get('project_id'),
+                    "project_name": rows[0].get('project_name'),
+                    "is_active": rows[0].get('is_active')
                 }
             
+            # Test 5: Reutilización de conexiones
+            result["steps"].append({
+                "step": 5,
+                "name": "Connection pool",
+                "status": "OK",
+                "data": client.stats()
+            })
+            
             result["final_status"] = "SUCCESS"
             
         except Exception as e:
@@ -1,47 +1,114 @@
 """
 Analytics Pixel - Vercel Serverless Function (Multi-tenant)
 Versión: 2.0.0 - Con soporte para eventos personalizados y e-commerce
-Usa REST API de Supabase directamente sin SDK
+Usa REST API de Supabase directamente sin SDK (cliente con pool keep-alive en _supabase.py)
 """
 
 from http.server import BaseHTTPRequestHandler
+import hashlib
 import json
 import os
-import re
+import sys
+import traceback
+import uuid
 from datetime import datetime
-from user_agents import parse
-import requests
+from urllib.parse import parse_qs, urlparse
 
-# Configuración de Supabase
-SUPABASE_URL = os.environ.get('SUPABASE_URL')
-SUPABASE_KEY = os.environ.get('SUPABASE_SERVICE_KEY')
+# Permite importar los módulos auxiliares (_*.py) de esta misma carpeta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# Headers para Supabase REST API
-def get_supabase_headers():
-    return {
-        'apikey': SUPABASE_KEY,
-        'Authorization': f'Bearer {SUPABASE_KEY}',
-        'Content-Type': 'application/json',
-        'Prefer': 'return=representation'
-    }
+import _obs as obs
+from _bots import get_detector
+from _cache import LRUCache, MISSING
+from _dimensions import DIMENSIONS_ENABLED, DimensionEncoder, fetch_dimension_values, parse_registered
+from _geo import geo_enabled, get_geo_stats, lookup_ip
+from _origins import OriginMatcher, get_origin_cache_stats
+from _schema import EVENT_VALIDATOR
+from _quota import QUOTA_ENABLED, QuotaTracker, TokenBucketLimiter
+from _rollup import ROLLUP_ENABLED, RollupAggregator
+from _spool import EventSpool, RejectedRowsError, SpoolFullError
+from _supabase import get_client, get_client_stats
+from _ua import classify_user_agent, get_ua_cache_stats, parse_user_agent
+
+
+# Caché de proyectos por tracking_code (persiste entre invocaciones warm)
+PROJECT_CACHE_TTL = float(os.environ.get('PROJECT_CACHE_TTL', '300'))
+PROJECT_CACHE_NEGATIVE_TTL = float(os.environ.get('PROJECT_CACHE_NEGATIVE_TTL', '60'))
+PROJECT_CACHE_MAX_SIZE = int(os.environ.get('PROJECT_CACHE_MAX_SIZE', '1000'))
+
+# Máximo de eventos aceptados en un único POST por lotes
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '500'))
+
+# Modo de ingesta: 'direct' (INSERT síncrono) o 'spool' (write-behind con spool local)
+INGEST_MODE = os.environ.get('INGEST_MODE', 'direct')
+
+# Cabecera Server-Timing con la duración de cada etapa (solo para depurar)
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+# Si se define, GET /api/track/metrics exige "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Filtro de event_id aceptados recientemente (reintentos del píxel, keepalive, SPA re-disparadas)
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', '1') == '1'
+DEDUP_MAX_EVENTS = int(os.environ.get('DEDUP_MAX_EVENTS', '50000'))
+DEDUP_WINDOW = float(os.environ.get('DEDUP_WINDOW', '600'))
+
+# Modo píxel de imagen (GET): salt del id de visitante diario que se genera sin cookies
+PIXEL_ID_SALT = os.environ.get('PIXEL_ID_SALT', '')
+
+# GIF transparente de 1x1 (43 bytes) que responde el modo píxel de imagen
+PIXEL_GIF = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\x00\x00\x00!\xf9\x04\x01\x00\x00\x00\x00'
+             b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+
+# Parámetros de GET /api/track que se copian tal cual al evento
+PIXEL_FIELDS = ('event_id', 'timestamp', 'user_id', 'session_id', 'event_type', 'event_name',
+                'page_url', 'page_title', 'referrer', 'screen_resolution', 'viewport_size',
+                'language', 'timezone')
 
-# Lista de User-Agents de bots conocidos
-BOT_PATTERNS = [
-    r'bot', r'crawler', r'spider', r'scraper', r'slurp', r'baidu',
-    r'bing', r'yandex', r'duckduck', r'teoma', r'ia_archiver',
-    r'googlebot', r'bingbot', r'slurp', r'duckduckbot', r'baiduspider',
-    r'yandexbot', r'facebookexternalhit', r'twitterbot', r'rogerbot',
-    r'linkedinbot', r'embedly', r'quora link preview', r'showyoubot',
-    r'outbrain', r'pinterest', r'developers.google.com/+/web/snippet'
-]
+_project_cache = LRUCache(max_size=PROJECT_CACHE_MAX_SIZE, ttl=PROJECT_CACHE_TTL)
+_recent_events = LRUCache(max_size=DEDUP_MAX_EVENTS, ttl=DEDUP_WINDOW)
+
+DUPLICATES_DROPPED = obs.REGISTRY.counter('accumetrics_events_duplicate_total',
+                                          'Eventos repetidos descartados por event_id (filter = sin llamar a Supabase)')
+
+def invalidate_project_cache(tracking_code: str = None):
+    """
+    Fuerza la invalidación de la caché de proyectos
+    Usar cuando se desactiva un proyecto o cambian sus allowed_domains.
+    Sin tracking_code vacía la caché completa.
+    """
+    if tracking_code is None:
+        _project_cache.clear()
+    else:
+        _project_cache.delete(tracking_code)
+
+def get_project_cache_stats() -> dict:
+    """Contadores de la caché de proyectos (hits/misses/evictions)"""
+    return _project_cache.stats()
+
+def is_recent_event(event_id) -> bool:
+    """¿Aceptó esta instancia el mismo event_id en los últimos DEDUP_WINDOW segundos?"""
+    if not DEDUP_ENABLED or not isinstance(event_id, str):
+        return False
+    return _recent_events.get(event_id) is not MISSING
+
+def remember_events(rows: list):
+    """Marca como vistos los eventos ya persistidos (nunca antes: un INSERT fallido debe poder reintentarse)"""
+    if not DEDUP_ENABLED:
+        return
+    for row in rows:
+        _recent_events.set(row['event_id'], True)
+
+def get_dedup_stats() -> dict:
+    """Contadores del filtro de event_id (hits = duplicados detectados)"""
+    return _recent_events.stats()
 
 def is_bot(user_agent: str) -> bool:
-    """Detecta si el User-Agent pertenece a un bot"""
-    ua_lower = user_agent.lower()
-    for pattern in BOT_PATTERNS:
-        if re.search(pattern, ua_lower):
-            return True
-    return False
+    """Detecta si el User-Agent pertenece a un bot (patrones en bot_patterns.txt)"""
+    return get_detector().is_bot(user_agent)
+
+def match_bot_rule(user_agent: str) -> str:
+    """Retorna el patrón de bot que coincide con el User-Agent, o None"""
+    return get_detector().match(user_agent)
 
 def anonymize_ip(ip: str) -> str:
     """Anonimiza una dirección IP (GDPR compliant)"""
@@ -57,21 +124,6 @@ def anonymize_ip(ip: str) -> str:
             return '.'.join(parts[:3]) + '.0'
     return 'unknown'
 
-def parse_user_agent(ua_string: str) -> dict:
-    """Parsea el User-Agent y extrae información"""
-    user_agent = parse(ua_string)
-    return {
-        'browser': user_agent.browser.family,
-        'browser_version': user_agent.browser.version_string,
-        'os': user_agent.os.family,
-        'os_version': user_agent.os.version_string,
-        'device': user_agent.device.family,
-        'is_mobile': user_agent.is_mobile,
-        'is_tablet': user_agent.is_tablet,
-        'is_pc': user_agent.is_pc,
-        'is_bot': user_agent.is_bot
-    }
-
 def get_client_ip(headers: dict) -> str:
     """Obtiene la IP real del cliente considerando proxies de Vercel"""
     forwarded = headers.get('x-forwarded-for', '')
@@ -84,130 +136,397 @@ def get_client_ip(headers: dict) -> str:
     
     return 'unknown'
 
+def daily_visitor_id(tracking_code: str, client_ip: str, user_agent: str) -> str:
+    """Id anónimo sin cookies que cambia cada día: hash de salt + fecha + tracking_code + IP + UA"""
+    day = datetime.utcnow().strftime('%Y-%m-%d')
+    key = f'{PIXEL_ID_SALT}|{day}|{tracking_code}|{client_ip}|{user_agent}'
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+def pixel_event(query: dict, headers, tracking_code: str, client_ip: str) -> dict:
+    """
+    Evento a partir de los parámetros de GET /api/track?tracking_code=...
+    El servidor rellena lo que falte: pageview, page_url (Referer), user_agent, ids y timestamp.
+    custom_params se pasan como cp.<nombre>=<valor>
+    """
+    event = {name: query[name][0] for name in PIXEL_FIELDS if name in query}
+    custom_params = {name[3:]: values[0] for name, values in query.items() if name.startswith('cp.')}
+    user_agent = headers.get('User-Agent', '')
+    
+    if 'event_id' not in event:
+        event['event_id'] = str(uuid.uuid4())
+    event.setdefault('timestamp', datetime.utcnow().isoformat() + 'Z')
+    event.setdefault('event_type', 'pageview')
+    event.setdefault('page_url', headers.get('Referer', ''))
+    event['user_agent'] = user_agent
+    if 'user_id' not in event:
+        event['user_id'] = daily_visitor_id(tracking_code, client_ip, user_agent)
+    # Sin cookies no hay sesión real: se agrupa por visitante y día
+    event.setdefault('session_id', event['user_id'])
+    event['custom_params'] = custom_params
+    return event
+
 def get_project_info(tracking_code: str) -> dict:
-    """Obtiene información del proyecto desde el tracking_code usando REST API"""
+    """Obtiene información del proyecto desde el tracking_code (con caché en memoria)"""
+    cached = _project_cache.get(tracking_code)
+    if cached is not MISSING:
+        return cached
+    
+    found, project = fetch_project_info(tracking_code)
+    if project:
+        # Allowlist compilada una vez y reutilizada mientras el proyecto siga en caché
+        project['origin_matcher'] = OriginMatcher(project.get('allowed_domains'))
+        _project_cache.set(tracking_code, project)
+    elif found:
+        # Caché negativa: tracking_code desconocido o proyecto inactivo
+        _project_cache.set(tracking_code, None, ttl=PROJECT_CACHE_NEGATIVE_TTL)
+    return project
+
+def fetch_project_info(tracking_code: str) -> tuple:
+    """
+    Obtiene información del proyecto desde el tracking_code usando REST API
+    Retorna (definitive, project): definitive es False si Supabase falló,
+    para no cachear errores transitorios como "proyecto inexistente"
+    """
     try:
-        print(f"[DEBUG] Fetching project for tracking_code: {tracking_code}")
+        obs.debug("Fetching project", tracking_code=tracking_code)
         
-        url = f"{SUPABASE_URL}/rest/v1/projects"
         params = {
             'tracking_code': f'eq.{tracking_code}',
             'select': 'project_id,client_id,is_active,allowed_domains'
         }
         
-        response = requests.get(url, headers=get_supabase_headers(), params=params, timeout=10)
-        
-        print(f"[DEBUG] Response status: {response.status_code}")
+        response = get_client().select('projects', params)
         
         if response.status_code == 200:
             data = response.json()
             if data and len(data) > 0 and data[0].get('is_active'):
-                print(f"[DEBUG] Project found: {data[0]['project_id']}")
-                return data[0]
+                obs.debug("Project found", project_id=data[0]['project_id'])
+                return True, data[0]
+            
+            obs.debug("Project not found or inactive", tracking_code=tracking_code)
+            return True, None
         
-        print(f"[DEBUG] Project not found or inactive")
-        return None
+        obs.error("Unexpected response fetching project", status=response.status_code)
+        return False, None
         
     except Exception as e:
-        print(f"[ERROR] Error getting project info: {str(e)}")
-        return None
+        obs.error("Error getting project info", error=str(e))
+        return False, None
+
+def sync_client_usage(period: str, increments: dict) -> dict:
+    """
+    Envía incrementos de uso por lotes (RPC increment_client_usage)
+    Retorna {client_id: (event_count, monthly_event_limit)} con los totales globales
+    """
+    payload = [{'client_id': client_id, 'count': count} for client_id, count in increments.items()]
+    response = get_client().rpc('increment_client_usage', {'p_period': period, 'p_increments': payload})
+    if response.status_code != 200:
+        raise RuntimeError(f"increment_client_usage returned {response.status_code}: {response.text}")
+    return {
+        str(row['client_id']): (row['event_count'], row.get('monthly_event_limit'))
+        for row in response.json()
+    }
+
+_quota = QuotaTracker(sync_client_usage)
+_rate_limiter = TokenBucketLimiter()
+
+def merge_rollups(rows: list):
+    """Envía los agregados parciales de esta instancia (RPC merge_events_rollup)"""
+    response = get_client().rpc('merge_events_rollup', {'p_rows': rows})
+    if response.status_code not in (200, 204):
+        raise RuntimeError(f"merge_events_rollup returned {response.status_code}: {response.text}")
+
+_rollup = RollupAggregator(merge_rollups)
+
+def register_dimension_values(values: list) -> dict:
+    """Registra de una vez los valores nuevos de dimensiones (RPC register_dimension_values) y devuelve sus ids"""
+    response = get_client().rpc('register_dimension_values', {'p_values': values}, retry=True)
+    if response.status_code != 200:
+        raise RuntimeError(f"register_dimension_values returned {response.status_code}: {response.text}")
+    return parse_registered(response.json())
+
+_dimensions = DimensionEncoder(register_dimension_values, lambda ids: fetch_dimension_values(get_client(), ids))
+
+def compact_rows(rows: list) -> list:
+    """Con DIMENSIONS_ENABLED, filas con ids de dimension_values; si no se pueden registrar, las de texto"""
+    if not DIMENSIONS_ENABLED:
+        return rows
+    try:
+        return _dimensions.encode(rows)
+    except Exception as e:
+        obs.error("Dimension encoding failed, inserting plain rows", error=str(e))
+        return rows
 
 def check_client_limit(client_id: str) -> bool:
-    """Verifica si el cliente ha excedido su límite de eventos"""
+    """
+    Verifica si el cliente ha excedido su límite mensual de eventos y, si no, reserva el evento
+    Si el evento no llega a guardarse hay que devolverlo con release_usage()
+    """
     try:
-        # Por ahora, siempre retorna True (sin límite)
-        # TODO: Implementar lógica de límites si es necesario
-        return True
+        return not QUOTA_ENABLED or _quota.allow(client_id)
     except Exception as e:
-        print(f"[ERROR] Error checking client limit: {str(e)}")
+        obs.error("Error checking client limit", error=str(e))
         return True
 
 def verify_domain(origin: str, allowed_domains: list) -> bool:
-    """Verifica si el origen está en la lista de dominios permitidos"""
-    if not allowed_domains:
+    """Verifica si el origen está en la lista de dominios permitidos (ver _origins.py)"""
+    return OriginMatcher(allowed_domains).match(origin)
+
+def insert_rows(rows: list) -> bool:
+    """
+    Inserta eventos en Supabase con un único INSERT masivo que ignora event_id ya existentes
+    (on_conflict=event_id), así que reenviar filas no las duplica. Retorna False ante un fallo
+    transitorio (5xx, 408/429); un 4xx es definitivo: RejectedRowsError para que el spool no
+    reintente el lote indefinidamente
+    """
+    response = get_client().insert(
+        'events_raw', compact_rows(rows),
+        params={'on_conflict': 'event_id'},
+        prefer=['resolution=ignore-duplicates']
+    )
+    if response.status_code in [200, 201]:
+        obs.debug("Events inserted", rows=len(rows))
         return True
+    if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+        raise RejectedRowsError(f"events_raw returned {response.status_code}: {response.text}")
+    obs.error("Insert failed", status=response.status_code, response=response.text)
+    return False
+
+_spool = None
+
+def get_spool() -> EventSpool:
+    """Spool write-behind del proceso (se crea y arranca su flusher en el primer uso)"""
+    global _spool
+    if _spool is None:
+        _spool = EventSpool(insert_rows)
+        _spool.start()
+    return _spool
+
+def _runtime_collector() -> list:
+    """Gauges del pool de Supabase y del spool para /metrics"""
+    samples = []
+    pool = get_client_stats()
+    if pool:
+        samples.append(('accumetrics_supabase_requests_total', 'Peticiones HTTP a Supabase', 'counter', {}, pool['requests']))
+        samples.append(('accumetrics_supabase_retries_total', 'Reintentos a Supabase', 'counter', {}, pool['retries']))
+        samples.append(('accumetrics_supabase_connections_opened_total', 'Conexiones abiertas por el pool', 'counter', {}, pool['connections_opened']))
+    if QUOTA_ENABLED:
+        quota = _quota.stats()
+        samples.append(('accumetrics_quota_pending_events', 'Eventos aún no sincronizados con client_usage', 'gauge', {}, quota['pending_events']))
+        samples.append(('accumetrics_quota_sync_failures_total', 'Sincronizaciones de cuota fallidas', 'counter', {}, quota['sync_failures']))
+    if ROLLUP_ENABLED:
+        rollup = _rollup.stats()
+        samples.append(('accumetrics_rollup_pending_events', 'Eventos aún no enviados a events_rollup', 'gauge', {}, rollup['pending_events']))
+        samples.append(('accumetrics_rollup_flush_failures_total', 'Envíos de agregados fallidos', 'counter', {}, rollup['flush_failures']))
+    if _spool is not None:
+        stats = _spool.stats()
+        samples.append(('accumetrics_spool_backlog_bytes', 'Bytes pendientes de drenar en el spool', 'gauge', {}, stats['backlog_bytes']))
+        samples.append(('accumetrics_spool_flushed_total', 'Eventos drenados del spool', 'counter', {}, stats['flushed']))
+        samples.append(('accumetrics_spool_dead_lettered_total', 'Filas rechazadas movidas a events.dead.jsonl', 'counter', {}, stats['dead_lettered']))
+        samples.append(('accumetrics_spool_breaker_open', 'Circuit breaker del spool abierto (1) o no (0)', 'gauge', {},
+                        0 if stats['breaker']['state'] == 'closed' else 1))
+    return samples
+
+obs.REGISTRY.register_collector(obs.cache_collector('project', get_project_cache_stats))
+obs.REGISTRY.register_collector(obs.cache_collector('user_agent', get_ua_cache_stats))
+obs.REGISTRY.register_collector(obs.cache_collector('origin', get_origin_cache_stats))
+obs.REGISTRY.register_collector(obs.cache_collector('geo', get_geo_stats))
+obs.REGISTRY.register_collector(obs.cache_collector('dimension', lambda: _dimensions.stats() if DIMENSIONS_ENABLED else {}))
+obs.REGISTRY.register_collector(obs.cache_collector('event_id', get_dedup_stats))
+obs.REGISTRY.register_collector(_runtime_collector)
+
+def release_usage(rows: list):
+    """Devuelve al uso mensual las reservas de eventos validados que no se guardaron"""
+    if not QUOTA_ENABLED:
+        return
+    counts = {}
+    for row in rows:
+        counts[row['client_id']] = counts.get(row['client_id'], 0) + 1
+    for client_id, count in counts.items():
+        _quota.release(client_id, count)
+
+def aggregate_events(rows: list):
+    """Suma los eventos aceptados a los agregados por proyecto y franja (events_rollup)"""
+    if not ROLLUP_ENABLED:
+        return
+    try:
+        _rollup.add(rows)
+    except Exception as e:
+        obs.error("Rollup error", error=str(e))
+
+def sync_usage():
+    """Sincroniza el uso mensual si algún cliente superó su holgura (también a mitad de importación)"""
+    if not QUOTA_ENABLED:
+        return
+    try:
+        _quota.maybe_sync()
+    except Exception as e:
+        obs.error("Quota sync error", error=str(e))
+
+def run_deferred_work():
+    """Trabajo que no debe retrasar la respuesta: drenar el spool, sincronizar cuotas y enviar agregados"""
+    flush_spool_if_due()
+    sync_usage()
+    if ROLLUP_ENABLED:
+        _rollup.maybe_flush()
+
+def drain_pending_work():
+    """Al parar un proceso de larga duración (serve.py): drenar el spool y enviar cuotas y agregados pendientes"""
+    if _spool is not None:
+        try:
+            _spool.stop(drain=True)
+        except Exception as e:
+            obs.error("Spool drain error", error=str(e))
+    if QUOTA_ENABLED:
+        _quota.sync()
+    if ROLLUP_ENABLED:
+        _rollup.flush()
+
+def store_events(rows: list) -> bool:
+    """Persiste eventos enriquecidos según INGEST_MODE"""
+    if INGEST_MODE == 'spool':
+        try:
+            get_spool().append(rows)
+            return True
+        except (SpoolFullError, OSError) as e:
+            # Sin spool disponible: intentar el INSERT directo antes de perder el evento
+            obs.error("Spool append failed, inserting directly", error=str(e))
     
-    from urllib.parse import urlparse
-    origin_domain = urlparse(origin).netloc if origin else ''
+    try:
+        return insert_rows(rows)
+    except Exception as e:
+        obs.error("Error inserting events", rows=len(rows), error=str(e))
+        return False
+
+def flush_spool_if_due():
+    """Drena el spool si toca; se llama después de responder al cliente"""
+    if INGEST_MODE != 'spool':
+        return
+    try:
+        get_spool().maybe_flush()
+    except Exception as e:
+        obs.error("Spool flush error", error=str(e))
+
+class EventError(Exception):
+    """
+    Evento rechazado: lleva el código HTTP y el mensaje de error para el cliente,
+    y un código de motivo estable para las métricas
+    """
     
-    for domain in allowed_domains:
-        if domain == '*' or domain in origin_domain or origin_domain in domain:
-            return True
+    def __init__(self, code: int, message: str, reason: str = 'invalid_event', errors: list = None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.reason = reason
+        # Todos los errores del evento (solo con SCHEMA_COLLECT_ALL_ERRORS=1)
+        self.errors = errors
+
+class DuplicateEvent(Exception):
+    """El event_id ya se aceptó hace poco: se responde como aceptado sin volver a insertarlo"""
+
+def extract_batch(payload):
+    """
+    Retorna la lista de eventos si el payload es un lote
+    (array JSON o sobre {"events": [...]}), o None si es un evento individual
+    """
+    if isinstance(payload, list):
+        return payload
+    if isinstance(payload, dict) and isinstance(payload.get('events'), list):
+        return payload['events']
+    return None
+
+def resolve_project(tracking_code: str, timer: obs.StageTimer = None) -> dict:
+    """Obtiene el proyecto activo del tracking_code o lanza EventError"""
+    if not tracking_code:
+        raise EventError(400, "Missing tracking_code", 'missing_tracking_code')
     
-    return False
+    # Obtener información del proyecto
+    timer = timer or obs.StageTimer()
+    with timer.stage('lookup'):
+        project_info = get_project_info(tracking_code)
+    
+    if not project_info:
+        raise EventError(401, "Invalid tracking_code or inactive project", 'invalid_tracking_code')
+    
+    return project_info
 
-def validate_ecommerce_data(ecommerce_data: dict) -> tuple:
+def process_event(event_data: dict, project_info: dict, origin: str, client_ip: str,
+                  timer: obs.StageTimer = None, rate_limit: bool = True) -> dict:
     """
-    Valida los datos de e-commerce
-    Retorna (is_valid, error_message)
+    Valida y enriquece un evento para events_raw
+    Lanza EventError si el evento debe rechazarse
+    rate_limit=False omite el token bucket por tracking_code (importaciones autenticadas)
     """
-    if not ecommerce_data:
-        return True, None
+    timer = timer or obs.StageTimer()
+    project_id = project_info['project_id']
+    client_id = project_info['client_id']
+    origin_matcher = project_info.get('origin_matcher') or OriginMatcher(project_info.get('allowed_domains'))
     
-    # Validar campos obligatorios para purchase
-    if not ecommerce_data.get('transaction_id'):
-        return False, "ecommerce_data.transaction_id is required"
+    # Verificar origen si hay restricciones de dominio
+    with timer.stage('domain'):
+        if not origin_matcher.match(origin):
+            raise EventError(403, "Domain not allowed", 'domain_not_allowed')
     
-    if 'value' not in ecommerce_data:
-        return False, "ecommerce_data.value is required"
+    # Repeticiones del mismo evento: no consumen cuota ni llaman a Supabase
+    if is_recent_event(event_data.get('event_id')):
+        raise DuplicateEvent(event_data['event_id'])
     
-    try:
-        value = float(ecommerce_data['value'])
-        if value < 0:
-            return False, "ecommerce_data.value must be >= 0"
-    except (ValueError, TypeError):
-        return False, "ecommerce_data.value must be a number"
+    # Rate limit por tracking_code (proyecto)
+    if rate_limit:
+        with timer.stage('quota'):
+            if not _rate_limiter.allow(project_id):
+                raise EventError(429, "Rate limit exceeded", 'rate_limited')
     
-    # Validar items si existe
-    if 'items' in ecommerce_data:
-        if not isinstance(ecommerce_data['items'], list):
-            return False, "ecommerce_data.items must be an array"
-        
-        for idx, item in enumerate(ecommerce_data['items']):
-            if not isinstance(item, dict):
-                return False, f"ecommerce_data.items[{idx}] must be an object"
-            
-            # Validar campos del item
-            if 'price' in item:
-                try:
-                    float(item['price'])
-                except (ValueError, TypeError):
-                    return False, f"ecommerce_data.items[{idx}].price must be a number"
-            
-            if 'quantity' in item:
-                try:
-                    int(item['quantity'])
-                except (ValueError, TypeError):
-                    return False, f"ecommerce_data.items[{idx}].quantity must be an integer"
+    # Validar y normalizar los campos del evento en una sola pasada (ver _schema.py)
+    with timer.stage('validate'):
+        record, errors = EVENT_VALIDATOR.validate(event_data)
+        if errors:
+            messages = [message for error in errors for message in error.messages]
+            raise EventError(400, messages[0], errors[0].reason, messages if len(messages) > 1 else None)
     
-    return True, None
-
-def insert_event(event_data: dict) -> bool:
-    """Inserta evento en Supabase usando REST API"""
+    # Límite mensual del cliente: reserva el evento, que ya no puede rechazarse salvo si falla el INSERT
+    with timer.stage('quota'):
+        if not check_client_limit(client_id):
+            raise EventError(429, "Monthly event limit exceeded", 'quota_exceeded')
+    
+    # Cualquier fallo a partir de aquí devuelve la reserva (el evento no llegará al INSERT)
     try:
-        print(f"[DEBUG] Inserting event: {event_data['event_id']}")
+        # País/región con la IP completa: es el único punto donde existe, después solo se guarda anonimizada
+        if geo_enabled():
+            with timer.stage('geo'):
+                geo = lookup_ip(client_ip)
         
-        url = f"{SUPABASE_URL}/rest/v1/events_raw"
+        # Anonimizar IP del cliente
+        anonymized_ip = anonymize_ip(client_ip)
         
-        response = requests.post(
-            url, 
-            headers=get_supabase_headers(), 
-            json=event_data,
-            timeout=10
-        )
+        # Parsear User-Agent y detectar bot (memoizados juntos por UA). A partir de aquí los campos se leen
+        # de record, ya normalizados (un user_agent numérico llega como str)
+        with timer.stage('ua'):
+            ua_data = classify_user_agent(record['user_agent'])
+            is_bot_detected = ua_data['is_bot']
         
-        print(f"[DEBUG] Insert response status: {response.status_code}")
+        obs.debug("Event validated", project_id=project_id, event_type=record['event_type'],
+                  event_name=record['event_name'], is_bot=is_bot_detected)
         
-        if response.status_code in [200, 201]:
-            print(f"[DEBUG] Event inserted successfully")
-            return True
-        else:
-            print(f"[ERROR] Insert failed: {response.text}")
-            return False
-            
-    except Exception as e:
-        print(f"[ERROR] Error inserting event: {str(e)}")
-        return False
+        # Completar el registro con los campos del servidor
+        record['project_id'] = project_id
+        record['client_id'] = client_id
+        record['ip_address'] = anonymized_ip
+        if geo_enabled():
+            record['country'], record['region'] = geo or (None, None)
+        record['device_type'] = record['device_type'] or ua_data.get('device', 'unknown')
+        record['browser'] = record['browser'] or ua_data.get('browser', 'unknown')
+        record['browser_version'] = ua_data.get('browser_version', '')
+        record['os'] = record['os'] or ua_data.get('os', 'unknown')
+        record['os_version'] = ua_data.get('os_version', '')
+        record['is_mobile'] = ua_data.get('is_mobile', False)
+        record['is_tablet'] = ua_data.get('is_tablet', False)
+        record['is_bot'] = is_bot_detected
+        record['processed_at'] = datetime.utcnow().isoformat()
+        return record
+    except Exception:
+        release_usage([{'client_id': client_id}])
+        raise
 
 class handler(BaseHTTPRequestHandler):
     """Handler principal para Vercel Serverless Function"""
@@ -230,14 +549,22 @@ class handler(BaseHTTPRequestHandler):
     
     def do_OPTIONS(self):
         """Maneja preflight CORS requests"""
-        print("[INFO] OPTIONS request received")
         self.send_response(200)
         self._set_cors_headers()
         self.end_headers()
     
     def do_GET(self):
-        """Maneja GET requests - solo para testing"""
-        print("[INFO] GET request received")
+        """Maneja GET requests: métricas (/metrics) o estado - solo para testing"""
+        url = urlparse(self.path)
+        if url.path.rstrip('/').endswith('/metrics') or 'metrics' in url.query.split('&'):
+            self.send_metrics()
+            return
+        
+        query = parse_qs(url.query)
+        if 'tracking_code' in query:
+            self.handle_pixel(query)
+            return
+        
         self.send_response(200)
         self._set_cors_headers()
         self.send_header('Content-Type', 'application/json')
@@ -246,168 +573,299 @@ class handler(BaseHTTPRequestHandler):
             "status": "ok",
             "message": "AccuMetrics API v2.0.0 - Custom Events & E-commerce",
             "endpoint": "/api/track",
-            "methods": ["POST", "OPTIONS"],
+            "methods": ["POST", "OPTIONS", "GET (pixel)"],
+            "batch": {"max_events": MAX_BATCH_SIZE},
+            "project_cache": get_project_cache_stats(),
+            "ua_cache": get_ua_cache_stats(),
+            "origin_cache": get_origin_cache_stats(),
+            "geo": get_geo_stats() if geo_enabled() else None,
+            "dimensions": _dimensions.stats() if DIMENSIONS_ENABLED else None,
+            "dedup": get_dedup_stats() if DEDUP_ENABLED else None,
+            "supabase_pool": get_client_stats(),
+            "ingest_mode": INGEST_MODE,
+            "spool": get_spool().stats() if INGEST_MODE == 'spool' else None,
+            "quota": _quota.stats() if QUOTA_ENABLED else None,
+            "rollup": _rollup.stats() if ROLLUP_ENABLED else None,
             "features": [
                 "pageview tracking",
                 "custom events",
                 "e-commerce (purchase)",
+                "batch ingestion",
+                "text/plain beacons (no preflight)",
+                "image pixel (GET)",
+                "IP geolocation (local database)",
+                "dictionary-encoded dimensions",
+                "prometheus metrics",
                 "dataLayer integration"
             ]
         }
         self.wfile.write(json.dumps(response).encode('utf-8'))
     
     def do_POST(self):
-        """Procesa evento de tracking"""
-        print("[INFO] POST request received")
+        """Procesa evento de tracking (un objeto, un array o un sobre {"events": [...]})"""
+        self.timer = obs.StageTimer()
         try:
-            # Obtener tracking_code del header o del body
-            tracking_code = self.headers.get('X-Tracking-Code')
+            # tracking_code de la cabecera o de la query string (si no, del body)
+            query = parse_qs(urlparse(self.path).query)
+            header_tracking_code = self.headers.get('X-Tracking-Code') or query.get('tracking_code', [None])[0]
             
-            # Leer body
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length)
-            event_data = json.loads(body.decode('utf-8'))
+            # Leer body: JSON enviado como application/json o como text/plain (petición CORS
+            # "simple", sin preflight)
+            with self.timer.stage('read'):
+                content_length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(content_length)
+                payload = json.loads(body.decode('utf-8'))
             
-            # Si no está en el header, buscar en el body
-            if not tracking_code:
-                tracking_code = event_data.get('tracking_code')
-            
-            if not tracking_code:
-                self.send_error_response(400, "Missing tracking_code")
-                return
-            
-            print(f"[INFO] Tracking code: {tracking_code}")
-            
-            # Obtener información del proyecto
-            project_info = get_project_info(tracking_code)
-            
-            if not project_info:
-                self.send_error_response(401, "Invalid tracking_code or inactive project")
-                return
-            
-            project_id = project_info['project_id']
-            client_id = project_info['client_id']
-            allowed_domains = project_info.get('allowed_domains', [])
-            
-            print(f"[INFO] Project ID: {project_id}, Client ID: {client_id}")
-            
-            # Verificar origen si hay restricciones de dominio
             origin = self.headers.get('Origin', '')
-            if allowed_domains and not verify_domain(origin, allowed_domains):
-                self.send_error_response(403, "Domain not allowed")
-                return
+            client_ip = get_client_ip(dict(self.headers))
             
-            # Verificar límite de eventos del cliente
-            if not check_client_limit(client_id):
-                self.send_error_response(429, "Monthly event limit exceeded")
+            events = extract_batch(payload)
+            if events is not None:
+                # Sobre {"tracking_code": ..., "events": [...]} (cola del píxel)
+                envelope_tracking_code = payload.get('tracking_code') if isinstance(payload, dict) else None
+                self.handle_batch(events, header_tracking_code, origin, client_ip, envelope_tracking_code)
                 return
             
-            # Validar campos obligatorios
-            required_fields = ['event_id', 'timestamp', 'user_id', 'session_id', 
-                             'event_type', 'page_url', 'user_agent']
-            
-            for field in required_fields:
-                if field not in event_data:
-                    self.send_error_response(400, f"Missing required field: {field}")
-                    return
+            if not isinstance(payload, dict):
+                raise EventError(400, "Event must be a JSON object")
             
-            # Validar event_type
-            valid_event_types = ['pageview', 'event']
-            if event_data['event_type'] not in valid_event_types:
-                self.send_error_response(400, f"Invalid event_type. Must be one of: {valid_event_types}")
+            tracking_code = header_tracking_code or payload.get('tracking_code')
+            if not self.accept_event(payload, tracking_code, origin, client_ip):
+                self.send_error_response(500, "Failed to insert event", 'insert_failed')
                 return
             
-            # Si es un evento custom, validar event_name
-            if event_data['event_type'] == 'event':
-                if not event_data.get('event_name'):
-                    self.send_error_response(400, "event_name is required for event_type='event'")
-                    return
-                
-                print(f"[INFO] Custom event: {event_data['event_name']}")
-            
-            # Validar datos de e-commerce si existen
-            ecommerce_data = event_data.get('ecommerce_data')
-            if ecommerce_data:
-                is_valid, error_msg = validate_ecommerce_data(ecommerce_data)
-                if not is_valid:
-                    self.send_error_response(400, f"Invalid ecommerce_data: {error_msg}")
-                    return
-                print(f"[INFO] E-commerce event: {ecommerce_data.get('transaction_id')}")
-            
-            # Obtener IP del cliente
-            headers_dict = dict(self.headers)
-            client_ip = get_client_ip(headers_dict)
-            anonymized_ip = anonymize_ip(client_ip)
-            
-            # Parsear User-Agent
-            ua_data = parse_user_agent(event_data['user_agent'])
-            
-            # Detectar bot
-            is_bot_detected = is_bot(event_data['user_agent']) or ua_data.get('is_bot', False)
-            
-            # Construir registro enriquecido
-            enriched_data = {
-                'event_id': event_data['event_id'],
-                'project_id': project_id,
-                'client_id': client_id,
-                'timestamp': event_data['timestamp'],
-                'user_id': event_data['user_id'],
-                'session_id': event_data['session_id'],
-                'event_type': event_data['event_type'],
-                'event_name': event_data.get('event_name') or ('pageview' if event_data['event_type'] == 'pageview' else None),  # Si es pageview y no tiene event_name, asignar 'pageview'
-                'page_url': event_data['page_url'],
-                'page_title': event_data.get('page_title', ''),
-                'referrer': event_data.get('referrer', ''),
-                'user_agent': event_data['user_agent'],
-                'ip_address': anonymized_ip,
-                'device_type': event_data.get('device_type') or ua_data.get('device', 'unknown'),
-                'browser': event_data.get('browser') or ua_data.get('browser', 'unknown'),
-                'browser_version': ua_data.get('browser_version', ''),
-                'os': event_data.get('os') or ua_data.get('os', 'unknown'),
-                'os_version': ua_data.get('os_version', ''),
-                'is_mobile': ua_data.get('is_mobile', False),
-                'is_tablet': ua_data.get('is_tablet', False),
-                'is_bot': is_bot_detected,
-                'screen_resolution': event_data.get('screen_resolution'),
-                'viewport_size': event_data.get('viewport_size'),
-                'language': event_data.get('language'),
-                'timezone': event_data.get('timezone'),
-                'custom_params': event_data.get('custom_params', {}),
-                'ecommerce_data': ecommerce_data,  # Nuevo campo
-                'processed_at': datetime.utcnow().isoformat()
-            }
-            
-            # Insertar en Supabase
-            success = insert_event(enriched_data)
-            
-            if not success:
-                self.send_error_response(500, "Failed to insert event")
-                return
-            
-            print(f"[INFO] Event processed successfully")
-            
             # Responder con éxito
-            self.send_response(204)
-            self._set_cors_headers()
-            self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-            self.send_header('Pragma', 'no-cache')
-            self.send_header('Expires', '0')
-            self.end_headers()
+            self.send_accepted()
+            run_deferred_work()
             
+        except DuplicateEvent as e:
+            DUPLICATES_DROPPED.inc(source='filter')
+            obs.debug("Duplicate event dropped", event_id=str(e))
+            self.send_accepted()
+        except EventError as e:
+            self.send_error_response(e.code, e.message, e.reason, errors=e.errors)
         except json.JSONDecodeError:
-            print("[ERROR] JSON decode error")
-            self.send_error_response(400, "Invalid JSON")
+            self.send_error_response(400, "Invalid JSON", 'invalid_json')
         except Exception as e:
-            print(f"[ERROR] Exception: {str(e)}")
-            import traceback
-            print(f"[ERROR] Traceback: {traceback.format_exc()}")
-            self.send_error_response(500, f"Internal server error")
+            obs.error("Unhandled exception", error=str(e), traceback=traceback.format_exc())
+            self.send_error_response(500, f"Internal server error", 'internal_error')
+    
+    def accept_event(self, event_data: dict, tracking_code: str, origin: str, client_ip: str) -> bool:
+        """
+        Valida, enriquece y persiste un evento individual
+        Retorna False si falla el INSERT (la reserva de cuota se devuelve); lanza EventError o DuplicateEvent
+        """
+        project_info = resolve_project(tracking_code, self.timer)
+        enriched_data = process_event(event_data, project_info, origin, client_ip, self.timer)
+        
+        # Insertar en Supabase (o en el spool local en modo write-behind)
+        with self.timer.stage('insert'):
+            success = store_events([enriched_data])
+        if not success:
+            release_usage([enriched_data])
+            return False
+        
+        remember_events([enriched_data])
+        aggregate_events([enriched_data])
+        obs.EVENTS_ACCEPTED.inc()
+        obs.debug("Event processed", event_id=enriched_data['event_id'])
+        return True
+    
+    def handle_pixel(self, query: dict):
+        """
+        Modo píxel de imagen: GET /api/track?tracking_code=...&page_url=... (sin JS, emails)
+        Siempre responde el GIF, también si el evento se rechaza, para no mostrar una imagen rota;
+        el motivo va en la cabecera X-AccuMetrics-Error y en las métricas
+        """
+        self.timer = obs.StageTimer()
+        error = None
+        accepted = False
+        try:
+            tracking_code = query['tracking_code'][0]
+            client_ip = get_client_ip(dict(self.headers))
+            event_data = pixel_event(query, self.headers, tracking_code, client_ip)
+            # Las imágenes no envían Origin: el dominio se verifica con el Referer
+            origin = self.headers.get('Origin') or self.headers.get('Referer', '')
+            accepted = self.accept_event(event_data, tracking_code, origin, client_ip)
+            if not accepted:
+                error = ("Failed to insert event", 'insert_failed')
+        except DuplicateEvent:
+            DUPLICATES_DROPPED.inc(source='filter')
+        except EventError as e:
+            error = (e.message, e.reason)
+        except Exception as e:
+            obs.error("Unhandled exception", error=str(e), traceback=traceback.format_exc())
+            error = ("Internal server error", 'internal_error')
+        
+        if error:
+            obs.EVENTS_REJECTED.inc(reason=error[1])
+            obs.info("Pixel event rejected", error=error[0])
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/gif')
+        self.send_header('Content-Length', str(len(PIXEL_GIF)))
+        self._set_no_cache_headers()
+        self._set_timing_header()
+        if error:
+            self.send_header('X-AccuMetrics-Error', error[0])
+        self.end_headers()
+        self.wfile.write(PIXEL_GIF)
+        self.wfile.flush()
+        if accepted:
+            run_deferred_work()
+    
+    def handle_batch(self, events: list, header_tracking_code: str, origin: str, client_ip: str,
+                     envelope_tracking_code: str = None):
+        """
+        Valida y enriquece cada evento del lote y los inserta con un único INSERT
+        tracking_code: cabecera, luego el del propio evento y por último el del sobre
+        """
+        if not events:
+            self.send_error_response(400, "Empty events batch", 'empty_batch')
+            return
+        
+        if len(events) > MAX_BATCH_SIZE:
+            self.send_error_response(413, f"Batch too large. Max {MAX_BATCH_SIZE} events", 'batch_too_large')
+            return
+        
+        # Una sola resolución de proyecto por tracking_code distinto
+        projects = {}
+        results = []
+        rows = []
+        batch_ids = set()
+        duplicates = 0
+        
+        for idx, event_data in enumerate(events):
+            event_id = event_data.get('event_id') if isinstance(event_data, dict) else None
+            try:
+                if not isinstance(event_data, dict):
+                    raise EventError(400, "Event must be a JSON object")
+                
+                # El mismo event_id ya aceptado antes dentro del lote
+                if isinstance(event_id, str) and event_id in batch_ids:
+                    raise DuplicateEvent(event_id)
+                
+                tracking_code = header_tracking_code or event_data.get('tracking_code') or envelope_tracking_code
+                if tracking_code not in projects:
+                    try:
+                        projects[tracking_code] = resolve_project(tracking_code, self.timer)
+                    except EventError as e:
+                        projects[tracking_code] = e
+                
+                project_info = projects[tracking_code]
+                if isinstance(project_info, EventError):
+                    raise project_info
+                
+                row = process_event(event_data, project_info, origin, client_ip, self.timer)
+                rows.append(row)
+                batch_ids.add(row['event_id'])
+                results.append({'index': idx, 'event_id': event_id, 'status': 'accepted'})
+            except DuplicateEvent:
+                duplicates += 1
+                results.append({'index': idx, 'event_id': event_id, 'status': 'duplicate'})
+            except EventError as e:
+                obs.EVENTS_REJECTED.inc(reason=e.reason)
+                results.append({
+                    'index': idx,
+                    'event_id': event_id,
+                    'status': 'rejected',
+                    'code': e.code,
+                    'error': e.message
+                })
+                if e.errors:
+                    results[-1]['errors'] = e.errors
+            except Exception as e:
+                # Un fallo inesperado en un evento no tumba el lote ni las reservas de cuota de los demás
+                obs.error("Unhandled exception in batch event", index=idx, error=str(e),
+                          traceback=traceback.format_exc())
+                obs.EVENTS_REJECTED.inc(reason='internal_error')
+                results.append({
+                    'index': idx,
+                    'event_id': event_id,
+                    'status': 'rejected',
+                    'code': 500,
+                    'error': "Internal server error"
+                })
+        
+        if rows:
+            with self.timer.stage('insert'):
+                success = store_events(rows)
+            if not success:
+                release_usage(rows)
+                self.send_error_response(500, "Failed to insert events", 'insert_failed', len(rows))
+                return
+            remember_events(rows)
+            aggregate_events(rows)
+        
+        accepted = len(rows)
+        rejected = len(events) - accepted - duplicates
+        obs.EVENTS_ACCEPTED.inc(accepted)
+        if duplicates:
+            DUPLICATES_DROPPED.inc(duplicates, source='filter')
+        obs.debug("Batch processed", accepted=accepted, rejected=rejected, duplicates=duplicates)
+        
+        self.send_response(200)
+        self._set_cors_headers()
+        self._set_no_cache_headers()
+        self._set_timing_header()
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        response = {
+            'accepted': accepted,
+            'rejected': rejected,
+            'duplicates': duplicates,
+            'results': results
+        }
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+        self.wfile.flush()
+        run_deferred_work()
+    
+    def _set_no_cache_headers(self):
+        """Evita que la respuesta se cachee"""
+        self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+        self.send_header('Pragma', 'no-cache')
+        self.send_header('Expires', '0')
+    
+    def _set_timing_header(self):
+        """Añade Server-Timing con la duración de cada etapa si SERVER_TIMING=1"""
+        timer = getattr(self, 'timer', None)
+        if SERVER_TIMING and timer and timer.stages:
+            self.send_header('Server-Timing', timer.server_timing())
+    
+    def send_metrics(self):
+        """Sirve las métricas del proceso en formato de texto de Prometheus"""
+        if METRICS_TOKEN and self.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            self.send_error_response(401, "Unauthorized")
+            return
+        body = obs.REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self._set_no_cache_headers()
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_accepted(self):
+        """204 sin cuerpo: evento aceptado (o repetido, que el cliente no necesita distinguir)"""
+        self.send_response(204)
+        self._set_cors_headers()
+        self._set_no_cache_headers()
+        self._set_timing_header()
+        self.end_headers()
+        self.wfile.flush()
     
-    def send_error_response(self, code: int, message: str):
-        """Envía respuesta de error"""
-        print(f"[ERROR] {code} - {message}")
+    def send_error_response(self, code: int, message: str, reason: str = None, events: int = 1,
+                            errors: list = None):
+        """Envía respuesta de error (y cuenta los eventos rechazados por motivo)"""
+        if reason:
+            obs.EVENTS_REJECTED.inc(events, reason=reason)
+        obs.log('error' if code >= 500 else 'info', "Request rejected", status=code, error=message)
         self.send_response(code)
         self.send_header('Content-Type', 'application/json')
         self._set_cors_headers()
+        self._set_timing_header()
         self.end_headers()
-        self.wfile.write(json.dumps({"error": message}).encode('utf-8'))
+        body = {"error": message}
+        if errors:
+            body["errors"] = errors
+        self.wfile.write(json.dumps(body).encode('utf-8'))
@@ -0,0 +1,46 @@
+"""
+Utilidades compartidas por los benchmarks
+Se ejecutan como scripts: `python benchmarks/bench_xxx.py`
+"""
+
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'api')
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+# Los módulos de api/ se importan igual que en Vercel
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+
+def load_lines(name: str) -> list:
+    """Lee un fichero de data/ ignorando líneas vacías y comentarios"""
+    with open(os.path.join(DATA_DIR, name), 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if line.strip() and not line.startswith('#')]
+
+
+def time_per_call(fn, inputs: list, min_time: float = 0.5) -> float:
+    """Microsegundos por llamada de fn(x) sobre inputs, repitiendo al menos min_time segundos"""
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for x in inputs:
+            fn(x)
+        calls += len(inputs)
+        elapsed = time.perf_counter() - start
+    return elapsed / calls * 1e6
+
+
+def write_results(name: str, data: dict) -> str:
+    """Guarda resultados en benchmarks/results/<name>.json"""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'{name}.json')
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+    return path
@@ -0,0 +1,201 @@
+"""
+Benchmark del archivo columnar (tools/export_events.py + tools/query_events.py) contra el fake PostgREST:
+- Exportación keyset completa e incremental (filas/s, tamaño del archivo frente al JSON de PostgREST)
+- Conteo, únicos, top y embudo sobre el archivo frente a paginar events_raw por REST y agregar en Python
+  (mismo resultado exigido en ambos)
+
+Requiere numpy. Uso: python benchmarks/bench_archive.py [--rows 200000]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from _common import BENCH_DIR, write_results
+from fake_postgrest import FakePostgREST
+
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'tools'))
+
+from _supabase import SupabaseClient
+from export_events import Exporter, keyset_params, watermark_of
+from query_events import Archive
+
+PROJECTS = ('project-a', 'project-b', 'project-c')
+DAYS = 30
+FUNNEL = ['pageview', 'add_to_cart', 'begin_checkout', 'purchase']
+BROWSERS = ('Chrome', 'Safari', 'Firefox', 'Edge', 'Samsung Internet')
+
+
+def make_rows(n: int, start: datetime, days: float = DAYS) -> list:
+    """Filas con la forma de events_raw: usuarios que avanzan (o no) por el embudo"""
+    rows = []
+    span = days * 86400
+    while len(rows) < n:
+        project = random.choice(PROJECTS)
+        user = f'user-{random.randint(1, n // 8)}'
+        session = str(uuid.uuid4())
+        moment = start + timedelta(seconds=random.uniform(0, span))
+        browser = random.choice(BROWSERS)
+        for step, name in enumerate(FUNNEL):
+            if step and random.random() > 0.45:
+                break
+            moment += timedelta(seconds=random.uniform(5, 900))
+            rows.append({
+                'event_id': str(uuid.uuid4()),
+                'timestamp': moment.isoformat(),
+                'user_id': user,
+                'session_id': session,
+                'event_type': 'pageview' if name == 'pageview' else 'event',
+                'event_name': name,
+                'page_url': f'https://shop.example.com/p/{random.randint(1, 2000)}',
+                'page_title': 'Producto',
+                'referrer': 'https://www.google.com/',
+                'user_agent': f'Mozilla/5.0 ({browser}) bench',
+                'device_type': 'mobile' if random.random() < 0.6 else 'desktop',
+                'browser': browser,
+                'browser_version': '120.0',
+                'os': random.choice(('Android', 'iOS', 'Windows', 'Mac OS X')),
+                'os_version': '14',
+                'screen_resolution': '390x844',
+                'viewport_size': '390x664',
+                'language': 'es-ES',
+                'timezone': 'Europe/Madrid',
+                'custom_params': {'variant': random.choice('AB')},
+                'ecommerce_data': {'transaction_id': str(uuid.uuid4()), 'value': 49.9, 'currency': 'EUR'}
+                if name == 'purchase' else None,
+                'project_id': project,
+                'client_id': 'client-1',
+                'ip_address': f'10.0.{random.randint(0, 255)}.{random.randint(0, 255)}',
+                'is_mobile': True,
+                'is_tablet': False,
+                'is_bot': random.random() < 0.05,
+                'processed_at': moment.replace(tzinfo=None).isoformat()
+            })
+    return rows[:n]
+
+
+def rest_rows(client, project_id: str, page_size: int = 1000):
+    """Lo que haría un dashboard sin archivo: paginar events_raw por PostgREST"""
+    until = datetime.now(timezone.utc).isoformat()
+    watermark = None
+    while True:
+        rows = client.select('events_raw', keyset_params(watermark, until, [project_id], page_size)).json()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        watermark = watermark_of(rows[-1])
+
+
+def rest_queries(client, project_id: str) -> dict:
+    count = 0
+    users = set()
+    browsers = {}
+    events = []
+    for row in rest_rows(client, project_id):
+        if row['event_type'] == 'pageview':
+            count += 1
+        users.add(row['user_id'])
+        browsers[row['browser']] = browsers.get(row['browser'], 0) + 1
+        if row['event_name'] in FUNNEL:
+            events.append((row['user_id'], row['timestamp'], FUNNEL.index(row['event_name'])))
+    # Embudo ordenado: primer paso k posterior al primer paso k-1
+    events.sort(key=lambda e: e[1])
+    reached = [{} for _ in FUNNEL]
+    for user, timestamp, step in events:
+        if user in reached[step]:
+            continue
+        if step == 0 or (user in reached[step - 1] and reached[step - 1][user] <= timestamp):
+            reached[step][user] = timestamp
+    top = sorted(browsers.items(), key=lambda item: -item[1])[:3]
+    return {'pageviews': count, 'uniques': len(users), 'top': [list(t) for t in top],
+            'funnel': [len(r) for r in reached]}
+
+
+def archive_queries(archive: Archive, project_id: str) -> dict:
+    return {
+        'pageviews': archive.count(project_id, where={'event_type': 'pageview'}),
+        'uniques': archive.uniques(project_id, 'user_id'),
+        'top': [list(t) for t in archive.top(project_id, 'browser', limit=3)],
+        'funnel': archive.funnel(project_id, FUNNEL)
+    }
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+    random.seed(7)
+
+    start = datetime.now(timezone.utc) - timedelta(days=DAYS + 2)
+    rows = make_rows(args.rows, start)
+    json_bytes = sum(len(json.dumps(row)) for row in rows)
+    root = tempfile.mkdtemp(prefix='accumetrics-archive-')
+    results = {'rows': args.rows}
+
+    with FakePostgREST(keep_rows=True) as fake:
+        fake.add_events(rows)
+        client = SupabaseClient(fake.url, 'bench', read_timeout=60)
+
+        exporter = Exporter(client, root, page_size=5000)
+        summary = exporter.run()
+        results['export'] = dict(summary, rows_per_second=int(summary['rows'] / max(summary['seconds'], 1e-9)),
+                                 json_mb=round(json_bytes / 1e6, 1),
+                                 archive_mb=round(directory_size(root) / 1e6, 1))
+        print(f"export: {summary['rows']} rows in {summary['seconds']} s "
+              f"({results['export']['rows_per_second']} rows/s), {summary['segments']} segments, "
+              f"JSON {results['export']['json_mb']} MB -> archive {results['export']['archive_mb']} MB")
+
+        # Eventos nuevos posteriores a la marca (y anteriores a ahora - lag)
+        extra = make_rows(1000, start + timedelta(days=DAYS + 1), days=0.5)
+        fake.add_events(extra)
+        incremental = Exporter(client, root, page_size=5000).run()
+        results['incremental_export'] = incremental
+        print(f"incremental export: {incremental['rows']} new rows in {incremental['seconds']} s")
+
+        project_id = PROJECTS[0]
+        t0 = time.perf_counter()
+        expected = rest_queries(client, project_id)
+        rest_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    got = archive_queries(Archive(root), project_id)
+    cold_seconds = time.perf_counter() - t0
+    warm_archive = Archive(root)
+    archive_queries(warm_archive, project_id)
+    t0 = time.perf_counter()
+    archive_queries(warm_archive, project_id)
+    warm_seconds = time.perf_counter() - t0
+
+    results['queries'] = {
+        'project_id': project_id,
+        'result': got,
+        'matches_rest': got == expected,
+        'rest_seconds': round(rest_seconds, 3),
+        'archive_cold_seconds': round(cold_seconds, 3),
+        'archive_warm_seconds': round(warm_seconds, 3),
+        'speedup_cold': round(rest_seconds / cold_seconds, 1),
+        'speedup_warm': round(rest_seconds / warm_seconds, 1)
+    }
+    print(f"queries ({project_id}): REST {rest_seconds:.2f} s, archive cold {cold_seconds:.3f} s "
+          f"({results['queries']['speedup_cold']}x), warm {warm_seconds:.3f} s "
+          f"({results['queries']['speedup_warm']}x), same result: {got == expected}")
+    if got != expected:
+        print(f"  REST:    {expected}\n  archive: {got}")
+
+    shutil.rmtree(root, ignore_errors=True)
+    print(f"results: {write_results('archive', results)}")
+
+
+if __name__ == '__main__':
+    main()
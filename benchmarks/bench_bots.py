@@ -0,0 +1,68 @@
+"""
+Benchmark del detector de bots: bucle de re.search por patrón (versión anterior)
+contra el BotDetector compilado en una sola alternancia
+
+Uso: python benchmarks/bench_bots.py
+"""
+
+import re
+
+from _common import load_lines, time_per_call, write_results
+
+from _bots import get_detector
+
+# Copia literal de la lista y el bucle que usaba api/track.py antes de _bots.py
+LEGACY_BOT_PATTERNS = [
+    r'bot', r'crawler', r'spider', r'scraper', r'slurp', r'baidu',
+    r'bing', r'yandex', r'duckduck', r'teoma', r'ia_archiver',
+    r'googlebot', r'bingbot', r'slurp', r'duckduckbot', r'baiduspider',
+    r'yandexbot', r'facebookexternalhit', r'twitterbot', r'rogerbot',
+    r'linkedinbot', r'embedly', r'quora link preview', r'showyoubot',
+    r'outbrain', r'pinterest', r'developers.google.com/+/web/snippet'
+]
+
+
+def legacy_is_bot(user_agent: str) -> bool:
+    ua_lower = user_agent.lower()
+    for pattern in LEGACY_BOT_PATTERNS:
+        if re.search(pattern, ua_lower):
+            return True
+    return False
+
+
+def main():
+    corpus = load_lines('user_agents.txt')
+    detector = get_detector()
+
+    disagreements = []
+    for ua in corpus:
+        old, rule = legacy_is_bot(ua), detector.match(ua)
+        if old != (rule is not None):
+            disagreements.append({'user_agent': ua, 'legacy': old, 'rule': rule})
+
+    humans = [ua for ua in corpus if not legacy_is_bot(ua)]
+    results = {
+        'corpus_size': len(corpus),
+        'bots_legacy': sum(legacy_is_bot(ua) for ua in corpus),
+        'bots_compiled': sum(detector.is_bot(ua) for ua in corpus),
+        'agreement': round(1 - len(disagreements) / len(corpus), 4),
+        'disagreements': disagreements,
+        'us_per_event': {
+            'legacy_loop': round(time_per_call(legacy_is_bot, corpus), 3),
+            'compiled': round(time_per_call(detector.is_bot, corpus), 3),
+            # Peor caso del bucle: navegadores reales recorren todos los patrones
+            'legacy_loop_humans_only': round(time_per_call(legacy_is_bot, humans), 3),
+            'compiled_humans_only': round(time_per_call(detector.is_bot, humans), 3)
+        }
+    }
+
+    for key, value in results['us_per_event'].items():
+        print(f"{key:28s} {value:10.3f} us")
+    print(f"agreement: {results['agreement']:.2%} ({len(disagreements)} disagreements)")
+    for d in disagreements:
+        print(f"  legacy={d['legacy']!s:5s} rule={d['rule']!r:40s} {d['user_agent'][:80]}")
+    print(f"results: {write_results('bots', results)}")
+
+
+if __name__ == '__main__':
+    main()
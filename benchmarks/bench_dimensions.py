@@ -0,0 +1,128 @@
+"""
+Benchmark del modo compacto de events_raw (api/_dimensions.py, DIMENSIONS_ENABLED):
+- Bytes de JSON por evento en el INSERT, filas de texto frente a filas con ids, y bytes de esos campos
+  en la fila de events_raw (texto frente a 9 integer)
+- Coste de encode() con la caché caliente y llamadas de registro con la caché fría
+- Throughput de INSERT contra el fake PostgREST: texto, compacto en frío (registra valores) y en caliente
+- decode() devuelve exactamente el texto original
+
+Uso: python benchmarks/bench_dimensions.py [--events 20000] [--batch 50] [--latency 0.002]
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+import uuid
+
+from _common import time_per_call, write_results
+from fake_postgrest import FakePostgREST
+from generators import custom_event, pageview, purchase, user_agents
+
+LANGUAGES = ('es-ES', 'es-MX', 'en-US', 'en-GB', 'fr-FR', 'de-DE', 'pt-BR')
+TIMEZONES = ('Europe/Madrid', 'America/Mexico_City', 'America/New_York', 'Europe/London', 'America/Sao_Paulo')
+SCREENS = ('1920x1080', '1536x864', '390x844', '412x915', '1440x900', '2560x1440', '360x800')
+
+
+def make_events(n: int) -> list:
+    agents = user_agents()
+    events = []
+    for _ in range(n):
+        kind = random.random()
+        agent = random.choice(agents)
+        event = (purchase('bench-code', user_agent=agent) if kind < 0.05 else
+                 custom_event('bench-code', user_agent=agent) if kind < 0.3 else
+                 pageview('bench-code', user_agent=agent))
+        # Que browser/os/device salgan del User-Agent, como en el píxel sin overrides
+        for field in ('device_type', 'browser', 'os'):
+            event.pop(field, None)
+        event['language'] = random.choice(LANGUAGES)
+        event['timezone'] = random.choice(TIMEZONES)
+        event['screen_resolution'] = random.choice(SCREENS)
+        events.append(event)
+    return events
+
+
+def fresh_ids(rows: list) -> list:
+    """Mismas filas con event_id nuevo (el fake ignora event_id repetidos)"""
+    return [dict(row, event_id=str(uuid.uuid4())) for row in rows]
+
+
+def insert_throughput(client, rows: list, batch: int, transform) -> dict:
+    start = time.perf_counter()
+    sent = 0
+    for i in range(0, len(rows), batch):
+        chunk = transform(rows[i:i + batch])
+        response = client.insert('events_raw', chunk, params={'on_conflict': 'event_id'},
+                                 prefer=['resolution=ignore-duplicates'])
+        assert response.status_code in (200, 201), response.text
+        sent += len(json.dumps(chunk))
+    seconds = time.perf_counter() - start
+    return {'rows_per_second': int(len(rows) / seconds), 'seconds': round(seconds, 3),
+            'request_bytes_per_event': round(sent / len(rows), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.002)
+    args = parser.parse_args()
+    random.seed(5)
+
+    with FakePostgREST(latency=args.latency) as fake:
+        os.environ['SUPABASE_URL'] = fake.url
+        os.environ['SUPABASE_SERVICE_KEY'] = 'bench'
+        import track
+        from _dimensions import DimensionEncoder
+        from _supabase import get_client
+
+        project = track.get_project_info('bench-code')
+        rows = [track.process_event(event, project, 'https://example.com', '203.0.113.9', rate_limit=False)
+                for event in make_events(args.events)]
+        client = get_client()
+        results = {'events': args.events, 'batch': args.batch, 'latency_ms': args.latency * 1000}
+
+        cold = DimensionEncoder(track.register_dimension_values)
+        plain_run = insert_throughput(client, fresh_ids(rows), args.batch, lambda chunk: chunk)
+        cold_run = insert_throughput(client, fresh_ids(rows), args.batch, cold.encode)
+        warm_run = insert_throughput(client, fresh_ids(rows), args.batch, cold.encode)
+        results['insert'] = {'plain': plain_run, 'compact_cold': dict(cold_run, **cold.stats()),
+                             'compact_warm': warm_run}
+        print(f"insert ({args.batch}/request, {args.latency * 1000:.0f} ms latency): "
+              f"plain {plain_run['rows_per_second']} rows/s, compact cold {cold_run['rows_per_second']} rows/s "
+              f"({cold.register_calls} register calls, {cold.registered} values), "
+              f"warm {warm_run['rows_per_second']} rows/s")
+
+        encoder = cold
+        single_plain = sum(len(json.dumps(row)) for row in rows) / len(rows)
+        single_compact = sum(len(json.dumps(encoder.encode([row])[0])) for row in rows) / len(rows)
+        stored = {field: sum(len(str(row.get(field) or '')) for row in rows) / len(rows) for field in encoder.fields}
+        results['payload'] = {
+            'plain_bytes_per_event': round(single_plain, 1),
+            'compact_bytes_per_event': round(single_compact, 1),
+            'reduction_pct': round((1 - single_compact / single_plain) * 100, 1),
+            'dimension_text_bytes_per_event': round(sum(stored.values()), 1),
+            'dimension_id_bytes_per_event': 4 * len(encoder.fields),
+            'distinct_values': len(fake.dimensions)
+        }
+        print(f"payload: {single_plain:.0f} -> {single_compact:.0f} bytes/event "
+              f"(-{results['payload']['reduction_pct']}%), {len(fake.dimensions)} distinct dimension values; "
+              f"stored per row: {sum(stored.values()):.0f} bytes of text -> {4 * len(encoder.fields)} bytes of ids")
+
+        sample = rows[:args.batch]
+        encode_us = time_per_call(lambda chunk: encoder.encode(chunk), [sample]) / len(sample)
+        results['encode_us_per_event'] = round(encode_us, 2)
+        print(f"encode (warm cache): {encode_us:.2f} us/event")
+
+        reader = DimensionEncoder(resolve_fn=lambda ids: track.fetch_dimension_values(client, ids))
+        decoded = reader.decode(encoder.encode(rows))
+        results['roundtrip_ok'] = decoded == rows
+        print(f"decode(encode(rows)) == rows: {results['roundtrip_ok']}")
+
+    print(f"results: {write_results('dimensions', results)}")
+
+
+if __name__ == '__main__':
+    main()
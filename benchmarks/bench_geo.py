@@ -0,0 +1,165 @@
+"""
+Benchmark de la geolocalización local de api/_geo.py con una base sintética del tamaño de las gratuitas:
+- Carga del CSV frente al formato compilado (mmap)
+- Búsqueda sin memoizar (un /24 o /48 distinto cada vez) y memoizada, en microsegundos
+- Mismo resultado que una búsqueda lineal sobre los rangos (muestra aleatoria)
+- Recarga en caliente: se reescribe el fichero y las búsquedas pasan a la base nueva
+
+Uso: python benchmarks/bench_geo.py [--v4-ranges 400000] [--v6-ranges 100000]
+"""
+
+import argparse
+import ipaddress
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from _common import time_per_call, write_results
+
+from _geo import GeoResolver, compile_database, load_database, read_csv
+
+COUNTRIES = ('ES', 'FR', 'DE', 'US', 'MX', 'AR', 'GB', 'IT', 'PT', 'BR', 'CO', 'CL', 'JP', 'CN', 'IN')
+REGIONS = ('Madrid', 'Catalonia', 'Andalusia', 'Ile-de-France', 'Bavaria', 'California', 'Texas', '')
+
+
+def write_ranges(path: str, v4_ranges: int, v6_ranges: int, country: str = None):
+    """
+    Rangos contiguos con huecos: IPv4 en bloques de /24 a /16, IPv6 dentro de bloques /32 de 2000::/3
+    terminando en cualquier /64 (muchos /48 quedan repartidos entre rango y hueco)
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('start_ip,end_ip,country,region\n')
+        step = (1 << 32) // v4_ranges
+        for i in range(v4_ranges):
+            start = i * step
+            end = start + random.randint(256, step) - 1
+            if random.random() < 0.05:
+                continue
+            f.write(f'{ipaddress.IPv4Address(start)},{ipaddress.IPv4Address(end)},'
+                    f'{country or random.choice(COUNTRIES)},{random.choice(REGIONS)}\n')
+        base = 0x2000 << 112
+        for i in range(v6_ranges):
+            start = base + (i << 96)
+            end = start + (random.randint(1, 1 << 32) << 64) - 1
+            f.write(f'{ipaddress.IPv6Address(start)},{ipaddress.IPv6Address(end)},'
+                    f'{country or random.choice(COUNTRIES)},{random.choice(REGIONS)}\n')
+
+
+def random_ips(n: int) -> list:
+    ips = []
+    for _ in range(n):
+        if random.random() < 0.8:
+            ips.append(str(ipaddress.IPv4Address(random.getrandbits(32))))
+        else:
+            ips.append(str(ipaddress.IPv6Address((0x2000 << 112) + random.getrandbits(112))))
+    return ips
+
+
+def boundary_ips(entries: list, n: int) -> list:
+    """IPs a ambos lados del final de rangos: el /24 o /48 que contiene el final queda repartido"""
+    ips = []
+    for version, start, end, country, region in random.sample(entries, n):
+        ips += [str(ipaddress.ip_address(end)), str(ipaddress.ip_address(end + 1))]
+    return ips
+
+
+def linear_lookup(entries: list, ip: str):
+    """Referencia: recorrer todos los rangos (IPv4 con la dirección completa, IPv6 con granularidad /64)"""
+    address = ipaddress.ip_address(ip)
+    number = int(address)
+    if address.version == 6:
+        number = number >> 64 << 64
+    for version, start, end, country, region in entries:
+        if version != address.version:
+            continue
+        if version == 6:
+            # Granularidad /64 de las tablas
+            start, end = start >> 64 << 64, (end >> 64 << 64) | ((1 << 64) - 1)
+        if start <= number <= end:
+            return country, region
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--v4-ranges', type=int, default=400000)
+    parser.add_argument('--v6-ranges', type=int, default=100000)
+    args = parser.parse_args()
+    random.seed(3)
+
+    root = tempfile.mkdtemp(prefix='accumetrics-geo-')
+    csv_path = os.path.join(root, 'ranges.csv')
+    bin_path = os.path.join(root, 'geo.bin')
+    write_ranges(csv_path, args.v4_ranges, args.v6_ranges)
+    results = {'v4_ranges': args.v4_ranges, 'v6_ranges': args.v6_ranges}
+
+    start = time.perf_counter()
+    csv_database = load_database(csv_path)
+    csv_seconds = time.perf_counter() - start
+    entries = read_csv(csv_path)
+    start = time.perf_counter()
+    compile_database(entries, bin_path)
+    compile_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    database = load_database(bin_path)
+    load_ms = (time.perf_counter() - start) * 1000
+    results['load'] = {'csv_seconds': round(csv_seconds, 2), 'compile_seconds': round(compile_seconds, 2),
+                       'compiled_load_ms': round(load_ms, 2), 'csv_mb': round(os.path.getsize(csv_path) / 1e6, 1),
+                       'compiled_mb': round(os.path.getsize(bin_path) / 1e6, 1)}
+    print(f"load: CSV {csv_seconds:.2f} s ({results['load']['csv_mb']} MB), compiled (mmap) {load_ms:.2f} ms "
+          f"({results['load']['compiled_mb']} MB)")
+
+    # Cada búsqueda sin memoizar: base nueva (caché vacía) y prefijos distintos
+    ips = random_ips(20000)
+    fresh = [load_database(bin_path) for _ in range(3)]
+    start = time.perf_counter()
+    for db in fresh:
+        for ip in ips:
+            db.lookup(ip)
+    uncached_us = (time.perf_counter() - start) / (len(ips) * len(fresh)) * 1e6
+    memo_ips = ips[:500]
+    for ip in memo_ips:
+        database.lookup(ip)
+    memoized_us = time_per_call(database.lookup, memo_ips)
+    baseline_us = time_per_call(ipaddress.ip_address, memo_ips)
+    results['lookup'] = {'uncached_us': round(uncached_us, 2), 'memoized_us': round(memoized_us, 3),
+                         'ipaddress_parse_us': round(baseline_us, 3)}
+    print(f"lookup: uncached {uncached_us:.2f} us, memoized {memoized_us:.3f} us "
+          f"(ipaddress.ip_address alone: {baseline_us:.3f} us)")
+
+    sample = ips[:300] + boundary_ips(entries, 100)
+    mismatches = [ip for ip in sample if database.lookup(ip) != linear_lookup(entries, ip)]
+    csv_mismatches = [ip for ip in sample if csv_database.lookup(ip) != database.lookup(ip)]
+    found = sum(1 for ip in sample if database.lookup(ip))
+    results['correctness'] = {'sample': len(sample), 'found': found, 'mismatches': len(mismatches),
+                              'csv_vs_compiled_mismatches': len(csv_mismatches)}
+    print(f"correctness: {len(sample)} IPs, {found} found, {len(mismatches)} mismatches vs linear scan, "
+          f"{len(csv_mismatches)} CSV vs compiled")
+
+    # Recarga en caliente: misma ruta, todo a un solo país
+    resolver = GeoResolver(bin_path, reload_interval=0.01)
+    before = resolver.lookup(sample[0])
+    single = os.path.join(root, 'single.csv')
+    write_ranges(single, 1000, 100, country='ES')
+    compile_database(read_csv(single), bin_path)
+    os.utime(bin_path, (time.time() + 5, time.time() + 5))
+    start = time.perf_counter()
+    after = before
+    while time.perf_counter() - start < 10:
+        time.sleep(0.02)
+        after = resolver.lookup('8.8.8.8')
+        if resolver.reloads > 1:
+            break
+    results['reload'] = {'reloads': resolver.reloads, 'seconds': round(time.perf_counter() - start, 3),
+                         'after': list(after) if after else None}
+    print(f"reload: {resolver.reloads} loads, new database visible after {results['reload']['seconds']} s "
+          f"(8.8.8.8 -> {after})")
+
+    shutil.rmtree(root, ignore_errors=True)
+    print(f"results: {write_results('geo', results)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Load test y benchmark de latencia del handler de /api/track
+Ejecuta cada escenario contra un PostgREST falso local, en proceso (handle_one_request
+directo) o sobre un servidor HTTP local, y reporta throughput y p50/p95/p99.
+
+Uso:
+  python benchmarks/bench_load.py                       # en proceso, todos los escenarios
+  python benchmarks/bench_load.py --mode http --concurrency 8
+  python benchmarks/bench_load.py --latency 0.02 --failure-rate 0.01
+  python benchmarks/bench_load.py --save baseline       # guarda results/load-baseline.json
+  python benchmarks/bench_load.py --baseline results/load-baseline.json
+"""
+
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+from _common import RESULTS_DIR, write_results
+from fake_postgrest import FakePostgREST
+from generators import bot_pageview, custom_event, mixed_pageview, pageview, purchase
+from harness import call_handler
+
+TRACKING_CODE = 'bench-code'
+ORIGIN = 'https://example.com'
+
+# nombre -> (método, generador del body o None)
+SCENARIOS = {
+    'pageview': ('POST', lambda: pageview(TRACKING_CODE)),
+    'pageview_mixed_ua': ('POST', lambda: mixed_pageview(TRACKING_CODE)),
+    'custom_event': ('POST', lambda: custom_event(TRACKING_CODE)),
+    'purchase_5_items': ('POST', lambda: purchase(TRACKING_CODE, 5)),
+    'purchase_200_items': ('POST', lambda: purchase(TRACKING_CODE, 200)),
+    'bot_traffic': ('POST', lambda: bot_pageview(TRACKING_CODE)),
+    'batch_50': ('POST', lambda: {'events': [pageview(TRACKING_CODE) for _ in range(50)]}),
+    'invalid_tracking_code': ('POST', lambda: pageview('unknown-code')),
+    'options_preflight': ('OPTIONS', None),
+}
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies_ms: list, statuses: dict, elapsed: float) -> dict:
+    values = sorted(latencies_ms)
+    return {
+        'requests': len(values),
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(statistics.fmean(values), 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3) if values else 0.0,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())}
+    }
+
+
+def _request_headers(method: str) -> dict:
+    headers = {'Origin': ORIGIN}
+    if method == 'OPTIONS':
+        headers['Access-Control-Request-Method'] = 'POST'
+    else:
+        headers['Content-Type'] = 'application/json'
+    return headers
+
+
+def run_in_process(handler_cls, method: str, make_body, requests: int) -> dict:
+    """Una petición detrás de otra llamando al handler directamente"""
+    bodies = [make_body() if make_body else None for _ in range(requests)]
+    headers = _request_headers(method)
+    latencies, statuses = [], {}
+    start = time.perf_counter()
+    for body in bodies:
+        t0 = time.perf_counter()
+        status, _, _ = call_handler(handler_cls, method, body=body, headers=headers)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        statuses[status] = statuses.get(status, 0) + 1
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+def run_http(port: int, method: str, make_body, requests: int, concurrency: int) -> dict:
+    """N clientes concurrentes contra un servidor HTTP local"""
+    bodies = [json.dumps(make_body()).encode('utf-8') if make_body else None for _ in range(requests)]
+    headers = _request_headers(method)
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    cursor = iter(range(requests))
+
+    def worker():
+        while True:
+            with lock:
+                idx = next(cursor, None)
+            if idx is None:
+                return
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            t0 = time.perf_counter()
+            conn.request(method, '/api/track', body=bodies[idx], headers=headers)
+            response = conn.getresponse()
+            response.read()
+            elapsed = (time.perf_counter() - t0) * 1000
+            conn.close()
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+def compare(results: dict, baseline_path: str):
+    """Imprime la variación de p50/p99/throughput contra un resultado anterior"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['scenarios']
+    print(f'\nvs {baseline_path}')
+    for name, current in results['scenarios'].items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        deltas = []
+        for key in ('p50_ms', 'p99_ms', 'throughput_rps'):
+            if old[key]:
+                deltas.append(f'{key} {(current[key] - old[key]) / old[key]:+.1%}')
+        print(f'  {name:24s} ' + '  '.join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test de /api/track')
+    parser.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess')
+    parser.add_argument('--requests', type=int, default=500, help='peticiones por escenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='clientes en modo http')
+    parser.add_argument('--latency', type=float, default=0.0, help='latencia del PostgREST falso (s)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fracción de 503 del PostgREST falso')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='limitar a uno o más escenarios')
+    parser.add_argument('--save', help='nombre del fichero de resultados (results/load-<save>.json)')
+    parser.add_argument('--baseline', help='JSON de una ejecución anterior para comparar')
+    args = parser.parse_args()
+
+    fake = FakePostgREST(latency=args.latency, failure_rate=args.failure_rate).start()
+    os.environ['SUPABASE_URL'] = fake.url
+    os.environ.setdefault('SUPABASE_SERVICE_KEY', 'bench')
+
+    import track
+
+    server = None
+    if args.mode == 'http':
+        server = ThreadingHTTPServer(('127.0.0.1', 0), track.handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {
+        'mode': args.mode,
+        'requests_per_scenario': args.requests,
+        'concurrency': args.concurrency if args.mode == 'http' else 1,
+        'fake_latency_s': args.latency,
+        'fake_failure_rate': args.failure_rate,
+        'python': sys.version.split()[0],
+        'scenarios': {}
+    }
+
+    # Los logs del handler van a /dev/null (se sigue pagando su coste, no se ven)
+    with open(os.devnull, 'w') as devnull:
+        for name in args.scenario or list(SCENARIOS):
+            method, make_body = SCENARIOS[name]
+            with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+                # Calentamiento: caches de proyecto/UA y pool de conexiones
+                run_in_process(track.handler, method, make_body, 5)
+                if server:
+                    summary = run_http(server.server_address[1], method, make_body,
+                                       args.requests, args.concurrency)
+                else:
+                    summary = run_in_process(track.handler, method, make_body, args.requests)
+            results['scenarios'][name] = summary
+            print(f"{name:24s} {summary['throughput_rps']:9.1f} req/s  "
+                  f"p50 {summary['p50_ms']:8.3f}  p95 {summary['p95_ms']:8.3f}  "
+                  f"p99 {summary['p99_ms']:8.3f} ms  {summary['statuses']}")
+
+    results['fake_postgrest'] = fake.stats()
+    if server:
+        server.shutdown()
+    fake.stop()
+
+    name = f"load-{args.save}" if args.save else f'load-{args.mode}'
+    print(f'results: {write_results(name, results)}')
+    if args.baseline:
+        compare(results, args.baseline if os.path.exists(args.baseline)
+                else os.path.join(RESULTS_DIR, args.baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark de la verificación de Origin: bucle de substrings de verify_domain() (versión
+anterior) contra el OriginMatcher compilado, con allowlists de 1, 10 y 500 dominios.
+Antes de medir, compara ambos con el corpus etiquetado de data/origins.txt.
+
+Uso: python benchmarks/bench_origins.py
+"""
+
+from urllib.parse import urlparse
+
+from _common import load_lines, time_per_call, write_results
+
+from _origins import OriginMatcher
+
+ALLOWLIST_SIZES = (1, 10, 500)
+
+
+# Copia literal de verify_domain() de api/track.py antes de _origins.py
+def legacy_verify_domain(origin: str, allowed_domains: list) -> bool:
+    if not allowed_domains:
+        return True
+
+    origin_domain = urlparse(origin).netloc if origin else ''
+
+    for domain in allowed_domains:
+        if domain == '*' or domain in origin_domain or origin_domain in domain:
+            return True
+
+    return False
+
+
+def load_corpus() -> list:
+    corpus = []
+    for line in load_lines('origins.txt'):
+        expected, origin, domains = line.split()
+        corpus.append((expected == 'allow', origin, domains.split(',')))
+    return corpus
+
+
+def check_corpus(corpus: list) -> dict:
+    legacy_errors, compiled_errors = [], []
+    for expected, origin, domains in corpus:
+        case = {'origin': origin, 'allowed_domains': domains, 'expected': expected}
+        if legacy_verify_domain(origin, domains) != expected:
+            legacy_errors.append(case)
+        if OriginMatcher(domains).match(origin) != expected:
+            compiled_errors.append(case)
+    return {'cases': len(corpus), 'legacy_errors': legacy_errors, 'compiled_errors': compiled_errors}
+
+
+def make_allowlist(size: int) -> list:
+    """size dominios; la mitad con comodín, como un proyecto multi-tienda"""
+    return [f'*.shop{i}.example.com' if i % 2 else f'site{i}.example.org' for i in range(size)]
+
+
+def make_origins(size: int) -> list:
+    """Mezcla de orígenes permitidos (primero/último de la lista) y rechazados"""
+    last = size - 1
+    last_host = f'www.shop{last}.example.com' if last % 2 else f'site{last}.example.org'
+    return [
+        'https://site0.example.org',
+        f'https://{last_host}',
+        'https://cdn.unknown-site.net',
+        'https://evil.example.net',
+    ]
+
+
+def main():
+    corpus = load_corpus()
+    accuracy = check_corpus(corpus)
+    results = {'corpus': accuracy, 'us_per_event': {}}
+
+    print(f"corpus: {accuracy['cases']} cases, legacy errors {len(accuracy['legacy_errors'])}, "
+          f"compiled errors {len(accuracy['compiled_errors'])}")
+    for case in accuracy['legacy_errors']:
+        print(f"  legacy wrong: {case['origin']:32s} {','.join(case['allowed_domains'])}")
+    for case in accuracy['compiled_errors']:
+        print(f"  COMPILED WRONG: {case['origin']:32s} {','.join(case['allowed_domains'])}")
+
+    for size in ALLOWLIST_SIZES:
+        domains = make_allowlist(size)
+        origins = make_origins(size)
+        matcher = OriginMatcher(domains)
+        timings = {
+            'legacy_loop': round(time_per_call(lambda o: legacy_verify_domain(o, domains), origins), 3),
+            'compiled': round(time_per_call(matcher.match, origins), 3),
+            # Coste de compilar (una vez por proyecto y TTL de caché)
+            'compile': round(time_per_call(OriginMatcher, [domains], min_time=0.2), 3)
+        }
+        results['us_per_event'][str(size)] = timings
+        print(f"{size:4d} domains  legacy {timings['legacy_loop']:9.3f} us  "
+              f"compiled {timings['compiled']:7.3f} us  compile {timings['compile']:9.3f} us")
+
+    print(f"results: {write_results('origins', results)}")
+
+
+if __name__ == '__main__':
+    main()
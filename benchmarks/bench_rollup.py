@@ -0,0 +1,99 @@
+"""
+Benchmark de los agregados de api/_rollup.py:
+- Error de HyperLogLog frente al número exacto de valores distintos (100 a 1M)
+- Fusión de sketches de varias instancias con usuarios solapados (debe estimar la unión, no la suma)
+- Coste por evento de RollupAggregator.add() y tamaño de lo enviado en cada flush
+
+Uso: python benchmarks/bench_rollup.py
+"""
+
+import json
+import random
+import time
+
+from _common import write_results
+from generators import custom_event, pageview, purchase
+
+from _rollup import HyperLogLog, RollupAggregator
+
+CARDINALITIES = (100, 1000, 10000, 100000, 1000000)
+INSTANCES = 8
+EVENTS = 50000
+
+
+def hll_accuracy() -> dict:
+    results = {}
+    for n in CARDINALITIES:
+        sketch = HyperLogLog()
+        for i in range(n):
+            sketch.add(f'user-{n}-{i}')
+        estimate = sketch.count()
+        results[str(n)] = {'estimate': estimate, 'error_pct': round((estimate - n) / n * 100, 2)}
+        print(f"{n:8d} distinct  estimate {estimate:8d}  error {results[str(n)]['error_pct']:+6.2f}%")
+    return results
+
+
+def merge_accuracy(users: int = 50000) -> dict:
+    """INSTANCES instancias ven subconjuntos solapados de los mismos usuarios"""
+    sketches = [HyperLogLog() for _ in range(INSTANCES)]
+    for i in range(users):
+        for index in random.sample(range(INSTANCES), 3):
+            sketches[index].add(f'user-{i}')
+    naive_sum = sum(s.count() for s in sketches)
+    merged = HyperLogLog()
+    for sketch in sketches:
+        merged.merge(sketch)
+    estimate = merged.count()
+    result = {'distinct': users, 'instances': INSTANCES, 'sum_of_instances': naive_sum,
+              'merged_estimate': estimate, 'error_pct': round((estimate - users) / users * 100, 2)}
+    print(f"merge: {users} users over {INSTANCES} instances  sum {naive_sum}  "
+          f"merged {estimate} ({result['error_pct']:+.2f}%)")
+    return result
+
+
+def make_records(n: int, projects: int = 20) -> list:
+    records = []
+    for i in range(n):
+        kind = random.random()
+        event = purchase('bench') if kind < 0.05 else custom_event('bench') if kind < 0.3 else pageview('bench')
+        event['project_id'] = f'project-{i % projects}'
+        event['user_id'] = f'user-{random.randint(1, n // 5)}'
+        event['is_bot'] = random.random() < 0.1
+        records.append(event)
+    return records
+
+
+def aggregator_cost() -> dict:
+    records = make_records(EVENTS)
+    sent = []
+    aggregator = RollupAggregator(sent.extend, max_pending=10 ** 9, flush_interval=10 ** 9)
+
+    start = time.perf_counter()
+    for record in records:
+        aggregator.add([record])
+    add_us = (time.perf_counter() - start) / EVENTS * 1e6
+
+    start = time.perf_counter()
+    aggregator.flush()
+    flush_ms = (time.perf_counter() - start) * 1000
+    payload = len(json.dumps({'p_rows': sent}))
+    result = {'events': EVENTS, 'us_per_event': round(add_us, 3), 'flush_ms': round(flush_ms, 2),
+              'rows': len(sent), 'payload_bytes': payload,
+              'events_per_second': int(1e6 / add_us)}
+    print(f"add: {add_us:.2f} us/event ({result['events_per_second']} events/s)  "
+          f"flush: {len(sent)} rows, {payload / 1024:.0f} KB in {flush_ms:.1f} ms")
+    return result
+
+
+def main():
+    random.seed(1)
+    results = {
+        'hll_accuracy': hll_accuracy(),
+        'merge': merge_accuracy(),
+        'aggregator': aggregator_cost()
+    }
+    print(f"results: {write_results('rollup', results)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Benchmark de validación + construcción del registro: código anterior de process_event()
+(bucle de obligatorios, validate_ecommerce_data() y copia campo a campo) contra el
+validador compilado de _schema.py, en pageviews y compras de hasta cientos de items.
+Antes de medir comprueba que ambos aceptan/rechazan igual y con el mismo mensaje.
+
+Uso: python benchmarks/bench_schema.py
+"""
+
+import copy
+
+from _common import time_per_call, write_results
+from generators import custom_event, pageview, purchase
+
+from _schema import EVENT_VALIDATOR
+
+ITEM_COUNTS = (5, 100, 300, 1000)
+
+# Resultado fijo del parseo de UA: aquí solo se mide validación y construcción
+UA_DATA = {'device': 'desktop', 'browser': 'Chrome', 'browser_version': '120', 'os': 'Windows',
+           'os_version': '10', 'is_mobile': False, 'is_tablet': False, 'is_bot': False}
+
+
+# Copia de validate_ecommerce_data() de api/track.py antes de _schema.py
+def legacy_validate_ecommerce_data(ecommerce_data: dict) -> tuple:
+    if not ecommerce_data:
+        return True, None
+    if not ecommerce_data.get('transaction_id'):
+        return False, "ecommerce_data.transaction_id is required"
+    if 'value' not in ecommerce_data:
+        return False, "ecommerce_data.value is required"
+    try:
+        value = float(ecommerce_data['value'])
+        if value < 0:
+            return False, "ecommerce_data.value must be >= 0"
+    except (ValueError, TypeError):
+        return False, "ecommerce_data.value must be a number"
+    if 'items' in ecommerce_data:
+        if not isinstance(ecommerce_data['items'], list):
+            return False, "ecommerce_data.items must be an array"
+        for idx, item in enumerate(ecommerce_data['items']):
+            if not isinstance(item, dict):
+                return False, f"ecommerce_data.items[{idx}] must be an object"
+            if 'price' in item:
+                try:
+                    float(item['price'])
+                except (ValueError, TypeError):
+                    return False, f"ecommerce_data.items[{idx}].price must be a number"
+            if 'quantity' in item:
+                try:
+                    int(item['quantity'])
+                except (ValueError, TypeError):
+                    return False, f"ecommerce_data.items[{idx}].quantity must be an integer"
+    return True, None
+
+
+# Copia de la validación y construcción del registro de process_event() antes de _schema.py
+def legacy_build(event_data: dict):
+    required_fields = ['event_id', 'timestamp', 'user_id', 'session_id',
+                       'event_type', 'page_url', 'user_agent']
+    for field in required_fields:
+        if field not in event_data:
+            return f"Missing required field: {field}"
+    valid_event_types = ['pageview', 'event']
+    if event_data['event_type'] not in valid_event_types:
+        return f"Invalid event_type. Must be one of: {valid_event_types}"
+    if event_data['event_type'] == 'event':
+        if not event_data.get('event_name'):
+            return "event_name is required for event_type='event'"
+    ecommerce_data = event_data.get('ecommerce_data')
+    if ecommerce_data:
+        is_valid, error_msg = legacy_validate_ecommerce_data(ecommerce_data)
+        if not is_valid:
+            return f"Invalid ecommerce_data: {error_msg}"
+    ua_data = UA_DATA
+    return {
+        'event_id': event_data['event_id'],
+        'project_id': 'p',
+        'client_id': 'c',
+        'timestamp': event_data['timestamp'],
+        'user_id': event_data['user_id'],
+        'session_id': event_data['session_id'],
+        'event_type': event_data['event_type'],
+        'event_name': event_data.get('event_name') or ('pageview' if event_data['event_type'] == 'pageview' else None),
+        'page_url': event_data['page_url'],
+        'page_title': event_data.get('page_title', ''),
+        'referrer': event_data.get('referrer', ''),
+        'user_agent': event_data['user_agent'],
+        'ip_address': '0.0.0.0',
+        'device_type': event_data.get('device_type') or ua_data.get('device', 'unknown'),
+        'browser': event_data.get('browser') or ua_data.get('browser', 'unknown'),
+        'browser_version': ua_data.get('browser_version', ''),
+        'os': event_data.get('os') or ua_data.get('os', 'unknown'),
+        'os_version': ua_data.get('os_version', ''),
+        'is_mobile': ua_data.get('is_mobile', False),
+        'is_tablet': ua_data.get('is_tablet', False),
+        'is_bot': ua_data['is_bot'],
+        'screen_resolution': event_data.get('screen_resolution'),
+        'viewport_size': event_data.get('viewport_size'),
+        'language': event_data.get('language'),
+        'timezone': event_data.get('timezone'),
+        'custom_params': event_data.get('custom_params', {}),
+        'ecommerce_data': ecommerce_data,
+        'processed_at': '2024-01-01T00:00:00'
+    }
+
+
+# Igual que process_event() actual sin las etapas de dominio/cuota/UA
+def compiled_build(event_data: dict):
+    record, errors = EVENT_VALIDATOR.validate(event_data)
+    if errors:
+        return errors[0].messages[0]
+    ua_data = UA_DATA
+    record['project_id'] = 'p'
+    record['client_id'] = 'c'
+    record['ip_address'] = '0.0.0.0'
+    record['device_type'] = record['device_type'] or ua_data.get('device', 'unknown')
+    record['browser'] = record['browser'] or ua_data.get('browser', 'unknown')
+    record['browser_version'] = ua_data.get('browser_version', '')
+    record['os'] = record['os'] or ua_data.get('os', 'unknown')
+    record['os_version'] = ua_data.get('os_version', '')
+    record['is_mobile'] = ua_data.get('is_mobile', False)
+    record['is_tablet'] = ua_data.get('is_tablet', False)
+    record['is_bot'] = ua_data['is_bot']
+    record['processed_at'] = '2024-01-01T00:00:00'
+    return record
+
+
+def invalid_cases() -> list:
+    """Eventos inválidos cuyo mensaje de error debe coincidir con el del código anterior"""
+    cases = []
+    for field in ('event_id', 'timestamp', 'user_id', 'session_id', 'event_type', 'page_url', 'user_agent'):
+        event = pageview('x')
+        del event[field]
+        cases.append(event)
+    cases.append(dict(pageview('x'), event_type='click'))
+    cases.append(dict(custom_event('x'), event_name=''))
+    for patch in ({'transaction_id': ''}, {'value': 'abc'}, {'value': -1}, {'items': 'x'}):
+        event = purchase('x', 3)
+        event['ecommerce_data'].update(patch)
+        cases.append(event)
+    event = purchase('x', 3)
+    del event['ecommerce_data']['value']
+    cases.append(event)
+    for patch in ({'price': 'gratis'}, {'quantity': 'dos'}):
+        event = purchase('x', 3)
+        event['ecommerce_data']['items'][2].update(patch)
+        cases.append(event)
+    event = purchase('x', 3)
+    event['ecommerce_data']['items'][1] = 'SKU-1'
+    cases.append(event)
+    return cases
+
+
+def check_equivalence() -> list:
+    mismatches = []
+    valid = [pageview('x'), custom_event('x'), purchase('x', 5)]
+    for event in valid + invalid_cases():
+        legacy = legacy_build(copy.deepcopy(event))
+        compiled = compiled_build(copy.deepcopy(event))
+        if isinstance(legacy, dict) and isinstance(compiled, dict):
+            same = legacy == compiled
+        else:
+            same = legacy == compiled
+        if not same:
+            mismatches.append({'legacy': legacy if isinstance(legacy, str) else 'accepted',
+                               'compiled': compiled if isinstance(compiled, str) else 'accepted'})
+    return mismatches
+
+
+def main():
+    mismatches = check_equivalence()
+    print(f"equivalence: {len(mismatches)} mismatches")
+    for m in mismatches:
+        print(f"  legacy={m['legacy']!r} compiled={m['compiled']!r}")
+
+    workloads = {'pageview': [pageview('x') for _ in range(50)],
+                 'custom_event': [custom_event('x') for _ in range(50)]}
+    for n in ITEM_COUNTS:
+        workloads[f'purchase_{n}_items'] = [purchase('x', n) for _ in range(10)]
+
+    results = {'mismatches': mismatches, 'us_per_event': {}}
+    for name, events in workloads.items():
+        timings = {
+            'legacy': round(time_per_call(legacy_build, events), 3),
+            'compiled': round(time_per_call(compiled_build, events), 3)
+        }
+        results['us_per_event'][name] = timings
+        print(f"{name:22s} legacy {timings['legacy']:10.3f} us  compiled {timings['compiled']:10.3f} us  "
+              f"x{timings['legacy'] / timings['compiled']:.2f}")
+
+    print(f"results: {write_results('schema', results)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark de cold start de api/track.py
+Cada muestra es un proceso Python nuevo que mide:
+  - import_ms: tiempo de `import track`
+  - first_options_ms / first_post_ms: primera petición tras el import (proceso distinto cada una)
+  - second_post_ms: segunda petición, ya en caliente
+  - cold_total_ms: import + primera petición
+Además guarda el desglose de `python -X importtime` de los módulos más caros.
+
+Uso: python benchmarks/bench_startup.py [--runs 5] [--latency 0.05]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from _common import API_DIR, BENCH_DIR, write_results
+
+# Script que se ejecuta en cada proceso hijo (cold start real)
+CHILD = r'''
+import json, os, sys, time
+sys.path.insert(0, {bench_dir!r})
+from fake_postgrest import FakePostgREST
+fake = FakePostgREST(latency={latency!r}).start()
+os.environ['SUPABASE_URL'] = fake.url
+os.environ['SUPABASE_SERVICE_KEY'] = 'bench'
+from harness import call_handler
+from generators import pageview
+
+t0 = time.perf_counter()
+import track
+t1 = time.perf_counter()
+result = {{'import_ms': (t1 - t0) * 1000}}
+if {mode!r} == 'options':
+    call_handler(track.handler, 'OPTIONS', headers={{'Origin': 'https://example.com'}})
+    result['first_options_ms'] = (time.perf_counter() - t1) * 1000
+    result['cold_total_ms'] = (time.perf_counter() - t0) * 1000
+else:
+    status, _, _ = call_handler(track.handler, 'POST', body=pageview('bench-code'))
+    t2 = time.perf_counter()
+    call_handler(track.handler, 'POST', body=pageview('bench-code'))
+    result['first_post_ms'] = (t2 - t1) * 1000
+    result['second_post_ms'] = (time.perf_counter() - t2) * 1000
+    result['cold_total_ms'] = (t2 - t0) * 1000
+    result['first_status'] = status
+print(json.dumps(result))
+'''
+
+
+def run_child(mode: str, latency: float) -> dict:
+    code = CHILD.format(bench_dir=BENCH_DIR, mode=mode, latency=latency)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='0')
+    out = subprocess.run([sys.executable, '-c', code], cwd=API_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def importtime_breakdown(top: int = 10) -> list:
+    """Módulos con mayor tiempo acumulado según `python -X importtime -c 'import track'`"""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import track'],
+                         cwd=API_DIR, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append({'module': name.strip(), 'self_us': int(self_us), 'cumulative_us': int(cumulative_us)})
+    rows.sort(key=lambda r: r['cumulative_us'], reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='latencia simulada de Supabase por petición (s)')
+    args = parser.parse_args()
+
+    samples = {'post': [run_child('post', args.latency) for _ in range(args.runs)],
+               'options': [run_child('options', args.latency) for _ in range(args.runs)]}
+
+    summary = {}
+    for mode, runs in samples.items():
+        for key in runs[0]:
+            if key.endswith('_ms'):
+                summary[f'{mode}.{key}'] = round(statistics.median(r[key] for r in runs), 2)
+
+    results = {'runs': args.runs, 'latency': args.latency, 'median': summary, 'importtime_top': importtime_breakdown()}
+    for key, value in summary.items():
+        print(f'{key:28s} {value:10.2f} ms')
+    for row in results['importtime_top']:
+        print(f"  {row['cumulative_us'] / 1000:8.1f} ms  {row['module']}")
+    print(f"results: {write_results('startup', results)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""
+Sustituto local de PostgREST para benchmarks
+Sirve `projects` (lookup por tracking_code), acepta INSERTs en `events_raw` (y, con keep_rows,
+los devuelve con la paginación keyset de tools/export_events.py) y las RPC `increment_client_usage` y `merge_events_rollup` sin red externa; la latencia y la tasa de fallos (503) por petición son configurables
+
+Uso standalone: python benchmarks/fake_postgrest.py --port 54321 --latency 0.02 --failure-rate 0.01
+"""
+
+import argparse
+import base64
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_PROJECT = {
+    'project_id': 'bench-project',
+    'client_id': 'bench-client',
+    'is_active': True,
+    'allowed_domains': []
+}
+
+
+class FakePostgREST:
+    """Servidor PostgREST falso en un hilo: `with FakePostgREST() as fake: fake.url`"""
+
+    def __init__(self, projects: dict = None, latency: float = 0.0, failure_rate: float = 0.0,
+                 port: int = 0, client_limits: dict = None, keep_rows: bool = False):
+        # tracking_code -> fila de projects
+        self.projects = projects if projects is not None else {'bench-code': DEFAULT_PROJECT}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        # client_id -> monthly_event_limit (None = sin límite) y uso acumulado
+        self.client_limits = client_limits or {}
+        self.client_usage = {}
+        self.rows_inserted = 0
+        # event_id ya insertados (para on_conflict=event_id + ignore-duplicates)
+        self.event_ids = set()
+        # (project_id, bucket) -> fila de events_rollup fusionada como en sql/events_rollup.sql
+        self.rollups = {}
+        # (dimension, value) -> id de dimension_values (sql/dimensions.sql)
+        self.dimensions = {}
+        # Filas de events_raw ordenadas por (processed_at, event_id), solo si keep_rows
+        self.keep_rows = keep_rows
+        self.events = []
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def start(self) -> 'FakePostgREST':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> dict:
+        return {'requests': self.requests, 'failures': self.failures,
+                'rows_inserted': self.rows_inserted}
+
+    def _increment_usage(self, payload: dict) -> list:
+        result = []
+        with self._lock:
+            for item in payload.get('p_increments', []):
+                client_id = item['client_id']
+                self.client_usage[client_id] = self.client_usage.get(client_id, 0) + item['count']
+                result.append({'client_id': client_id,
+                               'event_count': self.client_usage[client_id],
+                               'monthly_event_limit': self.client_limits.get(client_id)})
+        return result
+
+    def add_events(self, rows: list):
+        with self._lock:
+            self.events.extend(rows)
+            self.events.sort(key=lambda row: (row['processed_at'], row['event_id']))
+
+    _KEYSET = re.compile(r'^\(processed_at\.gt\."(.*)",and\(processed_at\.eq\."(.*)",event_id\.gt\."(.*)"\)\)$')
+
+    def _select_events(self, query: dict) -> list:
+        """Subconjunto de PostgREST que usa export_events.py: keyset, processed_at=lt, project_id=in, limit"""
+        rows = self.events
+        start = 0
+        keyset = self._KEYSET.match(query.get('or', [''])[0])
+        if keyset:
+            start = bisect.bisect_right(rows, (keyset.group(1), keyset.group(3)),
+                                        key=lambda row: (row['processed_at'], row['event_id']))
+        until = query.get('processed_at', [''])[0]
+        projects = None
+        project_filter = query.get('project_id', [''])[0]
+        if project_filter.startswith('in.('):
+            projects = {p.strip('"') for p in project_filter[4:-1].split(',')}
+        elif project_filter.startswith('eq.'):
+            projects = {project_filter[3:]}
+        limit = int(query.get('limit', [len(rows)])[0])
+        result = []
+        for row in rows[start:]:
+            if until.startswith('lt.') and row['processed_at'] >= until[3:]:
+                break
+            if projects is None or row['project_id'] in projects:
+                result.append(row)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def _merge_rollups(self, payload: dict):
+        with self._lock:
+            for row in payload.get('p_rows', []):
+                key = (row['project_id'], row['bucket'])
+                current = self.rollups.get(key)
+                if current is None:
+                    self.rollups[key] = row
+                    continue
+                for column in ('events', 'pageviews', 'bot_events', 'purchases'):
+                    current[column] += row[column]
+                for column in ('revenue', 'event_names'):
+                    for name, value in row[column].items():
+                        current[column][name] = current[column].get(name, 0) + value
+                for column in ('users_hll', 'sessions_hll'):
+                    merged = bytes(map(max, base64.b64decode(current[column]), base64.b64decode(row[column])))
+                    current[column] = base64.b64encode(merged).decode('ascii')
+
+    def _register_dimensions(self, payload: dict) -> list:
+        with self._lock:
+            result = []
+            for dimension, value in payload.get('p_values', []):
+                value_id = self.dimensions.get((dimension, value))
+                if value_id is None:
+                    value_id = self.dimensions[(dimension, value)] = len(self.dimensions) + 1
+                result.append({'dimension': dimension, 'value': value, 'id': value_id})
+            return result
+
+    def _select_dimensions(self, query: dict) -> list:
+        wanted = query.get('id', [''])[0]
+        ids = {int(i) for i in wanted[4:-1].split(',') if i} if wanted.startswith('in.(') else set()
+        with self._lock:
+            return [{'id': value_id, 'dimension': dimension, 'value': value}
+                    for (dimension, value), value_id in self.dimensions.items() if value_id in ids]
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, code: int, payload=None):
+                body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _begin(self) -> bool:
+                """Aplica latencia y decide si la petición falla (503)"""
+                if fake.latency:
+                    time.sleep(fake.latency)
+                failed = fake.failure_rate and random.random() < fake.failure_rate
+                with fake._lock:
+                    fake.requests += 1
+                    fake.failures += 1 if failed else 0
+                if failed:
+                    self._reply(503, {'message': 'simulated failure'})
+                return not failed
+
+            def do_GET(self):
+                if not self._begin():
+                    return
+                url = urlparse(self.path)
+                if url.path == '/rest/v1/events_raw' and fake.keep_rows:
+                    return self._reply(200, fake._select_events(parse_qs(url.query)))
+                if url.path == '/rest/v1/dimension_values':
+                    return self._reply(200, fake._select_dimensions(parse_qs(url.query)))
+                if url.path != '/rest/v1/projects':
+                    return self._reply(404, {'message': 'not found'})
+                code = parse_qs(url.query).get('tracking_code', [''])[0]
+                project = fake.projects.get(code[3:] if code.startswith('eq.') else code)
+                self._reply(200, [project] if project else [])
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not self._begin():
+                    return
+                path = urlparse(self.path).path
+                if path == '/rest/v1/rpc/increment_client_usage':
+                    return self._reply(200, fake._increment_usage(json.loads(body)))
+                if path == '/rest/v1/rpc/register_dimension_values':
+                    return self._reply(200, fake._register_dimensions(json.loads(body)))
+                if path == '/rest/v1/rpc/merge_events_rollup':
+                    fake._merge_rollups(json.loads(body))
+                    return self._reply(204)
+                if path != '/rest/v1/events_raw':
+                    return self._reply(404, {'message': 'not found'})
+                rows = json.loads(body)
+                rows = rows if isinstance(rows, list) else [rows]
+                query = parse_qs(urlparse(self.path).query)
+                ignore_duplicates = 'resolution=ignore-duplicates' in self.headers.get('Prefer', '')
+                inserted = []
+                with fake._lock:
+                    for row in rows:
+                        if ignore_duplicates and query.get('on_conflict') == ['event_id']:
+                            if row.get('event_id') in fake.event_ids:
+                                continue
+                            fake.event_ids.add(row.get('event_id'))
+                        inserted.append(row)
+                    fake.rows_inserted += len(inserted)
+                if fake.keep_rows:
+                    fake.add_events(inserted)
+                if 'return=representation' not in self.headers.get('Prefer', ''):
+                    return self._reply(201)
+                select = query.get('select', [''])[0]
+                if select:
+                    columns = select.split(',')
+                    inserted = [{c: row.get(c) for c in columns} for row in inserted]
+                self._reply(201, inserted)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake PostgREST para benchmarks')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakePostgREST(latency=args.latency, failure_rate=args.failure_rate, port=args.port)
+    print(f'Fake PostgREST on {fake.url} (tracking_code: bench-code)')
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Generadores de eventos sintéticos con la misma forma que envían los píxeles
+"""
+
+import random
+import uuid
+from datetime import datetime, timezone
+
+from _common import load_lines
+
+_USER_AGENTS = None
+
+
+def user_agents() -> list:
+    global _USER_AGENTS
+    if _USER_AGENTS is None:
+        _USER_AGENTS = load_lines('user_agents.txt')
+    return _USER_AGENTS
+
+
+def base_event(tracking_code: str, user_agent: str = None) -> dict:
+    return {
+        'tracking_code': tracking_code,
+        'event_id': str(uuid.uuid4()),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'user_id': str(uuid.uuid4()),
+        'session_id': str(uuid.uuid4()),
+        'page_url': f'https://example.com/page/{random.randint(1, 500)}',
+        'page_title': 'Benchmark page',
+        'referrer': 'https://www.google.com/',
+        'user_agent': user_agent or user_agents()[0],
+        'device_type': 'desktop',
+        'browser': 'Chrome',
+        'os': 'Windows',
+        'screen_resolution': '1920x1080',
+        'viewport_size': '1536x864',
+        'language': 'es-ES',
+        'timezone': 'Europe/Madrid'
+    }
+
+
+def pageview(tracking_code: str, user_agent: str = None) -> dict:
+    event = base_event(tracking_code, user_agent)
+    event['event_type'] = 'pageview'
+    event['event_name'] = 'pageview'
+    event['custom_params'] = {}
+    return event
+
+
+def custom_event(tracking_code: str, user_agent: str = None) -> dict:
+    event = base_event(tracking_code, user_agent)
+    event['event_type'] = 'event'
+    event['event_name'] = random.choice(['signup', 'add_to_cart', 'video_play', 'download'])
+    event['custom_params'] = {'plan': 'pro', 'position': random.randint(1, 10), 'source': 'bench'}
+    return event
+
+
+def purchase(tracking_code: str, n_items: int = 3, user_agent: str = None) -> dict:
+    event = base_event(tracking_code, user_agent)
+    event['event_type'] = 'event'
+    event['event_name'] = 'purchase'
+    event['custom_params'] = {}
+    items = [{
+        'id': f'SKU-{i}',
+        'name': f'Producto {i}',
+        'quantity': random.randint(1, 3),
+        'price': round(random.uniform(1, 200), 2)
+    } for i in range(n_items)]
+    event['ecommerce_data'] = {
+        'transaction_id': f'T-{uuid.uuid4().hex[:12]}',
+        'value': round(sum(item['price'] * item['quantity'] for item in items), 2),
+        'currency': 'EUR',
+        'items': items
+    }
+    return event
+
+
+def bot_pageview(tracking_code: str) -> dict:
+    """Pageview con un User-Agent de bot del corpus"""
+    bots = [ua for ua in user_agents() if 'bot' in ua.lower() or 'spider' in ua.lower()]
+    return pageview(tracking_code, random.choice(bots))
+
+
+def mixed_pageview(tracking_code: str) -> dict:
+    """Pageview con un User-Agent cualquiera del corpus (distribución sesgada al principio)"""
+    corpus = user_agents()
+    idx = min(int(random.expovariate(1 / 5)), len(corpus) - 1)
+    return pageview(tracking_code, corpus[idx])
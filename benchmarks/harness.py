@@ -0,0 +1,48 @@
+"""
+Ejecuta el handler de api/track.py en proceso, sin servidor HTTP
+Construye la petición HTTP cruda y la pasa por handle_one_request(), igual que
+haría http.server, para medir el coste del handler sin el del socket
+"""
+
+import io
+import json
+
+
+class _Server:
+    """Lo mínimo que BaseHTTPRequestHandler espera de self.server"""
+    server_name = 'bench'
+    server_port = 0
+
+
+def call_handler(handler_cls, method: str, path: str = '/api/track', body=None,
+                 headers: dict = None) -> tuple:
+    """Ejecuta una petición y retorna (status, headers, body) de la respuesta"""
+    if body is not None and not isinstance(body, (bytes, bytearray)):
+        body = json.dumps(body).encode('utf-8')
+    headers = dict(headers or {})
+    if body is not None:
+        headers.setdefault('Content-Length', str(len(body)))
+
+    raw = f'{method} {path} HTTP/1.1\r\n'
+    raw += ''.join(f'{k}: {v}\r\n' for k, v in headers.items())
+    raw = raw.encode('latin-1') + b'\r\n' + (body or b'')
+
+    h = handler_cls.__new__(handler_cls)
+    h.rfile = io.BytesIO(raw)
+    h.wfile = io.BytesIO()
+    h.client_address = ('127.0.0.1', 0)
+    h.server = _Server()
+    h.request = None
+    h.close_connection = True
+    # Silenciar el access log de http.server
+    h.log_message = lambda *args: None
+    h.handle_one_request()
+
+    head, _, payload = h.wfile.getvalue().partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    response_headers = {}
+    for line in lines[1:]:
+        key, _, value = line.partition(':')
+        response_headers[key.strip()] = value.strip()
+    return status, response_headers, payload
@@ -22,9 +22,18 @@
     cookieExpireDays: 730,
     sessionTimeoutMinutes: 30,
     respectDNT: true,
-    debugMode: false
+    debugMode: false,
+    // Cola de eventos (opcional): agrupa eventos y los envía en un solo POST
+    batching: false,
+    batchMaxEvents: 10,         // Enviar al acumular N eventos...
+    batchFlushInterval: 5000,   // ...o pasados N ms desde el primero
+    beaconMaxBytes: 60000       // sendBeacon/keepalive admiten ~64 KB por envío
   };
 
+  // JSON enviado como text/plain: petición CORS "simple", sin preflight OPTIONS.
+  // El servidor lo parsea igual y toma tracking_code del cuerpo.
+  const BODY_TYPE = 'text/plain;charset=UTF-8';
+
   // ============================================
   // UTILIDADES PARA COOKIES
   // ============================================
@@ -140,20 +149,22 @@
       return;
     }
 
+    if (CONFIG.batching) {
+      EventQueue.push(eventData);
+      return;
+    }
+
     log('Sending event:', eventData.event_type, eventData.event_name || '');
 
     if (navigator.sendBeacon && window.location.protocol !== 'file:') {
-      const blob = new Blob([JSON.stringify(eventData)], { type: 'application/json' });
+      const blob = new Blob([JSON.stringify(eventData)], { type: BODY_TYPE });
       const sent = navigator.sendBeacon(CONFIG.endpoint, blob);
       log('Event sent via sendBeacon:', sent);
     } else {
       fetch(CONFIG.endpoint, {
         method: 'POST',
         mode: 'cors',
-        headers: {
-          'Content-Type': 'application/json',
-          'X-Tracking-Code': CONFIG.trackingCode
-        },
+        headers: { 'Content-Type': BODY_TYPE },
         body: JSON.stringify(eventData),
         keepalive: true
       }).then(function(response) {
@@ -166,6 +177,125 @@
     }
   }
 
+  // ============================================
+  // COLA DE EVENTOS (CONFIG.batching)
+  // ============================================
+  // Los eventos se guardan en sessionStorage (sobreviven a la navegación) y se envían
+  // juntos en un sobre {"tracking_code": ..., "events": [...]} troceado para no superar
+  // el límite de sendBeacon.
+
+  const EventQueue = {
+    storageKey: '_analytics_queue',
+    events: [],
+    timer: null,
+
+    load: function() {
+      try {
+        const stored = JSON.parse(sessionStorage.getItem(this.storageKey) || '[]');
+        this.events = Array.isArray(stored) ? stored : [];
+      } catch (e) {
+        this.events = [];
+      }
+    },
+
+    save: function() {
+      try {
+        if (this.events.length) {
+          sessionStorage.setItem(this.storageKey, JSON.stringify(this.events));
+        } else {
+          sessionStorage.removeItem(this.storageKey);
+        }
+      } catch (e) {
+        // Sin sessionStorage (modo privado, cuota): la cola solo vive en memoria
+      }
+    },
+
+    push: function(eventData) {
+      this.events.push(eventData);
+      this.save();
+      log('Event queued:', eventData.event_type, eventData.event_name || '', '(' + this.events.length + ')');
+      if (this.events.length >= CONFIG.batchMaxEvents) {
+        this.flush();
+      } else {
+        this.schedule();
+      }
+    },
+
+    schedule: function() {
+      if (!this.timer && this.events.length) {
+        this.timer = setTimeout(this.flush.bind(this), CONFIG.batchFlushInterval);
+      }
+    },
+
+    // Trocea la cola en cuerpos JSON de como mucho beaconMaxBytes
+    chunks: function(events) {
+      const head = '{"tracking_code":' + JSON.stringify(CONFIG.trackingCode) + ',"events":[';
+      const tail = ']}';
+      const bodies = [];
+      let parts = [];
+      let size = head.length + tail.length;
+      events.forEach(function(eventData) {
+        const json = JSON.stringify(eventData);
+        const bytes = new Blob([json]).size + 1;
+        if (parts.length && size + bytes > CONFIG.beaconMaxBytes) {
+          bodies.push(head + parts.join(',') + tail);
+          parts = [];
+          size = head.length + tail.length;
+        }
+        parts.push(json);
+        size += bytes;
+      });
+      if (parts.length) bodies.push(head + parts.join(',') + tail);
+      return bodies;
+    },
+
+    flush: function() {
+      clearTimeout(this.timer);
+      this.timer = null;
+      if (!this.events.length) return;
+
+      const events = this.events;
+      this.events = [];
+      this.save();
+
+      this.chunks(events).forEach(function(body) {
+        const fitsBeacon = new Blob([body]).size <= CONFIG.beaconMaxBytes;
+        if (fitsBeacon && navigator.sendBeacon && window.location.protocol !== 'file:') {
+          const blob = new Blob([body], { type: BODY_TYPE });
+          if (navigator.sendBeacon(CONFIG.endpoint, blob)) {
+            log('Batch sent via sendBeacon:', body.length, 'bytes');
+            return;
+          }
+        }
+        // Sin beacon, beacon rechazado o un único evento mayor que el límite
+        fetch(CONFIG.endpoint, {
+          method: 'POST',
+          mode: 'cors',
+          headers: { 'Content-Type': BODY_TYPE },
+          body: body,
+          keepalive: fitsBeacon
+        }).then(function(response) {
+          log('Batch sent via fetch:', response.status);
+        }).catch(function(error) {
+          console.error('[AccuMetrics] Error:', error);
+        });
+      });
+    },
+
+    init: function() {
+      // Eventos pendientes de la página anterior
+      this.load();
+      this.schedule();
+      const self = this;
+      document.addEventListener('visibilitychange', function() {
+        if (document.visibilityState === 'hidden') self.flush();
+      });
+      window.addEventListener('pagehide', function() {
+        self.flush();
+      });
+    }
+  };
+
   // ============================================
   // RECOLECCIÓN DE DATOS BASE
   // ============================================
@@ -303,6 +433,10 @@
     log('Tracking Code:', CONFIG.trackingCode);
     log('Endpoint:', CONFIG.endpoint);
 
+    if (CONFIG.batching) {
+      EventQueue.init();
+    }
+
     if (document.readyState === 'loading') {
       document.addEventListener('DOMContentLoaded', trackPageview);
     } else {
@@ -334,6 +468,7 @@
     trackPurchase: trackPurchase,
     getUserId: getUserId,
     getSessionId: getSessionId,
+    flush: function() { EventQueue.flush(); },
     config: CONFIG,
     version: '2.0.1'
   };
@@ -15,9 +15,18 @@
     sessionCookieName: '_analytics_sid',
     cookieExpireDays: 730, // 2 años
     sessionTimeoutMinutes: 30,
-    respectDNT: true // Respetar Do Not Track
+    respectDNT: true, // Respetar Do Not Track
+    // Cola de eventos (opcional): agrupa eventos y los envía en un solo POST
+    batching: false,
+    batchMaxEvents: 10, // Enviar al acumular N eventos...
+    batchFlushInterval: 5000, // ...o pasados N ms desde el primero
+    beaconMaxBytes: 60000 // sendBeacon/keepalive admiten ~64 KB por envío
   };
 
+  // JSON enviado como text/plain: petición CORS "simple", sin preflight OPTIONS.
+  // El servidor lo parsea igual y toma tracking_code del cuerpo.
+  const BODY_TYPE = 'text/plain;charset=UTF-8';
+
   // Utilidades para cookies
   const CookieUtil = {
     set: function(name, value, days) {
@@ -126,18 +135,20 @@
       return;
     }
 
+    if (CONFIG.batching) {
+      EventQueue.push(eventData);
+      return;
+    }
+
     // Usar sendBeacon si está disponible (más confiable)
     if (navigator.sendBeacon) {
-      const blob = new Blob([JSON.stringify(eventData)], { type: 'application/json' });
+      const blob = new Blob([JSON.stringify(eventData)], { type: BODY_TYPE });
       navigator.sendBeacon(CONFIG.endpoint, blob);
     } else {
       // Fallback a fetch
       fetch(CONFIG.endpoint, {
         method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'X-Tracking-Code': CONFIG.trackingCode // También en header
-        },
+        headers: { 'Content-Type': BODY_TYPE },
         body: JSON.stringify(eventData),
         keepalive: true // Importante para eventos al cerrar página
       }).catch(function(error) {
@@ -146,6 +157,114 @@
     }
   }
 
+  // Cola de eventos (CONFIG.batching): se guarda en sessionStorage para sobrevivir a la
+  // navegación y se envía como {"tracking_code": ..., "events": [...]}, troceada para no
+  // superar el límite de sendBeacon
+  const EventQueue = {
+    storageKey: '_analytics_queue',
+    events: [],
+    timer: null,
+
+    load: function() {
+      try {
+        const stored = JSON.parse(sessionStorage.getItem(this.storageKey) || '[]');
+        this.events = Array.isArray(stored) ? stored : [];
+      } catch (e) {
+        this.events = [];
+      }
+    },
+
+    save: function() {
+      try {
+        if (this.events.length) {
+          sessionStorage.setItem(this.storageKey, JSON.stringify(this.events));
+        } else {
+          sessionStorage.removeItem(this.storageKey);
+        }
+      } catch (e) {
+        // Sin sessionStorage (modo privado, cuota): la cola solo vive en memoria
+      }
+    },
+
+    push: function(eventData) {
+      this.events.push(eventData);
+      this.save();
+      if (this.events.length >= CONFIG.batchMaxEvents) {
+        this.flush();
+      } else {
+        this.schedule();
+      }
+    },
+
+    schedule: function() {
+      if (!this.timer && this.events.length) {
+        this.timer = setTimeout(this.flush.bind(this), CONFIG.batchFlushInterval);
+      }
+    },
+
+    // Trocea la cola en cuerpos JSON de como mucho beaconMaxBytes
+    chunks: function(events) {
+      const head = '{"tracking_code":' + JSON.stringify(CONFIG.trackingCode) + ',"events":[';
+      const tail = ']}';
+      const bodies = [];
+      let parts = [];
+      let size = head.length + tail.length;
+      events.forEach(function(eventData) {
+        const json = JSON.stringify(eventData);
+        const bytes = new Blob([json]).size + 1;
+        if (parts.length && size + bytes > CONFIG.beaconMaxBytes) {
+          bodies.push(head + parts.join(',') + tail);
+          parts = [];
+          size = head.length + tail.length;
+        }
+        parts.push(json);
+        size += bytes;
+      });
+      if (parts.length) bodies.push(head + parts.join(',') + tail);
+      return bodies;
+    },
+
+    flush: function() {
+      clearTimeout(this.timer);
+      this.timer = null;
+      if (!this.events.length) return;
+
+      const events = this.events;
+      this.events = [];
+      this.save();
+
+      this.chunks(events).forEach(function(body) {
+        const fitsBeacon = new Blob([body]).size <= CONFIG.beaconMaxBytes;
+        if (fitsBeacon && navigator.sendBeacon) {
+          const blob = new Blob([body], { type: BODY_TYPE });
+          if (navigator.sendBeacon(CONFIG.endpoint, blob)) return;
+        }
+        // Sin beacon, beacon rechazado o un único evento mayor que el límite
+        fetch(CONFIG.endpoint, {
+          method: 'POST',
+          headers: { 'Content-Type': BODY_TYPE },
+          body: body,
+          keepalive: fitsBeacon
+        }).catch(function(error) {
+          console.error('[Analytics] Error:', error);
+        });
+      });
+    },
+
+    init: function() {
+      // Eventos pendientes de la página anterior
+      this.load();
+      this.schedule();
+      const self = this;
+      document.addEventListener('visibilitychange', function() {
+        if (document.visibilityState === 'hidden') self.flush();
+      });
+      window.addEventListener('pagehide', function() {
+        self.flush();
+      });
+    }
+  };
+
   // Recolectar datos del pageview
   function trackPageview() {
     const eventData = {
@@ -174,6 +293,10 @@
 
   // Inicializar tracking
   function init() {
+    if (CONFIG.batching) {
+      EventQueue.init();
+    }
+
     // Esperar a que el DOM esté listo
     if (document.readyState === 'loading') {
       document.addEventListener('DOMContentLoaded', trackPageview);
@@ -196,7 +319,8 @@
   window.analyticsPixel = {
     track: trackPageview,
     getUserId: getUserId,
-    getSessionId: getSessionId
+    getSessionId: getSessionId,
+    flush: function() { EventQueue.flush(); }
   };
 
   // Iniciar
@@ -0,0 +1,350 @@
+"""
+Modo servidor propio (on-prem): sirve los mismos handlers de api/ que Vercel, en un proceso de larga
+duración por núcleo
+
+- N procesos worker escuchan en el mismo puerto con SO_REUSEPORT (el kernel reparte las conexiones);
+  sin SO_REUSEPORT, el proceso padre abre el socket y los workers lo heredan
+- Cada worker importa api/ después del fork: cachés (proyectos, UAs, orígenes, event_id) y pool de
+  conexiones a Supabase propios que se mantienen calientes entre peticiones
+- Cada worker atiende con SERVER_THREADS hilos y una cola acotada de SERVER_QUEUE_SIZE conexiones; si
+  la cola está llena responde 503 con Retry-After sin leer la petición
+- SIGTERM/SIGINT: se deja de aceptar, se sirven también las conexiones que ya esperaban en el backlog
+  del socket, se terminan las peticiones en curso y en cola (como mucho SERVER_DRAIN_TIMEOUT segundos)
+  y se drenan spool, cuotas y agregados antes de salir
+- Las métricas son por worker (cada uno tiene su registro): /api/track/metrics en el puerto público
+  responde el worker que reciba la conexión. Con SERVER_METRICS_PORT, el worker i las sirve además en
+  SERVER_METRICS_PORT + i para que Prometheus raspe cada uno y sume
+
+Las peticiones pasan por la misma clase `handler` que en Vercel, así que el comportamiento es idéntico.
+La IP del cliente sale de X-Forwarded-For / X-Real-IP: poner un proxy delante que las añada.
+
+Uso: python serve.py --port 8000 --workers 4
+"""
+
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+import _obs as obs
+
+SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('SERVER_PORT', '8000'))
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', str(os.cpu_count() or 1)))
+# Hilos por worker: las peticiones son I/O (Supabase), no CPU
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', '32'))
+# Conexiones aceptadas esperando hilo; por encima se responde 503
+SERVER_QUEUE_SIZE = int(os.environ.get('SERVER_QUEUE_SIZE', '256'))
+SERVER_RETRY_AFTER = int(os.environ.get('SERVER_RETRY_AFTER', '1'))
+SERVER_DRAIN_TIMEOUT = float(os.environ.get('SERVER_DRAIN_TIMEOUT', '30'))
+# Timeout de cada lectura/escritura del socket (clientes lentos no retienen hilos indefinidamente)
+SERVER_REQUEST_TIMEOUT = float(os.environ.get('SERVER_REQUEST_TIMEOUT', '30'))
+# Primer puerto de métricas por worker (0 = desactivado): el worker i escucha en SERVER_METRICS_PORT + i
+SERVER_METRICS_PORT = int(os.environ.get('SERVER_METRICS_PORT', '0'))
+
+# Longitud máxima de la línea de petición que se inspecciona para enrutar
+_MAX_REQUEST_LINE = 8192
+
+REQUESTS_SHED = obs.REGISTRY.counter('accumetrics_requests_shed_total',
+                                     'Conexiones rechazadas con 503 por cola llena')
+
+
+def load_routes() -> list:
+    """(prefijo, handler) de api/, igual que las rutas de Vercel; se importa dentro de cada worker"""
+    import ingest
+    import track
+    return [('/api/track', track.handler), ('/api/ingest', ingest.handler)]
+
+
+def metrics_routes() -> list:
+    """Rutas del puerto de métricas de un worker: solo /metrics"""
+    import track
+    return [('/metrics', track.handler), ('/api/track/metrics', track.handler)]
+
+
+def _shed_response() -> bytes:
+    body = json.dumps({'error': 'Server overloaded, retry later'}).encode('utf-8')
+    head = (
+        'HTTP/1.1 503 Service Unavailable\r\n'
+        f'Retry-After: {SERVER_RETRY_AFTER}\r\n'
+        'Content-Type: application/json\r\n'
+        'Access-Control-Allow-Origin: *\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        'Connection: close\r\n\r\n'
+    )
+    return head.encode('latin-1') + body
+
+
+def _not_found_response() -> bytes:
+    body = json.dumps({'error': 'Not found'}).encode('utf-8')
+    head = f'HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+    return head.encode('latin-1') + body
+
+
+def peek_path(sock, timeout: float):
+    """
+    Ruta de la petición leída con MSG_PEEK (sin consumir bytes: el handler lee la petición entera)
+    None si el cliente cierra o no envía una línea de petición a tiempo
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        data = sock.recv(_MAX_REQUEST_LINE, socket.MSG_PEEK)
+        if not data:
+            return None
+        end = data.find(b'\n')
+        if end >= 0 or len(data) >= _MAX_REQUEST_LINE:
+            parts = data[:end if end >= 0 else len(data)].split()
+            return parts[1].decode('latin-1') if len(parts) >= 2 else ''
+        if time.monotonic() >= deadline:
+            return None
+        # Línea de petición incompleta: MSG_PEEK no consume, así que se espera a que llegue más
+        time.sleep(0.005)
+
+
+class BoundedThreadingServer(socketserver.TCPServer):
+    """
+    TCPServer con un pool fijo de hilos y cola acotada: sirve cada conexión con el handler de su ruta
+    y responde 503 + Retry-After cuando la cola está llena (load shedding)
+    """
+
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address, routes: list, threads: int = SERVER_THREADS,
+                 queue_size: int = SERVER_QUEUE_SIZE, reuse_port: bool = True, sock=None):
+        self.routes = routes
+        self.reuse_port = reuse_port
+        self.pending = queue.Queue(maxsize=max(1, queue_size))
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        if sock is None:
+            super().__init__(address, None)
+        else:
+            # Socket heredado del proceso padre (ya en listen)
+            super().__init__(address, None, bind_and_activate=False)
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+        self.threads = [threading.Thread(target=self._work, name=f'http-{i}', daemon=True)
+                        for i in range(max(1, threads))]
+        for thread in self.threads:
+            thread.start()
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def process_request(self, request, client_address):
+        """Encola la conexión; con la cola llena, 503 inmediato"""
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            REQUESTS_SHED.inc()
+            try:
+                request.settimeout(1)
+                request.sendall(_shed_response())
+                # Descartar lo ya recibido: cerrar con datos sin leer envía RST y el cliente perdería el 503
+                request.setblocking(False)
+                request.recv(65536)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _work(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            request, client_address = item
+            with self._in_flight_lock:
+                self.in_flight += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._in_flight_lock:
+                    self.in_flight -= 1
+
+    def finish_request(self, request, client_address):
+        request.settimeout(SERVER_REQUEST_TIMEOUT)
+        path = peek_path(request, SERVER_REQUEST_TIMEOUT)
+        if path is None:
+            return
+        route_path = path.split('?', 1)[0]
+        for prefix, handler_cls in self.routes:
+            if route_path == prefix or route_path.startswith(prefix + '/'):
+                handler_cls(request, client_address, self)
+                return
+        request.sendall(_not_found_response())
+
+    def handle_error(self, request, client_address):
+        obs.error("Unhandled server error", client=str(client_address[0]), error=str(sys.exc_info()[1]))
+
+    def accept_backlog(self) -> int:
+        """
+        Tras shutdown(): acepta las conexiones que ya esperaban en el backlog del socket, que se
+        perderían (RST) al cerrarlo, y las encola para servirlas en drain()
+        """
+        self.socket.setblocking(False)
+        accepted = 0
+        while True:
+            try:
+                request, client_address = self.socket.accept()
+            except OSError:
+                # BlockingIOError: backlog vacío
+                break
+            request.setblocking(True)
+            self.process_request(request, client_address)
+            accepted += 1
+        return accepted
+
+    def drain(self, timeout: float) -> bool:
+        """Tras shutdown(): termina la cola y las peticiones en curso; False si vence el timeout"""
+        for _ in self.threads:
+            self.pending.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self.threads)
+
+
+def run_worker(host: str, port: int, threads: int, queue_size: int, drain_timeout: float, sock=None,
+               metrics_port: int = 0):
+    """Proceso worker: importa api/, sirve hasta SIGTERM/SIGINT y drena"""
+    routes = load_routes()
+    import track
+
+    reuse_port = sock is None and hasattr(socket, 'SO_REUSEPORT')
+    server = BoundedThreadingServer((host, port), routes, threads, queue_size, reuse_port, sock)
+    metrics_server = None
+    if metrics_port:
+        metrics_server = BoundedThreadingServer((host, metrics_port), metrics_routes(), threads=1,
+                                                queue_size=8, reuse_port=False)
+        threading.Thread(target=metrics_server.serve_forever, name='metrics', daemon=True).start()
+
+    def stop(signum, frame):
+        # shutdown() espera a serve_forever: se llama desde otro hilo
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    obs.info("Worker listening", pid=os.getpid(), port=server.server_address[1], threads=threads,
+             queue_size=queue_size, metrics_port=metrics_port or None)
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        # Primero el backlog, después cerrar: lo que llegue entre medias es lo único que se pierde
+        backlog = server.accept_backlog()
+        server.server_close()
+        drained = server.drain(drain_timeout)
+        if not drained:
+            obs.warn("Drain timeout, requests still in flight", in_flight=server.in_flight)
+        track.drain_pending_work()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+            metrics_server.drain(1)
+        obs.info("Worker stopped", pid=os.getpid(), drained=drained, backlog=backlog)
+
+
+def listen_socket(host: str, port: int) -> socket.socket:
+    """Socket compartido por fork cuando no hay SO_REUSEPORT"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(BoundedThreadingServer.request_queue_size)
+    return sock
+
+
+def serve(host: str = SERVER_HOST, port: int = SERVER_PORT, workers: int = SERVER_WORKERS,
+          threads: int = SERVER_THREADS, queue_size: int = SERVER_QUEUE_SIZE,
+          drain_timeout: float = SERVER_DRAIN_TIMEOUT, metrics_port: int = SERVER_METRICS_PORT):
+    """Proceso padre: arranca los workers, reinicia los que mueren y reenvía SIGTERM/SIGINT"""
+    workers = max(1, workers)
+    sock = None if hasattr(socket, 'SO_REUSEPORT') else listen_socket(host, port)
+    children = {}   # pid -> (arranque, índice del worker)
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                # El índice se conserva al reiniciar: el puerto de métricas del worker no cambia
+                run_worker(host, port, threads, queue_size, drain_timeout, sock,
+                           metrics_port + index if metrics_port else 0)
+            except Exception as e:
+                obs.error("Worker crashed", error=str(e))
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = (time.monotonic(), index)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        spawn(index)
+    obs.info("Server started", host=host, port=port, workers=workers,
+             reuse_port=sock is None, metrics_port=metrics_port or None)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        child = children.pop(pid, None)
+        if child is None or stopping:
+            continue
+        started, index = child
+        obs.error("Worker exited, restarting", pid=pid, status=status)
+        # Evitar un bucle de reinicios si el worker muere al arrancar
+        if time.monotonic() - started < 1:
+            time.sleep(1)
+        if not stopping:
+            spawn(index)
+    obs.info("Server stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor multi-proceso para los handlers de api/')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS)
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS)
+    parser.add_argument('--queue-size', type=int, default=SERVER_QUEUE_SIZE)
+    parser.add_argument('--drain-timeout', type=float, default=SERVER_DRAIN_TIMEOUT)
+    parser.add_argument('--metrics-port', type=int, default=SERVER_METRICS_PORT,
+                        help='Métricas del worker i en este puerto + i (0 = solo en el puerto público)')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.threads, args.queue_size, args.drain_timeout,
+          args.metrics_port)
+
+
+if __name__ == '__main__':
+    main()
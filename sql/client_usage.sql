@@ -0,0 +1,33 @@
+-- Uso mensual de eventos por cliente (límite mensual en api/_quota.py)
+-- Requiere clients.monthly_event_limit (NULL = sin límite)
+
+alter table clients add column if not exists monthly_event_limit bigint;
+
+create table if not exists client_usage (
+    client_id text not null,
+    period date not null,
+    event_count bigint not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (client_id, period)
+);
+
+-- Suma por lotes los incrementos de una instancia y devuelve el total global y el límite.
+-- p_increments: [{"client_id": "...", "count": 12}, ...] (count 0 = solo consultar)
+create or replace function increment_client_usage(p_period date, p_increments jsonb)
+returns table (client_id text, event_count bigint, monthly_event_limit bigint)
+language sql
+as $$
+    with inc as (
+        select i->>'client_id' as client_id, (i->>'count')::bigint as n
+        from jsonb_array_elements(p_increments) as i
+    ), upserted as (
+        insert into client_usage as u (client_id, period, event_count, updated_at)
+        select inc.client_id, p_period, inc.n, now() from inc
+        on conflict (client_id, period)
+        do update set event_count = u.event_count + excluded.event_count, updated_at = now()
+        returning u.client_id, u.event_count
+    )
+    select upserted.client_id, upserted.event_count, c.monthly_event_limit
+    from upserted
+    left join clients c on c.client_id::text = upserted.client_id;
+$$;
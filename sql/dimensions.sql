@@ -0,0 +1,86 @@
+-- Modo compacto de events_raw (DIMENSIONS_ENABLED, api/_dimensions.py): los campos de texto repetitivos
+-- se guardan una vez en dimension_values y cada fila lleva <campo>_id. Las filas antiguas (y las que se
+-- insertan sin ids si falla el registro) conservan el texto; events_decoded une ambos casos.
+
+create table if not exists dimension_values (
+    id integer generated by default as identity primary key,
+    dimension text not null,   -- nombre del campo de events_raw (user_agent, browser, os...)
+    value text not null,
+    unique (dimension, value)
+);
+
+-- Sin claves foráneas: los ids solo salen de register_dimension_values y así el INSERT no las comprueba
+alter table events_raw add column if not exists user_agent_id integer;
+alter table events_raw add column if not exists browser_id integer;
+alter table events_raw add column if not exists browser_version_id integer;
+alter table events_raw add column if not exists os_id integer;
+alter table events_raw add column if not exists os_version_id integer;
+alter table events_raw add column if not exists device_type_id integer;
+alter table events_raw add column if not exists language_id integer;
+alter table events_raw add column if not exists timezone_id integer;
+alter table events_raw add column if not exists screen_resolution_id integer;
+
+-- En modo compacto las columnas de texto llegan a NULL
+do $$
+declare
+    field text;
+begin
+    foreach field in array array['user_agent', 'browser', 'browser_version', 'os', 'os_version',
+                                 'device_type', 'language', 'timezone', 'screen_resolution'] loop
+        if exists (select 1 from information_schema.columns
+                   where table_name = 'events_raw' and column_name = field) then
+            execute format('alter table events_raw alter column %I drop not null', field);
+        end if;
+    end loop;
+end $$;
+
+-- Registro por lotes: p_values = [["browser", "Chrome"], ["os", "iOS"], ...]
+-- Inserta los que falten y devuelve el id de todos. El select va en otra sentencia para ver también
+-- los valores que otra instancia haya registrado a la vez (on conflict do nothing no los devuelve).
+create or replace function register_dimension_values(p_values jsonb)
+returns table (dimension text, value text, id integer)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+    insert into dimension_values (dimension, value)
+    select distinct x->>0, x->>1
+    from jsonb_array_elements(p_values) as x
+    order by 1, 2
+    on conflict (dimension, value) do nothing;
+
+    return query
+    select d.dimension, d.value, d.id
+    from dimension_values d
+    join (select distinct x->>0 as dimension, x->>1 as value
+          from jsonb_array_elements(p_values) as x) as v
+      on d.dimension = v.dimension and d.value = v.value;
+end;
+$$;
+
+-- events_raw con el texto de las dimensiones, venga de la fila o de dimension_values
+create or replace view events_decoded as
+select e.*,
+       coalesce(e.user_agent, ua.value) as user_agent_text,
+       coalesce(e.browser, br.value) as browser_text,
+       coalesce(e.browser_version, bv.value) as browser_version_text,
+       coalesce(e.os, os.value) as os_text,
+       coalesce(e.os_version, ov.value) as os_version_text,
+       coalesce(e.device_type, dt.value) as device_type_text,
+       coalesce(e.language, lg.value) as language_text,
+       coalesce(e.timezone, tz.value) as timezone_text,
+       coalesce(e.screen_resolution, sr.value) as screen_resolution_text
+from events_raw e
+left join dimension_values ua on ua.id = e.user_agent_id
+left join dimension_values br on br.id = e.browser_id
+left join dimension_values bv on bv.id = e.browser_version_id
+left join dimension_values os on os.id = e.os_id
+left join dimension_values ov on ov.id = e.os_version_id
+left join dimension_values dt on dt.id = e.device_type_id
+left join dimension_values lg on lg.id = e.language_id
+left join dimension_values tz on tz.id = e.timezone_id
+left join dimension_values sr on sr.id = e.screen_resolution_id;
+
+-- Ejemplo: navegadores más usados sin unir por fila
+--   select d.value, count(*) from events_raw e join dimension_values d on d.id = e.browser_id
+--   where e.project_id = $1 group by d.value order by 2 desc;
@@ -0,0 +1,15 @@
+-- events_raw: los INSERT usan on_conflict=event_id con resolution=ignore-duplicates,
+-- así que un evento reenviado (reintentos del píxel, spool, /api/ingest) no se duplica ni falla.
+-- Requiere una restricción UNIQUE sobre event_id (si no es ya la clave primaria).
+
+create unique index if not exists events_raw_event_id_key on events_raw (event_id);
+
+-- Geolocalización (GEO_DB_PATH): país ISO 3166-1 alfa-2 y región, resueltos con la IP completa
+-- antes de anonimizarla. Solo se envían cuando GEO_DB_PATH está configurado.
+alter table events_raw add column if not exists country text;
+alter table events_raw add column if not exists region text;
+create index if not exists events_raw_project_country_idx on events_raw (project_id, country);
+
+-- Exportación (tools/export_events.py): paginación keyset por (processed_at, event_id), la marca que
+-- pone el servidor al aceptar el evento. Sin este índice cada página ordena events_raw entera.
+create index if not exists events_raw_processed_at_event_id_idx on events_raw (processed_at, event_id);
@@ -0,0 +1,100 @@
+-- Agregados por proyecto y franja horaria (api/_rollup.py), para no recorrer events_raw en los dashboards.
+-- users_hll / sessions_hll son sketches HyperLogLog densos: 4096 registros de 1 byte, hash blake2b de
+-- 64 bits calculado en Python. Se fusionan con hll_merge (máximo por registro) y se estiman con hll_count.
+
+create table if not exists events_rollup (
+    project_id text not null,
+    bucket timestamptz not null,
+    events bigint not null default 0,
+    pageviews bigint not null default 0,
+    bot_events bigint not null default 0,
+    purchases bigint not null default 0,
+    revenue jsonb not null default '{}',       -- {"EUR": 1234.5}
+    event_names jsonb not null default '{}',   -- eventos custom por event_name
+    users_hll bytea not null,
+    sessions_hll bytea not null,
+    updated_at timestamptz not null default now(),
+    primary key (project_id, bucket)
+);
+
+-- Unión de dos sketches: máximo registro a registro
+create or replace function hll_merge(a bytea, b bytea)
+returns bytea
+language sql immutable strict
+as $$
+    select decode(string_agg(lpad(to_hex(greatest(get_byte(a, i), get_byte(b, i))), 2, '0'), '' order by i), 'hex')
+    from generate_series(0, length(a) - 1) as i;
+$$;
+
+-- hll_union(users_hll): unión de varias franjas (p. ej. usuarios únicos del día)
+create or replace aggregate hll_union(bytea) (
+    sfunc = hll_merge,
+    stype = bytea
+);
+
+-- Cardinalidad estimada de un sketch (mismo estimador que HyperLogLog.count en Python)
+create or replace function hll_count(s bytea)
+returns bigint
+language sql immutable strict
+as $$
+    with registers as (
+        select get_byte(s, i) as rank from generate_series(0, length(s) - 1) as i
+    ), totals as (
+        select count(*)::float8 as m,
+               sum(power(2::float8, -rank)) as z,
+               count(*) filter (where rank = 0) as zeros
+        from registers
+    ), estimate as (
+        select m, zeros, (0.7213 / (1 + 1.079 / m)) * m * m / z as e from totals
+    )
+    select round(case when e <= 2.5 * m and zeros > 0 then m * ln(m / zeros) else e end)::bigint
+    from estimate;
+$$;
+
+-- Suma clave a clave de dos objetos {clave: número}
+create or replace function jsonb_sum_values(a jsonb, b jsonb)
+returns jsonb
+language sql immutable
+as $$
+    select coalesce(jsonb_object_agg(key, total), '{}'::jsonb)
+    from (
+        select key, sum(value::numeric) as total
+        from (
+            select * from jsonb_each_text(coalesce(a, '{}'::jsonb))
+            union all
+            select * from jsonb_each_text(coalesce(b, '{}'::jsonb))
+        ) as pairs
+        group by key
+    ) as sums;
+$$;
+
+-- Upsert por lotes de los parciales de una instancia (una fila por project_id + bucket)
+create or replace function merge_events_rollup(p_rows jsonb)
+returns void
+language sql
+as $$
+    insert into events_rollup as r (project_id, bucket, events, pageviews, bot_events, purchases,
+                                    revenue, event_names, users_hll, sessions_hll, updated_at)
+    select x->>'project_id', (x->>'bucket')::timestamptz,
+           (x->>'events')::bigint, (x->>'pageviews')::bigint, (x->>'bot_events')::bigint,
+           (x->>'purchases')::bigint, coalesce(x->'revenue', '{}'), coalesce(x->'event_names', '{}'),
+           decode(x->>'users_hll', 'base64'), decode(x->>'sessions_hll', 'base64'), now()
+    from jsonb_array_elements(p_rows) as x
+    on conflict (project_id, bucket) do update set
+        events = r.events + excluded.events,
+        pageviews = r.pageviews + excluded.pageviews,
+        bot_events = r.bot_events + excluded.bot_events,
+        purchases = r.purchases + excluded.purchases,
+        revenue = jsonb_sum_values(r.revenue, excluded.revenue),
+        event_names = jsonb_sum_values(r.event_names, excluded.event_names),
+        users_hll = hll_merge(r.users_hll, excluded.users_hll),
+        sessions_hll = hll_merge(r.sessions_hll, excluded.sessions_hll),
+        updated_at = now();
+$$;
+
+-- Ejemplos:
+--   pageviews por hora:   select bucket, pageviews from events_rollup where project_id = $1 order by bucket;
+--   usuarios únicos hoy:  select hll_count(hll_union(users_hll)) from events_rollup
+--                         where project_id = $1 and bucket >= date_trunc('day', now());
+--   ingresos por día:     select date_trunc('day', bucket) as day, key as currency, sum(value::numeric)
+--                         from events_rollup, jsonb_each_text(revenue) where project_id = $1 group by 1, 2;
@@ -0,0 +1,183 @@
+"""
+Formato columnar del archivo de events_raw (export_events.py escribe, query_events.py lee)
+
+<raíz>/project_id=<id>/date=<YYYY-MM-DD>/part-<seq>/
+    _meta.json          filas, rango de timestamps y tipo de cada columna
+    <col>.codes         columnas de texto repetitivo: códigos uint8/16/32 little-endian (0 = null)
+    <col>.dict.json.gz  diccionario de esas columnas (índice 0 = null)
+    <col>.i8            timestamps: int64 little-endian, ms desde epoch (null = INT64_MIN)
+    <col>.u1            booleanos: uint8 (null = 0)
+    <col>.jsonl.gz      objetos (custom_params, ecommerce_data), event_id y columnas no reconocidas
+
+Las columnas de ancho fijo se guardan sin comprimir para leerlas con mmap; la compresión viene del
+diccionario (un page_url de 200 bytes pasa a ocupar 2) y de gzip en diccionarios y JSON.
+"""
+
+import gzip
+import json
+import os
+import shutil
+import sys
+from array import array
+from datetime import datetime, timezone
+from urllib.parse import quote, unquote
+
+FORMAT_VERSION = 1
+
+TIMESTAMP_COLUMNS = frozenset(('timestamp', 'processed_at', 'created_at'))
+BOOL_COLUMNS = frozenset(('is_bot', 'is_mobile', 'is_tablet'))
+# Valores únicos por fila u objetos: el diccionario no aporta nada
+JSON_COLUMNS = frozenset(('event_id', 'custom_params', 'ecommerce_data'))
+
+NULL_TIMESTAMP = -(1 << 63)
+
+META_FILE = '_meta.json'
+PART_PREFIX = 'part-'
+
+
+def parse_timestamp_ms(value):
+    """ISO 8601 (sin zona = UTC) -> ms desde epoch; None si falta o no se entiende"""
+    if not value or value.__class__ is not str:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def day_of(timestamp_ms: int) -> str:
+    return datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+
+def project_dir_name(project_id: str) -> str:
+    return f'project_id={quote(str(project_id), safe="")}'
+
+
+def partition_dir(root: str, project_id: str, day: str) -> str:
+    return os.path.join(root, project_dir_name(project_id), f'date={day}')
+
+
+def project_of_dir(name: str) -> str:
+    return unquote(name[len('project_id='):])
+
+
+def part_name(seq: int) -> str:
+    return f'{PART_PREFIX}{seq:08d}'
+
+
+def part_seq(name: str):
+    """Número de secuencia de part-XXXXXXXX (None si no es un segmento)"""
+    if not name.startswith(PART_PREFIX):
+        return None
+    try:
+        return int(name[len(PART_PREFIX):])
+    except ValueError:
+        return None
+
+
+def _column_kind(name: str, values: list) -> str:
+    if name in TIMESTAMP_COLUMNS:
+        return 'ts'
+    if name in BOOL_COLUMNS:
+        return 'bool'
+    if name in JSON_COLUMNS:
+        return 'json'
+    for value in values:
+        if value is not None and value.__class__ is not str:
+            return 'json'
+    return 'dict'
+
+
+def _write_array(path: str, values: array):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    with open(path, 'wb') as f:
+        values.tofile(f)
+
+
+def _write_dict_column(directory: str, name: str, values: list) -> dict:
+    codes_by_value = {None: 0}
+    dictionary = [None]
+    codes = []
+    for value in values:
+        code = codes_by_value.get(value)
+        if code is None:
+            code = codes_by_value[value] = len(dictionary)
+            dictionary.append(value)
+        codes.append(code)
+    size = len(dictionary)
+    typecode, dtype = ('B', 'u1') if size <= 0xFF else ('H', 'u2') if size <= 0xFFFF else ('I', 'u4')
+    _write_array(os.path.join(directory, f'{name}.codes'), array(typecode, codes))
+    with gzip.open(os.path.join(directory, f'{name}.dict.json.gz'), 'wt', encoding='utf-8') as f:
+        json.dump(dictionary, f, ensure_ascii=False, separators=(',', ':'))
+    return {'kind': 'dict', 'dtype': dtype, 'cardinality': size - 1}
+
+
+def write_segment(directory: str, rows: list) -> dict:
+    """
+    Escribe las filas como un segmento nuevo (directorio temporal + rename, nunca queda a medias)
+    Retorna el _meta.json escrito
+    """
+    tmp = directory + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    names = {}
+    for row in rows:
+        for name in row:
+            names[name] = None
+
+    columns = {}
+    timestamps = []
+    for name in names:
+        values = [row.get(name) for row in rows]
+        kind = _column_kind(name, values)
+        if kind == 'ts':
+            parsed = [parse_timestamp_ms(v) for v in values]
+            if name == 'timestamp':
+                timestamps = [t for t in parsed if t is not None]
+            _write_array(os.path.join(tmp, f'{name}.i8'),
+                         array('q', [NULL_TIMESTAMP if v is None else v for v in parsed]))
+            columns[name] = {'kind': 'ts', 'dtype': 'i8'}
+        elif kind == 'bool':
+            _write_array(os.path.join(tmp, f'{name}.u1'), array('B', [1 if v else 0 for v in values]))
+            columns[name] = {'kind': 'bool', 'dtype': 'u1'}
+        elif kind == 'dict':
+            columns[name] = _write_dict_column(tmp, name, values)
+        else:
+            with gzip.open(os.path.join(tmp, f'{name}.jsonl.gz'), 'wt', encoding='utf-8') as f:
+                for value in values:
+                    f.write(json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+                    f.write('\n')
+            columns[name] = {'kind': 'json'}
+
+    meta = {
+        'version': FORMAT_VERSION,
+        'rows': len(rows),
+        'min_timestamp': min(timestamps) if timestamps else None,
+        'max_timestamp': max(timestamps) if timestamps else None,
+        'columns': columns
+    }
+    with open(os.path.join(tmp, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    os.rename(tmp, directory)
+    return meta
+
+
+def read_meta(directory: str) -> dict:
+    with open(os.path.join(directory, META_FILE)) as f:
+        return json.load(f)
+
+
+def read_dictionary(directory: str, name: str) -> list:
+    with gzip.open(os.path.join(directory, f'{name}.dict.json.gz'), 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_json_column(directory: str, name: str) -> list:
+    with gzip.open(os.path.join(directory, f'{name}.jsonl.gz'), 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
@@ -0,0 +1,216 @@
+"""
+Exporta events_raw a un archivo columnar particionado por project_id y día (formato en _columnar.py)
+
+Lee con paginación keyset sobre (processed_at, event_id), nunca con OFFSET, y continúa desde la
+última marca exportada (_export_state.json en la raíz del archivo). processed_at lo pone el servidor
+al aceptar el evento, así que los eventos con timestamp del cliente atrasado (backfills de /api/ingest,
+relojes desajustados) también se exportan, en la partición del día de su timestamp. Solo exporta
+eventos procesados antes de ahora - --lag, para que los que tardan en llegar a events_raw (spool)
+no se pierdan detrás de la marca. Usa el índice de sql/events_raw.sql.
+
+Las filas guardadas en modo compacto (DIMENSIONS_ENABLED) se exportan con el texto de dimension_values,
+igual que las demás.
+
+Uso:
+    SUPABASE_URL=... SUPABASE_SERVICE_KEY=... python tools/export_events.py --out archive/
+    python tools/export_events.py --out archive/ --project <project_id> --lag 7200
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from _columnar import day_of, parse_timestamp_ms, partition_dir, part_name, part_seq, write_segment
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+from _dimensions import DimensionEncoder, fetch_dimension_values
+from _supabase import SupabaseClient
+
+STATE_FILE = '_export_state.json'
+
+PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '5000'))
+# Filas acumuladas (entre todas las particiones) antes de escribir segmentos y avanzar la marca
+SEGMENT_ROWS = int(os.environ.get('EXPORT_SEGMENT_ROWS', '200000'))
+# Segundos hacia atrás desde ahora que aún no se exportan
+EXPORT_LAG = int(os.environ.get('EXPORT_LAG', '3600'))
+
+
+def _quote(value: str) -> str:
+    """Valor entre comillas para filtros PostgREST (timestamps llevan ':' y '.')"""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def keyset_params(watermark: dict, until: str, projects: list, page_size: int) -> dict:
+    """Filtros de la siguiente página: (processed_at, event_id) > marca y processed_at < until"""
+    params = {
+        'select': '*',
+        'order': 'processed_at.asc,event_id.asc',
+        'limit': str(page_size),
+        'processed_at': f'lt.{until}'
+    }
+    if watermark:
+        ts, event_id = _quote(watermark['processed_at']), _quote(watermark['event_id'])
+        params['or'] = f'(processed_at.gt.{ts},and(processed_at.eq.{ts},event_id.gt.{event_id}))'
+    if projects:
+        params['project_id'] = 'in.(' + ','.join(_quote(p) for p in projects) + ')'
+    return params
+
+
+def watermark_of(row: dict) -> dict:
+    """Marca keyset de la última fila leída"""
+    return {'processed_at': row['processed_at'], 'event_id': row['event_id']}
+
+
+def state_key(projects: list) -> str:
+    return ','.join(sorted(projects)) if projects else '*'
+
+
+def load_state(root: str) -> dict:
+    path = os.path.join(root, STATE_FILE)
+    if not os.path.exists(path):
+        return {'next_part': 1, 'watermarks': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(root: str, state: dict):
+    """Escritura atómica: el estado nunca apunta a segmentos que no existen"""
+    path = os.path.join(root, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def remove_orphans(root: str, next_part: int) -> int:
+    """Borra segmentos escritos después del último estado guardado (exportación interrumpida)"""
+    removed = 0
+    for directory, subdirs, _ in os.walk(root):
+        for name in list(subdirs):
+            seq = part_seq(name[:-4] if name.endswith('.tmp') else name)
+            if seq is None:
+                continue
+            subdirs.remove(name)
+            if name.endswith('.tmp') or seq >= next_part:
+                shutil.rmtree(os.path.join(directory, name))
+                removed += 1
+    return removed
+
+
+class Exporter:
+    """Pagina events_raw y escribe un segmento por partición cada SEGMENT_ROWS filas"""
+
+    def __init__(self, client, root: str, projects: list = None, page_size: int = PAGE_SIZE,
+                 segment_rows: int = SEGMENT_ROWS, lag: int = EXPORT_LAG):
+        self.client = client
+        self.root = root
+        self.projects = list(projects or [])
+        self.page_size = page_size
+        self.segment_rows = segment_rows
+        self.lag = lag
+        self.state = load_state(root)
+        self.key = state_key(self.projects)
+        others = set(self.state['watermarks']) - {self.key}
+        if others:
+            # Otro filtro de proyectos sobre el mismo directorio duplicaría filas en las consultas
+            raise ValueError(f"{root} already holds an export for other projects ({'; '.join(sorted(others))})")
+        self.watermark = self.state['watermarks'].get(self.key)
+        if self.watermark and 'processed_at' not in self.watermark:
+            # Marca de versiones que paginaban por timestamp: no se puede traducir a processed_at
+            raise ValueError(f"{root} was exported by event timestamp; export again to a new directory")
+        self.dimensions = DimensionEncoder(resolve_fn=lambda ids: fetch_dimension_values(client, ids))
+        self._buffers = {}
+        self._buffered = 0
+        self.rows = 0
+        self.pages = 0
+        self.segments = 0
+
+    def fetch_page(self, until: str) -> list:
+        params = keyset_params(self.watermark, until, self.projects, self.page_size)
+        response = self.client.select('events_raw', params)
+        if response.status_code != 200:
+            raise RuntimeError(f"events_raw returned {response.status_code}: {response.text}")
+        return self.dimensions.decode(response.json())
+
+    def add(self, rows: list):
+        for row in rows:
+            timestamp = parse_timestamp_ms(row.get('timestamp'))
+            day = day_of(timestamp) if timestamp is not None else 'unknown'
+            key = (str(row.get('project_id')), day)
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = []
+            buffer.append(row)
+        self._buffered += len(rows)
+        self.rows += len(rows)
+        self.watermark = watermark_of(rows[-1])
+
+    def flush(self):
+        """Escribe los segmentos pendientes y, después, avanza la marca"""
+        for (project_id, day), rows in sorted(self._buffers.items()):
+            directory = partition_dir(self.root, project_id, day)
+            os.makedirs(directory, exist_ok=True)
+            write_segment(os.path.join(directory, part_name(self.state['next_part'])), rows)
+            self.state['next_part'] += 1
+            self.segments += 1
+        self._buffers = {}
+        self._buffered = 0
+        if self.watermark:
+            self.state['watermarks'][self.key] = self.watermark
+        save_state(self.root, self.state)
+
+    def run(self) -> dict:
+        os.makedirs(self.root, exist_ok=True)
+        remove_orphans(self.root, self.state['next_part'])
+        until = (datetime.now(timezone.utc) - timedelta(seconds=self.lag)).isoformat()
+        start = time.perf_counter()
+        while True:
+            rows = self.fetch_page(until)
+            self.pages += 1
+            if rows:
+                self.add(rows)
+            last_page = len(rows) < self.page_size
+            if self._buffered >= self.segment_rows or (last_page and self._buffered):
+                self.flush()
+            if last_page:
+                break
+        return {
+            'rows': self.rows,
+            'pages': self.pages,
+            'segments': self.segments,
+            'watermark': self.watermark,
+            'seconds': round(time.perf_counter() - start, 2)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporta events_raw a un archivo columnar particionado')
+    parser.add_argument('--out', required=True, help='Directorio raíz del archivo')
+    parser.add_argument('--project', action='append', default=[], help='project_id a exportar (repetible; default: todos)')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--segment-rows', type=int, default=SEGMENT_ROWS)
+    parser.add_argument('--lag', type=int, default=EXPORT_LAG, help='Segundos recientes que no se exportan aún')
+    args = parser.parse_args()
+
+    url, key = os.environ.get('SUPABASE_URL'), os.environ.get('SUPABASE_SERVICE_KEY')
+    if not url or not key:
+        parser.error('SUPABASE_URL and SUPABASE_SERVICE_KEY are required')
+    # Páginas grandes: más margen de lectura que en los handlers
+    client = SupabaseClient(url, key, read_timeout=60)
+    try:
+        exporter = Exporter(client, args.out, args.project, args.page_size, args.segment_rows, args.lag)
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(exporter.run()))
+
+
+if __name__ == '__main__':
+    main()
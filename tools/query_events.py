@@ -0,0 +1,334 @@
+"""
+Consultas locales sobre el archivo columnar de export_events.py: conteos, únicos, top y embudos
+
+Las columnas de ancho fijo se leen con mmap como arrays de NumPy y los filtros se evalúan sobre los
+códigos del diccionario, sin decodificar strings. Se descartan sin abrirlas las particiones fuera
+del rango de fechas y los segmentos cuyo rango de timestamps o diccionario no encaja con el filtro.
+Requiere numpy (pip install -r tools/requirements.txt).
+
+    archive = Archive('archive/')
+    archive.count('<project_id>', '2026-01-01', '2026-02-01', where={'event_type': 'pageview'})
+    archive.uniques('<project_id>', 'user_id', '2026-01-01')
+    archive.top('<project_id>', 'browser', limit=5)
+    archive.funnel('<project_id>', ['pageview', 'add_to_cart', 'purchase'], window=3600)
+
+Uso: python tools/query_events.py archive/ count --project <id> --from 2026-01-01 --where event_type=pageview
+"""
+
+import argparse
+import json
+import os
+from collections import Counter
+from datetime import datetime, timezone
+
+import numpy as np
+
+from _columnar import (META_FILE, NULL_TIMESTAMP, part_seq, project_dir_name, project_of_dir,
+                       read_dictionary, read_json_column, read_meta)
+
+_MAX_TIMESTAMP = np.iinfo(np.int64).max
+
+
+def _to_ms(value):
+    """'2026-01-01', date, datetime o ms -> ms desde epoch (UTC); None = sin límite"""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def _day(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+
+class Segment:
+    """Un part-XXXXXXXX: columnas mapeadas en memoria bajo demanda"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.meta = read_meta(path)
+        self.rows = self.meta['rows']
+        self.columns = self.meta['columns']
+        self._arrays = {}
+        self._dictionaries = {}
+        self._codes = {}
+
+    def kind(self, name: str):
+        column = self.columns.get(name)
+        return column['kind'] if column else None
+
+    def array(self, name: str) -> np.ndarray:
+        """Columna de ancho fijo (códigos, timestamps o booleanos); una columna ausente es toda null"""
+        data = self._arrays.get(name)
+        if data is None:
+            column = self.columns.get(name)
+            if column is None:
+                data = np.zeros(self.rows, dtype=np.uint8)
+            else:
+                kind = column['kind']
+                if kind == 'json':
+                    raise ValueError(f"Column {name} is not a fixed-width column")
+                suffix = 'codes' if kind == 'dict' else column['dtype']
+                data = np.memmap(os.path.join(self.path, f'{name}.{suffix}'), dtype='<' + column['dtype'],
+                                 mode='r', shape=(self.rows,))
+            self._arrays[name] = data
+        return data
+
+    def dictionary(self, name: str) -> list:
+        values = self._dictionaries.get(name)
+        if values is None:
+            values = read_dictionary(self.path, name) if self.kind(name) == 'dict' else [None]
+            self._dictionaries[name] = values
+        return values
+
+    def codes(self, name: str, values) -> list:
+        """Códigos de estos valores en el diccionario del segmento (los que no aparecen se omiten)"""
+        index = self._codes.get(name)
+        if index is None:
+            index = self._codes[name] = {value: code for code, value in enumerate(self.dictionary(name))}
+        return [index[value] for value in values if value in index]
+
+    def json_column(self, name: str) -> list:
+        return read_json_column(self.path, name) if name in self.columns else [None] * self.rows
+
+    def mask(self, start_ms=None, end_ms=None, where: dict = None):
+        """Filas que cumplen el rango [start, end) y los filtros; None si ninguna puede cumplirlos"""
+        low, high = self.meta.get('min_timestamp'), self.meta.get('max_timestamp')
+        if low is not None:
+            if (start_ms is not None and high < start_ms) or (end_ms is not None and low >= end_ms):
+                return None
+
+        mask = np.ones(self.rows, dtype=bool)
+        if start_ms is not None or end_ms is not None:
+            timestamps = self.array('timestamp')
+            if start_ms is not None and (low is None or low < start_ms):
+                mask &= timestamps >= start_ms
+            if end_ms is not None and (high is None or high >= end_ms):
+                mask &= timestamps < end_ms
+
+        for name, expected in (where or {}).items():
+            values = list(expected) if isinstance(expected, (list, tuple, set, frozenset)) else [expected]
+            kind = self.kind(name)
+            if kind == 'bool':
+                column = self.array(name).astype(bool)
+                wanted = {v if v.__class__ is bool else str(v).lower() in ('1', 'true') for v in values}
+                if len(wanted) == 1:
+                    mask &= column if True in wanted else ~column
+                continue
+            if kind not in ('dict', None):
+                raise ValueError(f"Column {name} cannot be filtered (kind {kind})")
+            codes = self.codes(name, values)
+            if not codes:
+                # Ningún valor buscado aparece en el diccionario: se descarta el segmento entero
+                return None
+            column = self.array(name)
+            mask &= (column == codes[0]) if len(codes) == 1 else np.isin(column, codes)
+        return mask
+
+
+class Archive:
+    """Consultas sobre <raíz>/project_id=*/date=*/part-* con poda por partición y segmento"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._segments = {}
+
+    def projects(self) -> list:
+        return sorted(project_of_dir(name) for name in os.listdir(self.root) if name.startswith('project_id='))
+
+    def segments(self, project_id: str, start=None, end=None) -> list:
+        """Segmentos del proyecto cuyas particiones de día caen en [start, end)"""
+        project_path = os.path.join(self.root, project_dir_name(project_id))
+        if not os.path.isdir(project_path):
+            return []
+        start_ms, end_ms = _to_ms(start), _to_ms(end)
+        first_day = _day(start_ms) if start_ms is not None else None
+        last_day = _day(end_ms - 1) if end_ms is not None else None
+
+        segments = []
+        for partition in sorted(os.listdir(project_path)):
+            if not partition.startswith('date='):
+                continue
+            day = partition[len('date='):]
+            if day != 'unknown' and ((first_day and day < first_day) or (last_day and day > last_day)):
+                continue
+            partition_path = os.path.join(project_path, partition)
+            for name in sorted(os.listdir(partition_path)):
+                path = os.path.join(partition_path, name)
+                if part_seq(name) is None or not os.path.exists(os.path.join(path, META_FILE)):
+                    continue
+                segment = self._segments.get(path)
+                if segment is None:
+                    segment = self._segments[path] = Segment(path)
+                segments.append(segment)
+        return segments
+
+    def _scan(self, project_id: str, start, end, where):
+        start_ms, end_ms = _to_ms(start), _to_ms(end)
+        for segment in self.segments(project_id, start, end):
+            mask = segment.mask(start_ms, end_ms, where)
+            if mask is not None:
+                yield segment, mask
+
+    def count(self, project_id: str, start=None, end=None, where: dict = None) -> int:
+        return int(sum(np.count_nonzero(mask) for _, mask in self._scan(project_id, start, end, where)))
+
+    def uniques(self, project_id: str, column: str = 'user_id', start=None, end=None,
+                where: dict = None) -> int:
+        """Valores distintos exactos (sin contar null) de una columna de diccionario"""
+        seen = set()
+        for segment, mask in self._scan(project_id, start, end, where):
+            codes = segment.array(column)[mask]
+            if not codes.size:
+                continue
+            dictionary = segment.dictionary(column)
+            present = np.flatnonzero(np.bincount(codes, minlength=len(dictionary)))
+            seen.update(dictionary[code] for code in present if code)
+        return len(seen)
+
+    def top(self, project_id: str, column: str, start=None, end=None, where: dict = None,
+            limit: int = 10) -> list:
+        """[(valor, eventos), ...] ordenado de mayor a menor"""
+        totals = Counter()
+        for segment, mask in self._scan(project_id, start, end, where):
+            codes = segment.array(column)[mask]
+            if not codes.size:
+                continue
+            dictionary = segment.dictionary(column)
+            counts = np.bincount(codes, minlength=len(dictionary))
+            for code in np.flatnonzero(counts):
+                totals[dictionary[code]] += int(counts[code])
+        return totals.most_common(limit)
+
+    def funnel(self, project_id: str, steps: list, start=None, end=None, where: dict = None,
+               by: str = 'user_id', step_column: str = 'event_name', window: float = None) -> list:
+        """
+        Cuántos `by` (usuarios) completan cada paso en orden: el paso k cuenta si ocurre después
+        del primer paso k-1 y, con window (segundos), dentro de ese tiempo desde el primer paso 1
+        """
+        members, times, step_of = [], [], []
+        ids = {}
+        for segment, mask in self._scan(project_id, start, end, where):
+            dictionary = segment.dictionary(step_column)
+            lookup = np.full(len(dictionary), -1, dtype=np.int16)
+            for index, step in enumerate(steps):
+                for code in segment.codes(step_column, [step]):
+                    lookup[code] = index
+            step_index = lookup[segment.array(step_column)]
+            selected = mask & (step_index >= 0)
+            if not selected.any():
+                continue
+            # Códigos locales del segmento -> ids globales de `by`
+            global_ids = np.fromiter((ids.setdefault(v, len(ids)) for v in segment.dictionary(by)),
+                                     dtype=np.int64)
+            members.append(global_ids[segment.array(by)[selected]])
+            times.append(segment.array('timestamp')[selected])
+            step_of.append(step_index[selected])
+
+        if not members:
+            return [0] * len(steps)
+        members = np.concatenate(members)
+        times = np.concatenate(times)
+        step_of = np.concatenate(step_of)
+        # El id del valor null nunca cuenta
+        valid = members != ids.get(None, -1)
+        valid &= times != NULL_TIMESTAMP
+
+        counts = []
+        reached = first = None
+        for index in range(len(steps)):
+            selected = valid & (step_of == index)
+            member, ts = members[selected], times[selected]
+            if reached is not None:
+                previous = reached[member]
+                ok = ts >= previous
+                if window is not None:
+                    ok &= ts <= first[member] + int(window * 1000)
+                ok &= previous != _MAX_TIMESTAMP
+                member, ts = member[ok], ts[ok]
+            current = np.full(len(ids), _MAX_TIMESTAMP, dtype=np.int64)
+            np.minimum.at(current, member, ts)
+            if first is None:
+                first = current
+            reached = current
+            counts.append(int(np.count_nonzero(current != _MAX_TIMESTAMP)))
+        return counts
+
+    def rows(self, project_id: str, start=None, end=None, where: dict = None, columns: list = None):
+        """Filas completas (dicts) que cumplen el filtro, para inspección"""
+        for segment, mask in self._scan(project_id, start, end, where):
+            indexes = np.flatnonzero(mask)
+            if not indexes.size:
+                continue
+            names = columns or list(segment.columns)
+            decoded = {}
+            for name in names:
+                kind = segment.kind(name)
+                if kind == 'json':
+                    values = segment.json_column(name)
+                    decoded[name] = [values[i] for i in indexes]
+                elif kind == 'dict':
+                    dictionary = segment.dictionary(name)
+                    decoded[name] = [dictionary[c] for c in segment.array(name)[indexes]]
+                elif kind == 'bool':
+                    decoded[name] = [bool(v) for v in segment.array(name)[indexes]]
+                elif kind == 'ts':
+                    decoded[name] = [None if v == NULL_TIMESTAMP else
+                                     datetime.fromtimestamp(v / 1000, timezone.utc).isoformat()
+                                     for v in segment.array(name)[indexes].tolist()]
+                else:
+                    decoded[name] = [None] * len(indexes)
+            for i in range(len(indexes)):
+                yield {name: decoded[name][i] for name in names}
+
+
+def _parse_where(items: list) -> dict:
+    where = {}
+    for item in items:
+        name, _, value = item.partition('=')
+        where[name] = value.split(',') if ',' in value else value
+    return where
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Consultas sobre el archivo columnar de events_raw')
+    parser.add_argument('root')
+    parser.add_argument('query', choices=['count', 'uniques', 'top', 'funnel', 'projects'])
+    parser.add_argument('--project')
+    parser.add_argument('--from', dest='start', help='Inicio (incluido), p. ej. 2026-01-01')
+    parser.add_argument('--to', dest='end', help='Fin (excluido)')
+    parser.add_argument('--where', action='append', default=[], help='columna=valor[,valor...] (repetible)')
+    parser.add_argument('--column', default='user_id', help='Columna de uniques/top')
+    parser.add_argument('--steps', help='Pasos del embudo separados por comas (valores de event_name)')
+    parser.add_argument('--window', type=float, help='Segundos máximos del embudo desde el primer paso')
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    archive = Archive(args.root)
+    if args.query == 'projects':
+        print(json.dumps(archive.projects()))
+        return
+    if not args.project:
+        parser.error('--project is required')
+    where = _parse_where(args.where)
+    if args.query == 'count':
+        result = archive.count(args.project, args.start, args.end, where)
+    elif args.query == 'uniques':
+        result = archive.uniques(args.project, args.column, args.start, args.end, where)
+    elif args.query == 'top':
+        result = archive.top(args.project, args.column, args.start, args.end, where, args.limit)
+    else:
+        if not args.steps:
+            parser.error('--steps is required for funnel')
+        result = archive.funnel(args.project, args.steps.split(','), args.start, args.end, where,
+                                window=args.window)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()